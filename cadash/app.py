@@ -6,17 +6,23 @@ from flask_restful import Api
 
 from cadash import castatus
 from cadash import inventory
+from cadash import metrics
 from cadash import public
 from cadash import redunlive
+from cadash import tracing
 from cadash.assets import assets
 from cadash.extensions import bcrypt
 from cadash.extensions import cache
 from cadash.extensions import db
 from cadash.extensions import debug_toolbar
+from cadash.extensions import http_sessions
 from cadash.extensions import ldap_cli
 from cadash.extensions import login_manager
 from cadash.extensions import migrate
 from cadash.inventory.resources import register_resources
+from cadash.redunlive.poller import set_channel_max_workers
+from cadash.redunlive.resources import register_resources as register_redunlive_resources
+from cadash.redunlive.worker import start_fleet_poller
 from cadash.settings import Config
 from cadash.utils import setup_logging
 
@@ -39,6 +45,7 @@ def create_app(config_object=None, app_name=__name__):
     register_extensions(app)
     register_blueprints(app)
     register_errorhandlers(app)
+    register_workers(app)
     return app
 
 
@@ -55,9 +62,22 @@ def register_extensions(app):
     # ldap cli for authentication/authorization
     ldap_cli.init_app(app)
 
+    # keep-alive http sessions for ca_stats and capture agents
+    http_sessions.init_app(app)
+
+    # pool for concurrent requests to channels of a device
+    set_channel_max_workers(app.config['REDUNLIVE_CHANNEL_WORKERS'])
+
+    # counters and histograms of this worker, flushed to app cache
+    metrics.registry.init_app(app)
+
+    # timed spans per request, to logs and Server-Timing header
+    tracing.init_app(app)
+
     # flask-restful initialization
     api = Api(app)
     register_resources(api)
+    register_redunlive_resources(api)
     return None
 
 
@@ -67,6 +87,14 @@ def register_blueprints(app):
     app.register_blueprint(redunlive.views.blueprint)
     app.register_blueprint(castatus.views.blueprint)
     app.register_blueprint(inventory.views.blueprint)
+    app.register_blueprint(metrics.blueprint)
+    return None
+
+
+def register_workers(app):
+    """Start background workers, if configured to run in-process."""
+    if app.config['REDUNLIVE_POLLER_THREAD']:
+        start_fleet_poller(app)
     return None
 
 
@@ -3,6 +3,8 @@
 import sys
 
 PY2 = int(sys.version[0]) == 2
+# async/await, as used by cadash.redunlive.aio
+ASYNCIO = sys.version_info[:2] >= (3, 5)
 
 if PY2:
     text_type = unicode  # noqa
@@ -10,9 +12,13 @@ if PY2:
     string_types = (str, unicode)  # noqa
     unicode = unicode  # noqa
     basestring = basestring  # noqa
+    from urlparse import urljoin  # noqa
+    from urlparse import urlparse  # noqa
 else:
     text_type = str
     binary_type = bytes
     string_types = (str,)
     unicode = str
     basestring = (str, bytes)
+    from urllib.parse import urljoin  # noqa
+    from urllib.parse import urlparse  # noqa
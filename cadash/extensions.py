@@ -6,6 +6,7 @@ from flask_debugtoolbar import DebugToolbarExtension
 from flask_login import LoginManager
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
+from cadash.http_sessions import SessionPool
 from cadash.ldap import LdapClient
 
 bcrypt = Bcrypt()
@@ -15,3 +16,4 @@ migrate = Migrate()
 cache = Cache()
 debug_toolbar = DebugToolbarExtension()
 ldap_cli = LdapClient()
+http_sessions = SessionPool()
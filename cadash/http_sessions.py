@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""pool of keep-alive http sessions, shared by the whole process."""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from cadash.compat import urlparse
+
+
+class SessionPool(object):
+    """
+    one requests.Session per host, so connections to a host are reused.
+
+    sessions are created on first use, after gunicorn forks its workers, and
+    are safe to use from multiple threads.
+    assumes that init_app() is called before any session is created.
+    """
+
+    def __init__(
+            self, pool_maxsize=10, connect_timeout=3.05, read_timeout=10,
+            retries=1, retry_backoff=0.2):
+        """create instance."""
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._pool_maxsize = pool_maxsize
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._retries = retries
+        self._retry_backoff = retry_backoff
+
+
+    def init_app(self, app):
+        """init session pool, with configs from app."""
+        self._pool_maxsize = app.config['HTTP_POOL_MAXSIZE']
+        self._connect_timeout = app.config['HTTP_CONNECT_TIMEOUT']
+        self._read_timeout = app.config['HTTP_READ_TIMEOUT']
+        self._retries = app.config['HTTP_RETRIES']
+        self._retry_backoff = app.config['HTTP_RETRY_BACKOFF']
+        self.clear()
+
+
+    @property
+    def timeout(self):
+        """(connect, read) timeouts, as expected by requests."""
+        return (self._connect_timeout, self._read_timeout)
+
+
+    def session(self, url):
+        """keep-alive session for host in `url`."""
+        u = urlparse(url)
+        key = '%s://%s' % (u.scheme, u.netloc)
+        session = self._sessions.get(key)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    session = self._create_session()
+                    self._sessions[key] = session
+        return session
+
+
+    def _create_session(self):
+        # only retry failures to connect; a read error might be from a
+        # request that the device already executed
+        retry = Retry(
+                total=self._retries, connect=self._retries, read=0,
+                backoff_factor=self._retry_backoff)
+        adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=self._pool_maxsize,
+                max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+
+    def clear(self):
+        """close all sessions."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
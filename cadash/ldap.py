@@ -5,6 +5,8 @@ from ldap3 import Connection
 from ldap3 import Server
 import logging
 
+from cadash import tracing
+
 
 class LdapClient(object):
     """simple ldap client for dce ldap server.
@@ -28,6 +30,7 @@ class LdapClient(object):
         self._pwd = app.config['LDAP_BIND_PASSWD']
 
 
+    @tracing.traced('ldap')
     def is_authenticated(self, username, password):
         """authenticate user with ldap server."""
         u = ('uid=%s,ou=People,' % username) + self._base_search
@@ -39,6 +42,7 @@ class LdapClient(object):
         return result
 
 
+    @tracing.traced('ldap')
     def fetch_groups(self, username):
         """fetch all ldap groups `username` belongs to."""
         result = []
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+counters and latency histograms, exposed in prometheus text format.
+
+samples are recorded in the process registry, and flushed now and then to
+the app cache; with redis as app cache, flushed samples are added up in a
+redis hash, so `/metrics` in any worker reports the whole app. otherwise
+they stay in the process.
+"""
+import json
+import logging
+import socket
+import threading
+import time
+
+from flask import Blueprint
+from flask import current_app
+from flask import request
+from requests.exceptions import Timeout
+from werkzeug.contrib.cache import RedisCache
+
+from cadash.extensions import cache
+
+__all__ = ('MetricsRegistry', 'blueprint', 'outcome', 'registry',
+           'render_metrics')
+
+
+INF = float('inf')
+
+# secs to wait for a device, with default http timeouts
+DEVICE_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, INF)
+# secs for a whole poll of the fleet, and to pull and parse ca_stats
+POLL_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, INF)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'cadash_device_calls_total': (
+        'counter',
+        'calls to capture agents, by device, channel, call and outcome',
+        None),
+    'cadash_device_call_seconds': (
+        'histogram',
+        'secs for calls to capture agents, by device, channel and call',
+        DEVICE_BUCKETS),
+    'cadash_fleet_poll_seconds': (
+        'histogram', 'secs to poll capture agents due for a sync',
+        POLL_BUCKETS),
+    'cadash_fleet_poll_missed_total': (
+        'counter', 'capture agents not synced before the poll deadline',
+        None),
+    'cadash_ca_stats_fetch_seconds': (
+        'histogram', 'secs to pull and parse ca_stats, by outcome',
+        POLL_BUCKETS),
+}
+
+
+def outcome(error=None):
+    """outcome label of a call that raised `error`; 'ok' if `error` is None."""
+    if error is None:
+        return 'ok'
+    # asyncio and python 3 sockets raise TimeoutError
+    if isinstance(error, (Timeout, socket.timeout)) or \
+            type(error).__name__ == 'TimeoutError':
+        return 'timeout'
+    return 'error'
+
+
+def _format_value(value):
+    if value == INF:
+        return '+Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class LocalMetricsStore(object):
+    """flushed samples of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+
+    def add(self, samples):
+        with self._lock:
+            for (key, value) in samples.items():
+                self._totals[key] = self._totals.get(key, 0) + value
+
+
+    def totals(self):
+        with self._lock:
+            return dict(self._totals)
+
+
+    def clear(self):
+        with self._lock:
+            self._totals.clear()
+
+
+class RedisMetricsStore(object):
+    """flushed samples of all processes, added up in a redis hash."""
+
+    KEY = 'cadash:metrics'
+
+    def __init__(self, client, key=KEY):
+        self._client = client
+        self._key = key
+
+
+    def add(self, samples):
+        pipe = self._client.pipeline(transaction=False)
+        for ((name, labels), value) in samples.items():
+            pipe.hincrbyfloat(self._key, json.dumps([name, labels]), value)
+        pipe.execute()
+
+
+    def totals(self):
+        result = {}
+        for (field, value) in self._client.hgetall(self._key).items():
+            (name, labels) = json.loads(field)
+            result[(name, tuple(tuple(l) for l in labels))] = float(value)
+        return result
+
+
+class MetricsRegistry(object):
+    """
+    samples recorded in this process since last flushed.
+
+    a sample is keyed by (name, labels); labels are sorted (name, value)
+    pairs. histograms are kept as prometheus does: a cumulative count per
+    bucket, plus sum and count of observations.
+    assumes that init_app() is called before samples are recorded.
+    """
+
+    def __init__(self, flush_interval=15):
+        """create instance."""
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flushed_at = time.time()
+        self._local = LocalMetricsStore()
+        self.flush_interval = flush_interval
+
+
+    def init_app(self, app):
+        """init registry, with configs from app."""
+        self.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        self.clear()
+
+
+    def clear(self):
+        """drop all samples, flushed to this process or not."""
+        with self._lock:
+            self._pending.clear()
+            self._flushed_at = time.time()
+        self._local.clear()
+
+
+    def _add(self, updates):
+        with self._lock:
+            for (key, value) in updates:
+                self._pending[key] = self._pending.get(key, 0) + value
+
+
+    def inc(self, name, value=1, **labels):
+        """add `value` to counter `name`."""
+        assert METRICS[name][0] == 'counter'
+        self._add([((name, tuple(sorted(labels.items()))), value)])
+
+
+    def observe(self, name, value, **labels):
+        """add observation `value` to histogram `name`."""
+        buckets = METRICS[name][2]
+        labels = tuple(sorted(labels.items()))
+        # every bucket is listed, even if empty
+        updates = [
+            (('%s_bucket' % name, tuple(sorted(labels + (('le', _format_value(le)),)))),
+             1 if value <= le else 0)
+            for le in buckets]
+        updates.append((('%s_sum' % name, labels), value))
+        updates.append((('%s_count' % name, labels), 1))
+        self._add(updates)
+
+
+    def pending(self):
+        """samples not flushed yet."""
+        with self._lock:
+            return dict(self._pending)
+
+
+    def store(self, backend):
+        """where samples are flushed, for werkzeug cache `backend`."""
+        if isinstance(backend, RedisCache):
+            return RedisMetricsStore(backend._client)
+        return self._local
+
+
+    def flush(self, backend):
+        """add samples not flushed yet to the store for `backend`."""
+        with self._lock:
+            (samples, self._pending) = (self._pending, {})
+            self._flushed_at = time.time()
+        if not samples:
+            return
+        try:
+            self.store(backend).add(samples)
+        except Exception as e:
+            logger = logging.getLogger(__name__)
+            logger.warning(
+                    'unable to flush %d metrics samples; kept for next flush. '
+                    'error: %r' % (len(samples), e))
+            self._add(samples.items())
+
+
+    def flush_due(self, backend):
+        """flush, if not flushed for `flush_interval` secs."""
+        if time.time() - self._flushed_at >= self.flush_interval:
+            self.flush(backend)
+
+
+    def collect(self, backend):
+        """flush, then return all samples in the store for `backend`."""
+        self.flush(backend)
+        return self.store(backend).totals()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+            '%s="%s"' % (k, v.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+            for (k, v) in labels)
+
+
+def _without_le(labels):
+    return tuple(l for l in labels if l[0] != 'le')
+
+
+def render_metrics(samples):
+    """`samples` as prometheus text format."""
+    by_name = {}
+    for (key, value) in samples.items():
+        by_name.setdefault(key[0], []).append((key, value))
+
+    lines = []
+    for name in sorted(METRICS.keys()):
+        (kind, help_text, buckets) = METRICS[name]
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        if kind == 'counter':
+            series = sorted(by_name.get(name, []))
+        else:
+            # buckets of a series by increasing bound, then its sum and count
+            bucket_series = {}
+            for sample in by_name.get('%s_bucket' % name, []):
+                bucket_series.setdefault(_without_le(sample[0][1]), []).append(sample)
+            sums = dict((k[1], v) for (k, v) in by_name.get('%s_sum' % name, []))
+            series = []
+            for (labels, count) in sorted(
+                    (k[1], v) for (k, v) in by_name.get('%s_count' % name, [])):
+                series += sorted(
+                        bucket_series.get(labels, []),
+                        key=lambda s: float(dict(s[0][1])['le']))
+                series.append((('%s_sum' % name, labels), sums.get(labels, 0)))
+                series.append((('%s_count' % name, labels), count))
+        for ((sample_name, labels), value) in series:
+            lines.append('%s%s %s' % (
+                sample_name, _format_labels(labels), _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+# process registry; samples from all threads go here
+registry = MetricsRegistry()
+
+blueprint = Blueprint('metrics', __name__)
+
+
+@blueprint.after_app_request
+def flush_metrics(response):
+    """flush samples now and then, while the worker serves requests."""
+    registry.flush_due(cache.cache)
+    return response
+
+
+@blueprint.route('/metrics', methods=['GET'])
+def metrics():
+    """samples of all workers, in prometheus text format."""
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != 'Bearer %s' % token:
+        return current_app.response_class(
+                'unauthorized\n', status=401, mimetype='text/plain',
+                headers={'WWW-Authenticate': 'Bearer'})
+    return current_app.response_class(
+            render_metrics(registry.collect(cache.cache)),
+            mimetype='text/plain; version=0.0.4')
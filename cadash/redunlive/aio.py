@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio transport to epiphan-pearl devices, for fleet-wide polling.
+
+python 3.5+ only; import this module only when `cadash.compat.ASYNCIO` is
+True, otherwise poll with `cadash.redunlive.poller`. a single thread holds
+all device requests in flight, instead of one thread per request.
+"""
+import asyncio
+import base64
+import logging
+import time
+from urllib.parse import urlencode
+from urllib.parse import urljoin
+from urllib.parse import urlparse
+from urllib.request import getproxies
+from urllib.request import proxy_bypass
+
+from cadash import tracing
+from cadash.metrics import outcome
+from cadash.redunlive.errors import DeviceRequestError
+
+__all__ = ('AsyncEpipearl', 'sync_all', 'sync_all_async',
+           'sync_live_status_async')
+
+
+DEFAULT_MAX_CONCURRENCY = 1000
+DEFAULT_DEADLINE = 20  # seconds
+
+
+class AsyncEpipearl(object):
+    """
+    asyncio client for epiphan-pearl, same contract as epipearl.Epipearl.
+
+    `get_params` and `set_params` are coroutines; connections to the device
+    are kept alive and reused. as the pooled http sessions, failures to
+    connect are retried `retries` times, after `retry_backoff` secs doubling
+    each time; requests go through `proxy` if set, or the proxy for the
+    device in the environment (http_proxy/no_proxy).
+    a client must only be used from the event loop that created it.
+    """
+
+    def __init__(
+            self, base_url, user, passwd, timeout=(3.05, 10), proxy=None,
+            retries=1, retry_backoff=0.2, max_idle=2):
+        """create instance; `timeout` is (connect, read) secs."""
+        self.url = base_url
+        self._auth = 'Basic %s' % base64.b64encode(
+                ('%s:%s' % (user, passwd)).encode('utf-8')).decode('ascii')
+        (self._connect_timeout, self._read_timeout) = timeout
+        self._proxy = proxy if proxy is not None else _env_proxy(base_url)
+        self._retries = retries
+        self._retry_backoff = retry_backoff
+        self._max_idle = max_idle
+        self._idle = []
+
+
+    async def get_params(self, channel, params={}):
+        text = await self.get(
+                'admin/channel%s/get_params.cgi' % channel, params=params)
+        r = {}
+        for line in text.splitlines():
+            if '=' in line:
+                (key, value) = [x.strip() for x in line.split('=', 1)]
+                r[key] = value
+        return r
+
+
+    async def set_params(self, channel, params):
+        await self.get('admin/channel%s/set_params.cgi' % channel, params=params)
+        return True
+
+
+    async def get(self, path, params={}):
+        """GET `path` in device; return body text, raise if status not 2xx."""
+        url = urljoin(self.url, path)
+        if params:
+            url = '%s?%s' % (url, urlencode(params))
+
+        (status, body) = await self._request('GET', url)
+        if status // 100 != 2:
+            raise DeviceRequestError(
+                    'GET %s returned status %s' % (url, status))
+        return body.decode('utf-8', 'replace')
+
+
+    async def close(self):
+        """close idle connections."""
+        while self._idle:
+            (reader, writer) = self._idle.pop()
+            writer.close()
+
+
+    async def _request(self, method, url):
+        u = urlparse(url)
+        target = urlparse(self._proxy) if self._proxy else u
+        if target.scheme not in ('http', ''):
+            raise DeviceRequestError('scheme not supported (%s)' % url)
+
+        # requests through a proxy use the absolute url
+        request_uri = url if self._proxy else (u.path or '/') + \
+                ('?%s' % u.query if u.query else '')
+        request = (
+                '%s %s HTTP/1.1\r\n'
+                'Host: %s\r\n'
+                'Authorization: %s\r\n'
+                'X-REQUESTED-AUTH: Basic\r\n'
+                'Accept: text/html, text/*\r\n'
+                'Connection: keep-alive\r\n'
+                '\r\n' % (method, request_uri, u.netloc, self._auth))
+
+        (reader, writer) = await self._connect(target.hostname, target.port or 80)
+        try:
+            writer.write(request.encode('latin-1'))
+            (status, body, keep_alive) = await asyncio.wait_for(
+                    _read_response(reader), self._read_timeout)
+        except BaseException:
+            writer.close()
+            raise
+
+        if keep_alive and len(self._idle) < self._max_idle:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        return (status, body)
+
+
+    async def _connect(self, host, port):
+        while self._idle:
+            (reader, writer) = self._idle.pop()
+            if not reader.at_eof():
+                return (reader, writer)
+            writer.close()
+
+        # only failures to connect are retried; a read error might be from
+        # a request that the device already executed
+        backoff = self._retry_backoff
+        for attempt in range(self._retries + 1):
+            try:
+                return await asyncio.wait_for(
+                        asyncio.open_connection(host, port), self._connect_timeout)
+            except (OSError, asyncio.TimeoutError):
+                if attempt == self._retries:
+                    raise
+            await asyncio.sleep(backoff)
+            backoff *= 2
+
+
+async def _read_response(reader):
+    """return (status, body, keep_alive) of http/1.1 response in `reader`."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise DeviceRequestError('connection closed by device')
+    parts = status_line.decode('latin-1').split(None, 2)
+    status = int(parts[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        (name, value) = line.decode('latin-1').split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+
+    keep_alive = headers.get('connection', '').lower() != 'close' and \
+            parts[0] == 'HTTP/1.1'
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # skip trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        body = b''.join(chunks)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    elif status in (204, 304) or status // 100 == 1:
+        body = b''
+    else:
+        body = await reader.read()
+        keep_alive = False
+    return (status, body, keep_alive)
+
+
+def _env_proxy(url):
+    host = urlparse(url).hostname
+    if proxy_bypass(host):
+        return None
+    return getproxies().get('http')
+
+
+async def _blocking(fn, *args):
+    """run `fn(*args)`, e.g. a call to the app cache, off the event loop."""
+    return await asyncio.get_event_loop().run_in_executor(None, fn, *args)
+
+
+async def _get_publish_type(ca, client, chan_name):
+    channel = ca.channel(chan_name)
+    if channel == 'not available':
+        return 'not available'
+
+    logger = logging.getLogger(__name__)
+    start = time.time()
+    try:
+        response = await client.get_params(
+                channel=channel, params={'publish_type': ''})
+    except Exception as e:
+        logger.warning(
+                'CA(%s) unable to get channel(%s) publish_type. error: %r' %
+                (ca.name, chan_name, e))
+        await _record(ca, 'get_params', chan_name, 'not available', start, e)
+        return 'not available'
+
+    ca.last_update = time.time()
+    publish_type = response.get('publish_type', 'not available')
+    await _record(ca, 'get_params', chan_name, publish_type, start)
+    return publish_type
+
+
+async def _set_publish_type(ca, client, chan_name, value):
+    channel = ca.channel(chan_name)
+    if channel == 'not available':
+        return 'not available'
+
+    logger = logging.getLogger(__name__)
+    start = time.time()
+    try:
+        await client.set_params(channel=channel, params={'publish_type': value})
+    except Exception as e:
+        logger.warning(
+                'CA(%s) unable to set channel(%s) publish_type to %s. error: %r'
+                % (ca.name, chan_name, value, e))
+        await _record(ca, 'set_params', chan_name, 'not available', start, e)
+        return 'not available'
+
+    ca.last_update = time.time()
+    await _record(ca, 'set_params', chan_name, value, start)
+    return value
+
+
+async def _record(ca, call, chan_name, publish_type, start, error=None):
+    """metrics, breaker and history of a device call, as in CaptureAgent."""
+    latency = time.time() - start
+    # coroutines share the thread, so device calls do not nest in spans
+    tracing.record('device_%s' % call, start, latency)
+    if ca.metrics is not None:
+        ca.metrics.inc(
+                'cadash_device_calls_total', device=ca.name, channel=chan_name,
+                call=call, outcome=outcome(error))
+        ca.metrics.observe(
+                'cadash_device_call_seconds', latency, device=ca.name,
+                channel=chan_name, call=call)
+    if ca.breaker is not None:
+        if error is None:
+            await _blocking(ca.breaker.record_success, ca.serial_number)
+        else:
+            await _blocking(ca.breaker.record_failure, ca.serial_number)
+    if ca.history is not None:
+        await _blocking(
+                ca.history.record, ca.serial_number, time.time(), chan_name,
+                publish_type, latency)
+
+
+async def sync_live_status_async(ca, client):
+    """
+    async version of CaptureAgent.sync_live_status, through `client`.
+
+    :param: ca: redunlive.models.CaptureAgent
+    :param: client: AsyncEpipearl for the capture agent
+    """
+    logger = logging.getLogger(__name__)
+    if ca.breaker is not None and \
+            not await _blocking(ca.breaker.allow, ca.serial_number):
+        logger.debug('CA(%s) breaker is open; not polled' % ca.name)
+        ca.mark_not_available()
+        return
+
+    (live, lowBR) = await asyncio.gather(
+            _get_publish_type(ca, client, 'live'),
+            _get_publish_type(ca, client, 'lowBR'))
+
+    if live != lowBR:
+        logger.warning(
+                'CA(%s) publish_type for live/lowBR (%s/%s); trying to fix...'
+                % (ca.name, live, lowBR))
+        lowBR = await _set_publish_type(ca, client, 'lowBR', live)
+
+    ca.set_publish_type('live', live)
+    ca.set_publish_type('lowBR', lowBR)
+
+
+async def sync_all_async(
+        cas, clients, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        deadline=DEFAULT_DEADLINE):
+    """
+    sync live status of capture agents concurrently, in the running loop.
+
+    same as `cadash.redunlive.poller.sync_all`, but at most
+    `max_concurrency` devices are polled at the same time. as there, each
+    device is synced into a copy, and its status copied back if done before
+    the deadline.
+
+    :param: cas: list of redunlive.models.CaptureAgent
+    :param: clients: dict of AsyncEpipearl by capture agent serial_number
+    :return: list of capture agents that missed the deadline
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def sync(polled):
+        async with semaphore:
+            await sync_live_status_async(polled, clients[polled.serial_number])
+
+    tasks = {}
+    for ca in cas:
+        polled = ca.copy()
+        tasks[asyncio.ensure_future(sync(polled))] = (ca, polled)
+    if not tasks:
+        return []
+    (done, pending) = await asyncio.wait(list(tasks.keys()), timeout=deadline)
+
+    logger = logging.getLogger(__name__)
+    for t in done:
+        (ca, polled) = tasks[t]
+        if t.exception() is not None:
+            logger.warning(
+                    'CA(%s) failed to sync live status. error: %r'
+                    % (ca.name, t.exception()))
+            ca.mark_not_available()
+        else:
+            ca.copy_live_status(polled)
+
+    missed = []
+    for t in pending:
+        t.cancel()
+        ca = tasks[t][0]
+        ca.mark_not_available()
+        missed.append(ca)
+    if pending:
+        await asyncio.wait(pending)
+    return missed
+
+
+def sync_all(
+        cas, user, passwd, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        deadline=DEFAULT_DEADLINE, timeout=(3.05, 10), proxy=None,
+        retries=1, retry_backoff=0.2):
+    """
+    sync live status of capture agents in an event loop in this thread.
+
+    drop-in for `cadash.redunlive.poller.sync_all`; creates an AsyncEpipearl
+    per capture agent, with creds `user`/`passwd`, `timeout`, `proxy` and
+    connect `retries`, closed when done.
+
+    :return: list of capture agents that missed the deadline
+    """
+    cas = list(cas)
+    if not cas:
+        return []
+
+    logger = logging.getLogger(__name__)
+    start = time.time()
+
+    async def run():
+        clients = dict(
+                (ca.serial_number, AsyncEpipearl(
+                    'http://%s' % ca.address, user, passwd, timeout=timeout,
+                    proxy=proxy, retries=retries, retry_backoff=retry_backoff))
+                for ca in cas)
+        try:
+            return await sync_all_async(
+                    cas, clients, max_concurrency=max_concurrency,
+                    deadline=deadline)
+        finally:
+            for client in clients.values():
+                await client.close()
+
+    loop = asyncio.new_event_loop()
+    try:
+        missed = loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+    if missed:
+        logger.warning(
+                'sync of %d out of %d capture agents missed deadline(%ss): %s'
+                % (len(missed), len(cas), deadline, missed))
+    logger.debug(
+            'synced %d capture agents in %.3fs' % (len(cas), time.time() - start))
+    return missed
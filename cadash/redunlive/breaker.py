@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""circuit breaker for unreachable capture agents."""
+import logging
+import time
+
+from werkzeug.contrib.cache import RedisCache
+
+from cadash.redunlive.singleflight import CacheLease
+
+__all__ = ('CircuitBreaker',)
+
+
+class CircuitBreaker(object):
+    """
+    per-device circuit breaker, with state in a cache shared by all workers.
+
+    after `threshold` consecutive failures the breaker for a device opens,
+    and calls to the device are skipped; once `backoff` seconds have passed,
+    a single caller across all workers is allowed to probe the device.
+    each failed probe doubles the wait for the next one, up to `max_backoff`.
+    a successful call closes the breaker.
+
+    failures are counted with an atomic increment in the cache, so calls to
+    channels of a device, and to devices, are never serialized.
+    """
+
+    KEY_PREFIX = 'redunlive:breaker:'
+
+    def __init__(self, backend, threshold=3, backoff=10, max_backoff=600):
+        """create instance; `backend` is a werkzeug cache."""
+        self._backend = backend
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+
+    def _key(self, device):
+        return '%s%s' % (self.KEY_PREFIX, device)
+
+
+    def _retry_key(self, device):
+        return '%s:retry_at' % self._key(device)
+
+
+    def state(self, device):
+        """dict with 'failures' and 'retry_at' for `device`, or None if closed."""
+        (failures, retry_at) = self._backend.get_many(
+                self._key(device), self._retry_key(device))
+        if not failures:
+            return None
+        return {'failures': failures, 'retry_at': retry_at or 0}
+
+
+    def is_open(self, device):
+        state = self.state(device)
+        return state is not None and state['failures'] >= self.threshold
+
+
+    def allow(self, device):
+        """return True if `device` can be called now."""
+        state = self.state(device)
+        if state is None:
+            return True
+        if state['failures'] < self.threshold:
+            return True
+        if time.time() < state['retry_at']:
+            return False
+
+        # breaker is due for a probe; only one caller gets to do it
+        probe_key = '%s:probe' % self._key(device)
+        probe_ttl = max(1, int(self._next_backoff(state['failures'])))
+        return CacheLease(self._backend, probe_key, probe_ttl).acquire()
+
+
+    def record_success(self, device):
+        # failures may be counted by other instances, or workers; a success
+        # anywhere ends the run of consecutive failures
+        failures = self._backend.get(self._key(device))
+        if not failures:
+            return
+        self._backend.delete_many(self._key(device), self._retry_key(device))
+        if failures >= self.threshold:
+            logger = logging.getLogger(__name__)
+            logger.warning('CA(%s) breaker closed' % device)
+
+
+    def record_failure(self, device):
+        # forget about devices that stay dead for long
+        timeout = int(10 * self.max_backoff)
+        failures = self._count_failure(device, timeout)
+        if failures is None or failures < self.threshold:
+            return
+
+        backoff = self._next_backoff(failures)
+        self._backend.set(
+                self._retry_key(device), time.time() + backoff, timeout=timeout)
+        logger = logging.getLogger(__name__)
+        logger.warning(
+                'CA(%s) breaker open after %d failures; next probe in %ss'
+                % (device, failures, backoff))
+
+
+    def _count_failure(self, device, timeout):
+        """add a failure of `device`, atomically; return failures so far."""
+        key = self._key(device)
+        if isinstance(self._backend, RedisCache):
+            # INCR and EXPIRE in one round trip
+            name = self._backend.key_prefix + key
+            pipe = self._backend._client.pipeline()
+            pipe.incr(name)
+            pipe.expire(name, timeout)
+            return pipe.execute()[0]
+
+        # in-process caches; add() sets the expiry, if not counting yet
+        self._backend.add(key, 0, timeout=timeout)
+        return self._backend.inc(key)
+
+
+    def _next_backoff(self, failures):
+        exponent = min(max(0, failures - self.threshold), 32)
+        return min(self.max_backoff, self.backoff * (2 ** exponent))
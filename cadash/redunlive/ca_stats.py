@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""incremental parsing of the ca_stats feed of capture agents."""
+from collections import namedtuple
+import json
+
+from cadash.compat import string_types
+from cadash.redunlive.errors import CaStatsFormatError
+from cadash.redunlive.errors import CaStatsItemError
+from cadash.redunlive.models import CaLocation
+
+__all__ = ('CaStatsEntries', 'ca_fingerprint', 'iter_json_array',
+           'read_ca_stats')
+
+
+_WHITESPACE = u' \t\n\r'
+
+# chars of a single ca_stats item kept before the text is taken as invalid;
+# items are about 1k chars
+MAX_ITEM_CHARS = 1024 * 1024
+
+# capture agents in ca_stats: `location_names` and `location_entries` by
+# location id, entries as lists of (serial_number, fingerprint) in ca_stats
+# order; `errors` are the items left out, as dicts with 'index',
+# 'location', 'address' and 'error'
+CaStatsEntries = namedtuple(
+        'CaStatsEntries', ['location_names', 'location_entries', 'errors'])
+
+
+class _ChunkReader(object):
+    """text from chunks, keeping only what was not parsed yet."""
+
+    def __init__(self, chunks, max_item=MAX_ITEM_CHARS):
+        self._chunks = iter(chunks)
+        self.max_item = max_item
+        self.buf = u''
+        self.pos = 0
+        self.consumed = 0
+
+
+    def fill(self):
+        """drop parsed text and append next chunk; False if no more chunks."""
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            return False
+        self.consumed += self.pos
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+
+    def peek(self):
+        """next char that is not whitespace, or None at the end."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return None
+
+
+    def decode(self, decoder):
+        """next json value."""
+        self.peek()
+        while True:
+            try:
+                (value, end) = decoder.raw_decode(self.buf, self.pos)
+            except ValueError as e:
+                # invalid json is not parsed with more text; fail before
+                # buffering the rest of the stream
+                if len(self.buf) - self.pos <= self.max_item and self.fill():
+                    continue
+                raise CaStatsFormatError(
+                        'invalid json at char %d: %s'
+                        % (self.consumed + self.pos, e))
+            # a value at the end of the text, e.g. a number, may go on in
+            # the next chunk
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_array(chunks, max_item=MAX_ITEM_CHARS):
+    """
+    yield items of the json array in text `chunks`, one at a time.
+
+    only the text of the item being parsed is kept, not the whole array.
+    raises CaStatsFormatError if the text is not a json array, or an item
+    is not parsed within `max_item` chars.
+    """
+    reader = _ChunkReader(chunks, max_item)
+    decoder = json.JSONDecoder()
+    if reader.peek() != u'[':
+        raise CaStatsFormatError('expected json array')
+    reader.pos += 1
+
+    if reader.peek() == u']':
+        reader.pos += 1
+    else:
+        while True:
+            yield reader.decode(decoder)
+            c = reader.peek()
+            reader.pos += 1
+            if c == u']':
+                break
+            if c != u',':
+                raise CaStatsFormatError(
+                        'expected "," or "]" at char %d'
+                        % (reader.consumed + reader.pos - 1))
+
+    if reader.peek() is not None:
+        raise CaStatsFormatError('unexpected data after json array')
+
+
+def _live_channels(ca_attributes):
+    """
+    find the live streaming channels in ca_stats `ca_attributes`.
+
+    :return: tuple (live channel, live publish_type,
+             lowBR channel, lowBR publish_type)
+    """
+    live = ['not available', 'not available']
+    lowBR = ['not available', 'not available']
+    if 'channels' in ca_attributes and \
+            isinstance(ca_attributes['channels'], dict):
+        for chan, info in ca_attributes['channels'].items():
+            if not isinstance(info, dict) or \
+                    not isinstance(info.get('name'), string_types):
+                continue
+            if 'live' in info['name'].lower():
+                c = live if 'lowbr' not in info['name'].lower() else lowBR
+                c[0] = chan if chan else 'not available'
+                if 'publish_type' in info:
+                    c[1] = info['publish_type']
+    return (live[0], live[1], lowBR[0], lowBR[1])
+
+
+def ca_fingerprint(ca_item):
+    """
+    (serial_number, fingerprint) of capture agent in ca_stats `ca_item`.
+
+    the fingerprint is (location, role, address, serial_number) plus the
+    live channels, as in `_live_channels`.
+    raises CaStatsItemError if `ca_item` misses required properties.
+    """
+    for key in ('location', 'address', 'role'):
+        if not isinstance(ca_item.get(key), string_types):
+            raise CaStatsItemError('missing "%s"' % key)
+
+    attributes = ca_item.get('ca_attributes')
+    if not isinstance(attributes, dict) or \
+            not isinstance(attributes.get('serial_number'), string_types):
+        raise CaStatsItemError('missing "serial_number"')
+
+    serial_number = attributes['serial_number']
+    return (serial_number, (
+        ca_item['location'], ca_item['role'], ca_item['address'],
+        serial_number) + _live_channels(attributes))
+
+
+def read_ca_stats(items):
+    """
+    group capture agents in ca_stats `items` by location.
+
+    `items` is iterated once, so it can be a generator, as from
+    `iter_json_array`; only fingerprints are kept. items that are not valid
+    are left out and reported in the result `errors`; their location is
+    still listed.
+
+    :return: CaStatsEntries
+    """
+    location_names = {}
+    location_entries = {}
+    errors = []
+    for (index, ca_item) in enumerate(items):
+        if not isinstance(ca_item, dict):
+            errors.append({'index': index, 'location': None, 'address': None,
+                           'error': 'not a json object'})
+            continue
+
+        location = ca_item.get('location')
+        if isinstance(location, string_types):
+            loc_id = CaLocation.clean_name(location)
+            if loc_id not in location_entries:
+                location_names[loc_id] = location
+                location_entries[loc_id] = []
+
+        try:
+            (serial_number, fingerprint) = ca_fingerprint(ca_item)
+        except CaStatsItemError as e:
+            errors.append({
+                'index': index,
+                'location': location,
+                'address': ca_item.get('address'),
+                'error': str(e)})
+            continue
+        location_entries[loc_id].append((serial_number, fingerprint))
+
+    return CaStatsEntries(location_names, location_entries, errors)
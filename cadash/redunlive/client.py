@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""epipearl client over pooled keep-alive sessions."""
+import threading
+
+from epipearl import Epipearl
+from requests.auth import HTTPBasicAuth
+
+from cadash.compat import urljoin
+from cadash.extensions import http_sessions
+
+__all__ = ('PooledEpipearl', 'get_epipearl_client')
+
+
+class PooledEpipearl(Epipearl):
+    """
+    epipearl client that reuses connections to the device.
+
+    same api as epipearl.Epipearl, but requests go through the session for
+    the device host in the process session pool, with the pool timeouts.
+    """
+
+    def __init__(self, base_url, user, passwd, session_pool=http_sessions):
+        """create instance."""
+        super(PooledEpipearl, self).__init__(base_url, user, passwd)
+        self._session_pool = session_pool
+        self._auth = HTTPBasicAuth(user, passwd)
+
+
+    def get(self, path, params={}, extra_headers={}):
+        headers = self.default_headers.copy()
+        headers.update(extra_headers)
+
+        resp = self._session_pool.session(self.url).get(
+                urljoin(self.url, path),
+                params=params,
+                auth=self._auth,
+                headers=headers,
+                timeout=self._session_pool.timeout)
+        resp.raise_for_status()
+        return resp
+
+
+    def post(self, path, data={}, extra_headers={}):
+        headers = self.default_headers.copy()
+        headers.update(extra_headers)
+
+        resp = self._session_pool.session(self.url).post(
+                urljoin(self.url, path),
+                data=data,
+                auth=self._auth,
+                headers=headers,
+                timeout=self._session_pool.timeout)
+        resp.raise_for_status()
+        return resp
+
+
+# clients by (address, user, passwd), reused across polls
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_epipearl_client(address, user, passwd):
+    """pooled epipearl client for device at `address`."""
+    key = (address, user, passwd)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.setdefault(
+                    key, PooledEpipearl('http://%s' % address, user, passwd))
+    return client
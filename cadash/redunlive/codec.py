@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+compact binary format for the redunlive snapshot.
+
+    header | record offsets | values | removed | records
+
+the header has the format version, snapshot version and creation time, the
+number of locations, values and removed locations, and the oldest snapshot
+version changes are known since. values are the channel numbers and
+publish_types, which repeat across the fleet and are stored once; records
+refer to them by index. removed are ids of locations dropped from the
+snapshot, with the version they were dropped. records hold one location
+each, with the version its state last changed, sorted by location id, and
+start with the id, so a single location is found by binary search over the
+offsets without decoding the others. strings are utf-8.
+"""
+import struct
+
+from cadash.compat import text_type
+from cadash.redunlive.errors import SnapshotFormatError
+
+__all__ = ('decode_location', 'decode_snapshot', 'encode_snapshot',
+           'location_state', 'read_header', 'replace_locations')
+
+
+MAGIC = b'RLSN'
+# 2: version of last change per location, and removed locations
+FORMAT_VERSION = 2
+
+# magic, format version, snapshot version, created, number of locations,
+# number of values, number of removed locations, changes known since version
+HEADER = struct.Struct('!4sBQdIIIQ')
+STR_LEN = struct.Struct('!H')
+VERSION = struct.Struct('!Q')
+# id length, name length, flags (has primary, has secondary), number of
+# experimental cas, version of last change; followed by id and name
+LOCATION = struct.Struct('!HHBHQ')
+# serial_number length, address length, index of live channel, live
+# publish_type, lowBR channel and lowBR publish_type in values, last_update;
+# followed by serial_number and address
+CA = struct.Struct('!HHHHHHd')
+
+HAS_PRIMARY = 0x01
+HAS_SECONDARY = 0x02
+
+
+def location_state(d):
+    """
+    state of location dict `d` that matters to clients: all but the time
+    capture agents were last polled.
+    """
+    def ca_state(ca):
+        if ca is None:
+            return None
+        return (ca['serial_number'], ca['address'],
+                ca['channels']['live']['channel'],
+                ca['channels']['live']['publish_type'],
+                ca['channels']['lowBR']['channel'],
+                ca['channels']['lowBR']['publish_type'])
+
+    return (d['name'], ca_state(d['primary_ca']), ca_state(d['secondary_ca']),
+            tuple(ca_state(ca) for ca in d['experimental_cas']))
+
+
+def _utf8(value):
+    if not isinstance(value, text_type):
+        value = text_type(value)
+    return value.encode('utf-8')
+
+
+def _pack_str(value):
+    b = _utf8(value)
+    return STR_LEN.pack(len(b)) + b
+
+
+def _unpack_str(data, offset):
+    (size,) = STR_LEN.unpack_from(data, offset)
+    offset += STR_LEN.size
+    return (data[offset:offset + size].decode('utf-8'), offset + size)
+
+
+def _encode_ca(d, values, out):
+    serial_number = _utf8(d['serial_number'])
+    address = _utf8(d['address'])
+    indexes = []
+    for chan_name in ('live', 'lowBR'):
+        for field in ('channel', 'publish_type'):
+            value = d['channels'][chan_name][field]
+            indexes.append(values.setdefault(value, len(values)))
+    out.append(CA.pack(*(
+        [len(serial_number), len(address)] + indexes + [d['last_update']])))
+    out.append(serial_number)
+    out.append(address)
+
+
+def _encode_location(loc_id, d, changed, values):
+    """record bytes for location dict `d`; adds new values to `values`."""
+    loc_id = _utf8(loc_id)
+    name = _utf8(d['name'])
+    flags = (HAS_PRIMARY if d['primary_ca'] is not None else 0) | \
+            (HAS_SECONDARY if d['secondary_ca'] is not None else 0)
+    out = [LOCATION.pack(len(loc_id), len(name), flags,
+                         len(d['experimental_cas']), changed),
+           loc_id, name]
+    for ca in [d['primary_ca'], d['secondary_ca']] + d['experimental_cas']:
+        if ca is not None:
+            _encode_ca(ca, values, out)
+    return b''.join(out)
+
+
+def _decode_location(data, offset, values):
+    """(location id, location dict, version of last change) at `offset`."""
+    (id_len, name_len, flags, experimental, changed) = \
+        LOCATION.unpack_from(data, offset)
+    offset += LOCATION.size
+    loc_id = data[offset:offset + id_len].decode('utf-8')
+    offset += id_len
+    name = data[offset:offset + name_len].decode('utf-8')
+    offset += name_len
+
+    cas = []
+    count = experimental + (flags & HAS_PRIMARY) + ((flags & HAS_SECONDARY) >> 1)
+    for i in range(count):
+        (serial_len, address_len, live_channel, live_pt, lowbr_channel,
+         lowbr_pt, last_update) = CA.unpack_from(data, offset)
+        offset += CA.size
+        serial_number = data[offset:offset + serial_len].decode('utf-8')
+        offset += serial_len
+        address = data[offset:offset + address_len].decode('utf-8')
+        offset += address_len
+        cas.append({
+                'serial_number': serial_number,
+                'address': address,
+                'last_update': last_update,
+                'channels': {
+                    'live': {
+                        'channel': values[live_channel],
+                        'publish_type': values[live_pt]},
+                    'lowBR': {
+                        'channel': values[lowbr_channel],
+                        'publish_type': values[lowbr_pt]}},
+                })
+
+    primary = cas.pop(0) if flags & HAS_PRIMARY else None
+    secondary = cas.pop(0) if flags & HAS_SECONDARY else None
+    return (loc_id, {
+            'id': loc_id,
+            'name': name,
+            'primary_ca': primary,
+            'secondary_ca': secondary,
+            'experimental_cas': cas}, changed)
+
+
+def _record_key(data, offset):
+    (id_len,) = STR_LEN.unpack_from(data, offset)
+    start = offset + LOCATION.size
+    return data[start:start + id_len]
+
+
+def _assemble(snapshot, records, values):
+    """
+    snapshot bytes.
+
+    :param: snapshot: dict with 'version', 'created', 'removed' and
+        'deltas_since', as returned by `decode_snapshot`
+    :param: records: list of (location id as utf-8, record bytes)
+    :param: values: dict of value index by value
+    """
+    records.sort(key=lambda r: r[0])
+    tables = []
+    for value in sorted(values, key=values.get):
+        tables.append(_pack_str(value))
+    removed = snapshot.get('removed', {})
+    for (loc_id, version) in removed.items():
+        tables.append(_pack_str(loc_id))
+        tables.append(VERSION.pack(version))
+    tables = b''.join(tables)
+
+    n = len(records)
+    offsets = []
+    position = HEADER.size + 4 * n + len(tables)
+    for (key, record) in records:
+        offsets.append(position)
+        position += len(record)
+    header = HEADER.pack(
+            MAGIC, FORMAT_VERSION, snapshot['version'], snapshot['created'], n,
+            len(values), len(removed),
+            snapshot.get('deltas_since', snapshot['version']))
+    return b''.join(
+            [header, struct.pack('!%dI' % n, *offsets), tables] +
+            [r for (k, r) in records])
+
+
+def encode_snapshot(snapshot):
+    """
+    snapshot as bytes.
+
+    :param: snapshot: dict with
+        'version' and 'created';
+        'locations': location dicts by id, as in
+            `cadash.redunlive.snapshot.location_to_dict`;
+        'changed': version each location last changed, by id; defaults to
+            'version';
+        'removed': version locations were dropped, by id; defaults to none;
+        'deltas_since': oldest version that changes are known since;
+            defaults to 'version'
+    """
+    values = {}
+    changed = snapshot.get('changed', {})
+    records = [
+            (_utf8(loc_id), _encode_location(
+                loc_id, d, changed.get(loc_id, snapshot['version']), values))
+            for (loc_id, d) in snapshot['locations'].items()]
+    return _assemble(snapshot, records, values)
+
+
+def read_header(data):
+    """(snapshot version, created, number of locations) in `data`."""
+    if not isinstance(data, bytes) or len(data) < 5:
+        raise SnapshotFormatError('not a redunlive snapshot')
+    (magic, format_version) = struct.unpack_from('!4sB', data)
+    if magic != MAGIC:
+        raise SnapshotFormatError('not a redunlive snapshot')
+    if format_version != FORMAT_VERSION:
+        raise SnapshotFormatError(
+                'snapshot format version(%s) not supported' % format_version)
+    (magic, format_version, version, created, n, n_values, n_removed,
+     deltas_since) = HEADER.unpack_from(data)
+    return (version, created, n)
+
+
+def _read_tables(data):
+    """(offsets of records, list of values, removed, deltas_since) in `data`."""
+    (magic, format_version, version, created, n, n_values, n_removed,
+     deltas_since) = HEADER.unpack_from(data)
+    offsets = struct.unpack_from('!%dI' % n, data, HEADER.size)
+    values = []
+    offset = HEADER.size + 4 * n
+    for i in range(n_values):
+        (value, offset) = _unpack_str(data, offset)
+        values.append(value)
+    removed = {}
+    for i in range(n_removed):
+        (loc_id, offset) = _unpack_str(data, offset)
+        (removed[loc_id],) = VERSION.unpack_from(data, offset)
+        offset += VERSION.size
+    return (offsets, values, removed, deltas_since)
+
+
+def decode_snapshot(data):
+    """snapshot dict, as passed to `encode_snapshot`, with all keys set."""
+    (version, created, n) = read_header(data)
+    (offsets, values, removed, deltas_since) = _read_tables(data)
+    locations = {}
+    changed = {}
+    for offset in offsets:
+        (loc_id, d, changed[loc_id]) = _decode_location(data, offset, values)
+        locations[loc_id] = d
+    return {'version': version, 'created': created, 'locations': locations,
+            'changed': changed, 'removed': removed,
+            'deltas_since': deltas_since}
+
+
+def _find_record(data, loc_id):
+    """offset of record of `loc_id` in `data`, or None."""
+    (version, created, n) = read_header(data)
+    key = _utf8(loc_id)
+    (lo, hi) = (0, n)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        (offset,) = struct.unpack_from('!I', data, HEADER.size + 4 * mid)
+        mid_key = _record_key(data, offset)
+        if mid_key < key:
+            lo = mid + 1
+        elif mid_key > key:
+            hi = mid
+        else:
+            return offset
+    return None
+
+
+def decode_location(data, loc_id):
+    """location dict for `loc_id` in snapshot `data`, or None if not there."""
+    offset = _find_record(data, loc_id)
+    if offset is None:
+        return None
+    values = _read_tables(data)[1]
+    return _decode_location(data, offset, values)[1]
+
+
+def replace_locations(data, version, created, location_dicts):
+    """
+    new snapshot bytes with `location_dicts` added or replaced in `data`.
+
+    records of other locations are copied as they are, not decoded; a
+    replaced location keeps its version of last change if its state is the
+    same, as in `location_state`.
+    """
+    read_header(data)
+    (offsets, old_values, removed, deltas_since) = _read_tables(data)
+    # keep indexes of values in copied records
+    values = dict((v, i) for (i, v) in enumerate(old_values))
+
+    replaced = {}
+    for (loc_id, d) in location_dicts.items():
+        changed = version
+        offset = _find_record(data, loc_id)
+        if offset is not None:
+            (old_id, old, old_changed) = _decode_location(data, offset, old_values)
+            if location_state(old) == location_state(d):
+                changed = old_changed
+        replaced[_utf8(loc_id)] = _encode_location(loc_id, d, changed, values)
+        removed.pop(loc_id, None)
+
+    records = list(replaced.items())
+    ends = list(offsets[1:]) + [len(data)]
+    for (start, end) in zip(offsets, ends):
+        key = _record_key(data, start)
+        if key not in replaced:
+            records.append((key, data[start:end]))
+    return _assemble({
+        'version': version, 'created': created, 'removed': removed,
+        'deltas_since': deltas_since}, records, values)
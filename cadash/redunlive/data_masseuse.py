@@ -1,90 +1,311 @@
 # -*- coding: utf-8 -*-
 
-from epipearl import Epipearl
 import logging
+import time
 
 from flask import current_app
+import requests
 
+from cadash import tracing
+from cadash.compat import ASYNCIO
+from cadash.extensions import cache
+from cadash.metrics import outcome
+from cadash.metrics import registry
+from cadash.redunlive.breaker import CircuitBreaker
+from cadash.redunlive.ca_stats import CaStatsEntries
+from cadash.redunlive.ca_stats import iter_json_array
+from cadash.redunlive.ca_stats import read_ca_stats
+from cadash.redunlive.client import get_epipearl_client
+from cadash.redunlive.errors import CaStatsUnavailableError
+from cadash.redunlive.history import HistoryRecorder
 from cadash.redunlive.models import CaptureAgent
 from cadash.redunlive.models import CaLocation
+from cadash.redunlive.poller import sync_all
+from cadash.redunlive.schedule import PollSchedule
+from cadash.utils import stream_cached_data
+from cadash.utils import stream_data_cached
 
-__all__ = ('map_redunlive_ca_loc')
+__all__ = ('load_ca_stats_entries', 'map_redunlive_ca_loc',
+           'prep_redunlive_data')
 
 
-def map_redunlive_ca_loc(data):
+def load_ca_stats_entries():
     """
-    massage json list of capture agents into list of locations.
+    pull ca_stats and return its entries, as in `read_ca_stats`.
 
-    :param: data: json string with list of dicts of CAs properties
+    entries are parsed again only when ca_stats changed; no capture agent
+    is polled.
     """
-    all_locations = {}
-    all_cas = {}
+    start = time.time()
+    result = 'ok'
+    try:
+        return _load_ca_stats_entries()
+    except CaStatsUnavailableError:
+        result = 'unavailable'
+        raise
+    except Exception as e:
+        result = outcome(e)
+        raise
+    finally:
+        registry.observe(
+                'cadash_ca_stats_fetch_seconds', time.time() - start,
+                outcome=result)
 
-    for ca_item in data:
-        loc_id = CaLocation.clean_name(ca_item['location'])
 
-        # create location object if not in internal map of locations
-        if loc_id not in all_locations:
-            all_locations[loc_id] = CaLocation(ca_item['location'])
-        loc = all_locations[loc_id]
+def _load_ca_stats_entries():
+    url = current_app.config['CA_STATS_JSON_URL']
+    cache_file = current_app.config['CA_STATS_CACHE_FILE']
+    stream = stream_data_cached(
+            url,
+            cache_file=cache_file,
+            creds={
+                'user': current_app.config['CA_STATS_USER'],
+                'pwd': current_app.config['CA_STATS_PASSWD']
+                },
+            timeout=current_app.config['CA_STATS_TIMEOUT'])
+    if stream is None:
+        raise CaStatsUnavailableError('ca_stats unavailable at (%s)' % url)
 
-        # check required ca_item property "address"
+    try:
+        with stream:
+            return _parse_ca_stats(stream)
+    except requests.RequestException as e:
+        # the body broke off while parsed; the partial parse is dropped, and
+        # the copy on disk, left as it was, is read instead
         logger = logging.getLogger(__name__)
-        if 'address' not in ca_item:
+        logger.warning(
+                'ca_stats download from (%s) broke off; error: %s' % (url, e))
+        stream = stream_cached_data(url, cache_file)
+    if stream is None:
+        raise CaStatsUnavailableError('ca_stats unavailable at (%s)' % url)
+    with stream:
+        return _parse_ca_stats(stream)
+
+
+def _parse_ca_stats(stream):
+    """entries of ca_stats in `stream`, parsed again only if changed."""
+    state = _state()
+    (fetched_at, entries) = state['ca_stats']
+    if stream.modified or fetched_at != stream.fetched_at:
+        # items are parsed as downloaded, and only their fingerprints kept;
+        # so the span includes the download of the body
+        with tracing.span('ca_stats_parse'):
+            entries = read_ca_stats(iter_json_array(stream))
+        state['ca_stats'] = (stream.fetched_at, entries)
+        if entries.errors:
+            logger = logging.getLogger(__name__)
             logger.warning(
-                    'missing "address" for capture agent in location(%s)'
-                    % ca_item['location'])
-            continue
+                    '%d capture agents left out of ca_stats; first: %s'
+                    % (len(entries.errors), entries.errors[0]))
+    return entries
+
+
+def prep_redunlive_data():
+    """read and parse data for redunlive."""
+    entries = load_ca_stats_entries()
+    state = _state()
+    previous = None
+    if current_app.config['REDUNLIVE_INCREMENTAL_MAPPING']:
+        previous = state['mapping']
+    state['mapping'] = map_redunlive_ca_loc(entries, previous=previous)
+    return state['mapping']
+
+
+def _state():
+    # ca_stats entries last parsed and last mapping, kept per app between calls
+    return current_app.extensions.setdefault(
+            'redunlive', {'ca_stats': (None, None), 'mapping': None})
+
+
+@tracing.traced('map_redunlive_ca_loc')
+def map_redunlive_ca_loc(data, previous=None):
+    """
+    massage json list of capture agents into list of locations.
+
+    when `previous` is the result of an earlier call, the mapping is
+    incremental: capture agents whose ca_stats entry did not change are
+    reused as they are, without polling the device again; locations whose
+    entries did not change are reused as well. only new or changed capture
+    agents are created and synced with the actual device, along with reused
+    capture agents that are due for a poll, as in the poll schedule.
+
+    :param: data: iterable of ca_stats items (dicts of CAs properties), or
+             CaStatsEntries as returned by `read_ca_stats`
+    :param: previous: dict returned by an earlier call, or None
+    :return: dict with 'all_locations' and 'all_cas', by id and serial
+             number; 'synced_cas' is the list of capture agents polled;
+             'errors' are the ca_stats items left out, as in CaStatsEntries
+    """
+    if previous is None:
+        previous = {
+                'all_locations': {}, 'all_cas': {},
+                'fingerprints': {}, 'location_fingerprints': {}}
+    schedule = previous.get('schedule') or PollSchedule(
+            live_interval=current_app.config['REDUNLIVE_POLL_LIVE_INTERVAL'],
+            idle_interval=current_app.config['REDUNLIVE_POLL_IDLE_INTERVAL'],
+            recent_window=current_app.config['REDUNLIVE_POLL_RECENT_WINDOW'])
+
+    all_locations = {}
+    all_cas = {}
+    fingerprints = {}
+    location_fingerprints = {}
+    location_of = {}
+    synced_cas = []
 
-        # check required ca_item property "serial_number"
-        serial_number = None
-        if 'ca_attributes' in ca_item and \
-                'serial_number' in ca_item['ca_attributes']:
-            serial_number = ca_item['ca_attributes']['serial_number']
+    if not isinstance(data, CaStatsEntries):
+        data = read_ca_stats(data)
+
+    for (loc_id, entries) in data.location_entries.items():
+        loc_fingerprint = tuple(fp for (serial, fp) in entries)
+
+        if previous['location_fingerprints'].get(loc_id) == loc_fingerprint:
+            # nothing changed in this location
+            loc = previous['all_locations'][loc_id]
+            for (serial_number, fingerprint) in entries:
+                all_cas[serial_number] = previous['all_cas'][serial_number]
         else:
-            logger.warning(
-                    'missing "serial_number" for CA(%s) in location(%s)'
-                    % (ca_item['address'], ca_item['location']))
+            loc = CaLocation(data.location_names[loc_id])
+            for (serial_number, fingerprint) in entries:
+                ca = None
+                if previous['fingerprints'].get(serial_number) == fingerprint:
+                    ca = previous['all_cas'][serial_number]
+                else:
+                    ca = _create_ca(serial_number, fingerprint)
+                    synced_cas.append(ca)
+
+                role = fingerprint[1]
+                if role == 'Primary':
+                    loc.primary_ca = ca
+                elif role == 'Secondary':
+                    loc.secondary_ca = ca
+                else:
+                    # not too worried about 'experimental' capture agents right now
+                    loc.experimental_cas.append(ca)
+
+                # add ca to internal list of ca's
+                all_cas[serial_number] = ca
+
+        for (serial_number, fingerprint) in entries:
+            fingerprints[serial_number] = fingerprint
+            location_of[serial_number] = loc_id
+        all_locations[loc_id] = loc
+        location_fingerprints[loc_id] = loc_fingerprint
+
+    # end __for loc_id in location_entries__
+
+    # reused capture agents due for a poll, earliest first
+    now = time.time()
+    schedule.retain(all_cas.keys())
+    before = dict((ca.serial_number, None) for ca in synced_cas)
+    for serial_number in schedule.pop_due(now):
+        if serial_number in all_cas and serial_number not in before:
+            ca = all_cas[serial_number]
+            before[serial_number] = _publish_types(ca)
+            synced_cas.append(ca)
+
+    # sync capture agents with actual devices, all at once
+    missed = sync_cas(synced_cas)
+
+    for ca in synced_cas:
+        if ca in missed:
+            # try again soon; queued devices were not polled at all
+            schedule.schedule(ca.serial_number, now + schedule.live_interval)
             continue
+        # new capture agents have no status to compare to; experimental
+        # capture agents are not part of the livestream
+        loc = all_locations[location_of[ca.serial_number]]
+        schedule.reschedule(
+                ca,
+                live=loc.active_livestream is not None and
+                ca in (loc.primary_ca, loc.secondary_ca),
+                changed=before[ca.serial_number] not in (None, _publish_types(ca)),
+                now=now)
 
-        ca = CaptureAgent(serial_number, ca_item['address'])
+    return {
+            'all_locations': all_locations,
+            'all_cas': all_cas,
+            'synced_cas': synced_cas,
+            'fingerprints': fingerprints,
+            'location_fingerprints': location_fingerprints,
+            'schedule': schedule,
+            'errors': data.errors,
+            }
+
+
+def _publish_types(ca):
+    return (ca.publish_type('live'), ca.publish_type('lowBR'))
 
-        if ca_item['role'] == 'Primary':
-            loc.primary_ca = ca
-        elif ca_item['role'] == 'Secondary':
-            loc.secondary_ca = ca
-        else:
-            # not too worried about 'experimental' capture agents right now
-            loc.experimental_cas.append(ca)
 
-        # find the live streaming channel
-        if 'channels' in ca_item['ca_attributes'] and \
-                isinstance(ca_item['ca_attributes']['channels'], dict):
-            for chan, info in ca_item['ca_attributes']['channels'].iteritems():
-                if 'live' in info['name'].lower():
-                    if 'lowbr' not in info['name'].lower():
-                        ca.channels['live']['channel'] = chan if chan else 'not available'
-                        if 'publish_type' in info:
-                            ca.channels['live']['publish_type'] = info['publish_type']
-                    else:
-                        ca.channels['lowBR']['channel'] = chan if chan else 'not available'
-                        if 'publish_type' in info:
-                            ca.channels['lowBR']['publish_type'] = info['publish_type']
+def _create_ca(serial_number, fingerprint):
+    """capture agent as in ca_stats entry with `fingerprint`, with client set."""
+    ca = CaptureAgent(serial_number, fingerprint[2])
+    ca.set_channel('live', fingerprint[4])
+    ca.set_publish_type('live', fingerprint[5])
+    ca.set_channel('lowBR', fingerprint[6])
+    ca.set_publish_type('lowBR', fingerprint[7])
+    set_epipearl_client(ca)
+    return ca
 
-        # add ca to internal list of ca's
-        all_cas[ca.serial_number] = ca
 
-        # sync capture agent object with actual device
-        set_epipearl_client(ca)
+def sync_cas(cas):
+    """sync capture agents, via asyncio if configured; return missed ones."""
+    start = time.time()
+    with tracing.span('fleet_poll'):
+        missed = _sync_cas(cas)
+    if cas:
+        # no devices due is not a poll
+        registry.observe('cadash_fleet_poll_seconds', time.time() - start)
+        registry.inc('cadash_fleet_poll_missed_total', len(missed))
+    # the poller may not serve requests, which flush metrics otherwise
+    registry.flush_due(cache.cache)
+    return missed
 
-    # end __for ca_item in data__
 
-    return {'all_locations': all_locations, 'all_cas': all_cas}
+def _sync_cas(cas):
+    config = current_app.config
+    if config['REDUNLIVE_ASYNC_POLLING']:
+        if not ASYNCIO:
+            logger = logging.getLogger(__name__)
+            logger.warning('asyncio polling requires python 3.5+; using threads')
+        else:
+            from cadash.redunlive import aio
+            return aio.sync_all(
+                    cas, config['EPIPEARL_USER'], config['EPIPEARL_PASSWD'],
+                    max_concurrency=config['REDUNLIVE_ASYNC_MAX_CONCURRENCY'],
+                    deadline=config['REDUNLIVE_POLL_DEADLINE'],
+                    timeout=(config['HTTP_CONNECT_TIMEOUT'],
+                             config['HTTP_READ_TIMEOUT']),
+                    retries=config['HTTP_RETRIES'],
+                    retry_backoff=config['HTTP_RETRY_BACKOFF'])
+
+    return sync_all(
+            cas,
+            max_workers=config['REDUNLIVE_POLL_WORKERS'],
+            deadline=config['REDUNLIVE_POLL_DEADLINE'])
 
 
 def set_epipearl_client(ca):
-    ca.client = Epipearl(
-            'http://%s' % ca.address,
+    """
+    set client, circuit breaker, history and metrics to talk to actual device.
+
+    does not sync status.
+    """
+    ca.client = get_epipearl_client(
+            ca.address,
             current_app.config['EPIPEARL_USER'],
             current_app.config['EPIPEARL_PASSWD'])
-    ca.sync_live_status()
+    ca.breaker = CircuitBreaker(
+            cache.cache,
+            threshold=current_app.config['REDUNLIVE_BREAKER_THRESHOLD'],
+            backoff=current_app.config['REDUNLIVE_BREAKER_BACKOFF'],
+            max_backoff=current_app.config['REDUNLIVE_BREAKER_MAX_BACKOFF'])
+    ca.history = get_history_recorder()
+    ca.metrics = registry
+
+
+def get_history_recorder():
+    """recorder of publish_type transitions in shared cache."""
+    return HistoryRecorder(
+            cache.cache,
+            capacity=current_app.config['REDUNLIVE_HISTORY_SIZE'],
+            timeout=current_app.config['REDUNLIVE_HISTORY_TTL'])
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""exceptions in redunlive module."""
+
+from cadash.errors import Error
+
+
+class CaStatsUnavailableError(Error):
+    """ca_stats data not available, nor a cached copy of it."""
+
+
+class DeviceRequestError(Error):
+    """request to capture agent failed."""
+
+
+class SnapshotFormatError(Error):
+    """data in cache is not a redunlive snapshot in a known format."""
+
+
+class CaStatsFormatError(Error):
+    """ca_stats data is not a json array."""
+
+
+class CaStatsItemError(Error):
+    """ca_stats entry for a capture agent misses required properties."""
+
+
+class FailoverInProgressError(Error):
+    """failover of location to another target still running."""
+
+    def __init__(self, message, job=None):
+        """create instance; `job` is the status dict of the running job."""
+        super(FailoverInProgressError, self).__init__(message)
+        self.job = job
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+fan-out of redunlive location changes to server-sent events streams.
+
+events are dicts with 'event' (type), 'id' (snapshot version) and 'data'.
+with redis as app cache, events go through redis pub/sub, so streams in any
+worker get changes published by the fleet poller or by any other worker;
+otherwise they stay in the process.
+"""
+import json
+import logging
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from flask import current_app
+from werkzeug.contrib.cache import RedisCache
+
+from cadash.extensions import cache
+
+__all__ = ('LocalEventBus', 'RedisEventBus', 'event_stream', 'format_event',
+           'get_event_bus')
+
+
+EVENTS_CHANNEL = 'redunlive:events'
+
+# events kept for a stream not read fast enough; when full, the stream
+# asks the browser to reload
+SUBSCRIPTION_QUEUE_SIZE = 1000
+
+# millisecs the browser waits before reconnecting a closed stream
+RETRY_MS = 3000
+
+# tells the browser it missed events and has to reload the page
+RELOAD = {'event': 'reload', 'id': None, 'data': {}}
+
+
+class LocalSubscription(object):
+    """events published in this process since subscribed."""
+
+    def __init__(self, bus):
+        self._bus = bus
+        self._queue = queue.Queue(maxsize=SUBSCRIPTION_QUEUE_SIZE)
+        self.lost = False
+
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.lost = True
+
+
+    def get(self, timeout):
+        """next event, or None if none in `timeout` secs."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+
+class LocalEventBus(object):
+    """fan-out to subscriptions in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+
+    def publish(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for s in subscriptions:
+            s.put(event)
+            if s.lost:
+                # e.g. stream closed before it was read
+                self.unsubscribe(s)
+
+
+    def subscribe(self):
+        subscription = LocalSubscription(self)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+
+class RedisSubscription(object):
+    """events published in redis channel since subscribed."""
+
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+        self.lost = False
+
+
+    def get(self, timeout):
+        """next event, or None if none in `timeout` secs."""
+        deadline = time.time() + timeout
+        while True:
+            # subscribe confirmations come as None, before the timeout
+            message = self._pubsub.get_message(
+                    timeout=max(0, deadline - time.time()))
+            if message is not None and message['type'] == 'message':
+                return json.loads(message['data'])
+            if time.time() >= deadline:
+                return None
+
+
+    def close(self):
+        self._pubsub.close()
+
+
+class RedisEventBus(object):
+    """fan-out to subscriptions in all processes, by redis pub/sub."""
+
+    def __init__(self, client, channel=EVENTS_CHANNEL):
+        self._client = client
+        self._channel = channel
+
+
+    def publish(self, event):
+        self._client.publish(self._channel, json.dumps(event))
+
+
+    def subscribe(self):
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self._channel)
+        return RedisSubscription(pubsub)
+
+
+def get_event_bus():
+    """event bus of current app; redis pub/sub when redis is the app cache."""
+    bus = current_app.extensions.get('redunlive_events')
+    if bus is None:
+        backend = cache.cache
+        if isinstance(backend, RedisCache):
+            bus = RedisEventBus(backend._client)
+        else:
+            bus = LocalEventBus()
+        bus = current_app.extensions.setdefault('redunlive_events', bus)
+    return bus
+
+
+def format_event(event):
+    """`event` as server-sent event text."""
+    lines = ['event: %s' % event['event']]
+    if event['id'] is not None:
+        lines.append('id: %s' % event['id'])
+    lines.append('data: %s' % json.dumps(event['data']))
+    return '\n'.join(lines) + '\n\n'
+
+
+def event_stream(subscription, replay, heartbeat, max_age):
+    """
+    yield server-sent events text: events in `replay`, then from `subscription`.
+
+    :param: replay: list of events missed by the browser, or None if not known
+    :param: heartbeat: secs between comments sent when there are no events,
+        so proxies do not close the connection
+    :param: max_age: secs to keep the stream open; the browser reconnects,
+        with the id of the last event, and the worker is freed meanwhile
+    """
+    logger = logging.getLogger(__name__)
+    try:
+        yield 'retry: %d\n\n' % RETRY_MS
+        if replay is None:
+            yield format_event(RELOAD)
+            return
+        for event in replay:
+            yield format_event(event)
+
+        deadline = time.time() + max_age
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            event = subscription.get(min(heartbeat, remaining))
+            if subscription.lost:
+                logger.info('redunlive events stream too slow, events lost')
+                yield format_event(RELOAD)
+                break
+            yield ': keepalive\n\n' if event is None else format_event(event)
+    finally:
+        subscription.close()
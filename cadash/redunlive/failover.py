@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""failover of a location livestream, as background jobs."""
+import logging
+import threading
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+from cadash.extensions import cache
+from cadash.redunlive.data_masseuse import set_epipearl_client
+from cadash.redunlive.errors import FailoverInProgressError
+from cadash.redunlive.snapshot import location_from_dict
+from cadash.redunlive.snapshot import update_snapshot_location
+
+__all__ = ('get_batch_report', 'get_job', 'get_location_job',
+           'submit_bulk_failover', 'submit_failover')
+
+
+JOB_KEY_PREFIX = 'redunlive:failover:job:'
+LOCATION_JOB_KEY_PREFIX = 'redunlive:failover:location:'
+BATCH_KEY_PREFIX = 'redunlive:failover:batch:'
+TAKEOVER_KEY_PREFIX = 'redunlive:failover:takeover:'
+
+# secs to keep job status around after last change
+JOB_TTL = 3600
+
+# job states, and valid transitions between them
+QUEUED = 'queued'
+SWITCHING = 'switching'
+SYNCING = 'syncing'
+DONE = 'done'
+FAILED = 'failed'
+
+TRANSITIONS = {
+        QUEUED: (SWITCHING, FAILED),
+        SWITCHING: (SYNCING, FAILED),
+        SYNCING: (DONE, FAILED),
+        DONE: (),
+        FAILED: (),
+        }
+
+# failover jobs run in this process, in a pool created on first use
+_executor = None
+_executor_lock = threading.Lock()
+# jobs submitted to the pool and not finished, to set deadlines of queued jobs
+_pending = [0]
+_pending_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                        max_workers=current_app.config['REDUNLIVE_FAILOVER_WORKERS'])
+    return _executor
+
+
+def _job_key(job_id):
+    return '%s%s' % (JOB_KEY_PREFIX, job_id)
+
+
+def _location_job_key(loc_id):
+    return '%s%s' % (LOCATION_JOB_KEY_PREFIX, loc_id)
+
+
+def _batch_key(batch_id):
+    return '%s%s' % (BATCH_KEY_PREFIX, batch_id)
+
+
+def _takeover_key(loc_id, job_id):
+    return '%s%s:%s' % (TAKEOVER_KEY_PREFIX, loc_id, job_id)
+
+
+def _add_pending(n):
+    with _pending_lock:
+        _pending[0] += n
+        return _pending[0]
+
+
+def _check_lost(job):
+    """`job`, or a failed copy if past its deadline and not finished."""
+    if job is None or is_finished(job) or \
+            time.time() <= job.get('deadline', float('inf')):
+        return job
+    lost = dict(job)
+    lost['state'] = FAILED
+    lost['error'] = 'job lost: no progress since %s, in step "%s"' % (
+            time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(job['updated'])),
+            job['step'] or job['state'])
+    return lost
+
+
+def get_job(job_id):
+    """
+    return status dict for failover job `job_id`, or None if unknown.
+
+    a job not finished by its deadline, as when its worker died, is
+    reported failed.
+    """
+    return _check_lost(cache.get(_job_key(job_id)))
+
+
+def get_location_job(loc_id):
+    """return status dict of last failover job for location, or None."""
+    job_id = cache.get(_location_job_key(loc_id))
+    return None if job_id is None else get_job(job_id)
+
+
+def is_finished(job):
+    return job['state'] in (DONE, FAILED)
+
+
+def _save_job(job):
+    job['updated'] = time.time()
+    # a queued job waits for the jobs ahead in the pool too
+    timeout = current_app.config['REDUNLIVE_FAILOVER_JOB_TIMEOUT']
+    if job['state'] == QUEUED:
+        timeout *= 1 + _add_pending(0) // current_app.config['REDUNLIVE_FAILOVER_WORKERS']
+    job['deadline'] = job['updated'] + timeout
+    cache.set(_job_key(job['id']), job, timeout=JOB_TTL)
+
+
+def _transition(job, state, step=None):
+    """move `job` to `state`; raise ValueError if not a valid transition."""
+    if state not in TRANSITIONS[job['state']]:
+        raise ValueError(
+                'invalid failover job transition from %s to %s' %
+                (job['state'], state))
+    job['state'] = state
+    job['step'] = step
+    _save_job(job)
+
+
+def failover_steps(location, target):
+    """
+    list of (description, capture agent, publish_type) to failover to `target`.
+
+    toggling from backup to primary requires a start over of the backup, so
+    akamai detects the switch for sure.
+    """
+    primary = location.primary_ca
+    secondary = location.secondary_ca
+    if target == 'primary':
+        return [
+                ('start primary streaming', primary, '6'),
+                ('stop secondary streaming', secondary, '0'),
+                ('start secondary streaming', secondary, '6'),
+                ]
+    else:
+        return [
+                ('make sure secondary is streaming', secondary, '6'),
+                ('stop primary streaming', primary, '0'),
+                ]
+
+
+def _claim_location(loc_id, job_id):
+    """
+    make `job_id` the failover job of location; None if so, else running job.
+
+    the location key is claimed with an atomic add (of the backend: the
+    flask-cache proxy drops its result), so only one of concurrent
+    submitters gets it; a finished or lost job is replaced by one submitter
+    only, the one that adds the takeover key for that job.
+    """
+    key = _location_job_key(loc_id)
+    for i in range(3):
+        if cache.cache.add(key, job_id, timeout=JOB_TTL):
+            return None
+        current_id = cache.get(key)
+        if current_id is None:
+            # expired since add; try again
+            continue
+        current = get_job(current_id)
+        if current is not None and not is_finished(current):
+            return current
+        takeover_key = _takeover_key(loc_id, current_id)
+        if cache.cache.add(takeover_key, job_id, timeout=JOB_TTL):
+            cache.set(key, job_id, timeout=JOB_TTL)
+            return None
+        winner = get_job(cache.get(takeover_key))
+        if winner is not None and not is_finished(winner):
+            return winner
+    # key kept expiring, or jobs finishing as we look; last one wins
+    cache.set(key, job_id, timeout=JOB_TTL)
+    return None
+
+
+def submit_failover(location_dict, target):
+    """
+    queue failover of location to `target` ('primary' or 'secondary').
+
+    `location_dict` is the location as in the redunlive snapshot. returns the
+    job status dict; if a failover of the location to `target` is still
+    running, returns that job instead of queuing another one. raises
+    FailoverInProgressError if running to the other target.
+    """
+    logger = logging.getLogger(__name__)
+    loc_id = location_dict['id']
+
+    now = time.time()
+    job = {
+            'id': uuid.uuid4().hex,
+            'loc_id': loc_id,
+            'target': target,
+            'state': QUEUED,
+            'step': None,
+            'error': None,
+            'active_livestream': None,
+            'settle_times': [],
+            'created': now,
+            'updated': now,
+            }
+    # saved before claiming, so others see it running once claimed
+    _save_job(job)
+    running = _claim_location(loc_id, job['id'])
+    if running is not None:
+        cache.delete(_job_key(job['id']))
+        if running['target'] != target:
+            raise FailoverInProgressError(
+                    'failover of location(%s) to %s in progress; job(%s)' %
+                    (loc_id, running['target'], running['id']), job=running)
+        logger.info(
+                'failover of location(%s) already in progress; job(%s)' %
+                (loc_id, running['id']))
+        return running
+
+    app = current_app._get_current_object()
+    _add_pending(1)
+    _get_executor().submit(_run_job, app, job, location_dict)
+    logger.info(
+            'failover of location(%s) to %s queued; job(%s)' %
+            (loc_id, target, job['id']))
+    return job
+
+
+def submit_bulk_failover(locations, loc_ids, target):
+    """
+    queue failover of each location in `loc_ids` to `target`.
+
+    `locations` are the location dicts in the redunlive snapshot, by id.
+    jobs run in parallel, at most REDUNLIVE_FAILOVER_WORKERS at a time per
+    process. returns the batch report, as in `get_batch_report`.
+    """
+    logger = logging.getLogger(__name__)
+    batch = {
+            'id': uuid.uuid4().hex,
+            'target': target,
+            'created': time.time(),
+            'jobs': {},
+            'not_found': [],
+            # location: id of job running to the other target
+            'conflicts': {},
+            }
+    for loc_id in loc_ids:
+        if loc_id in batch['jobs'] or loc_id in batch['not_found'] or \
+                loc_id in batch['conflicts']:
+            continue
+        if loc_id not in locations:
+            batch['not_found'].append(loc_id)
+            continue
+        try:
+            job = submit_failover(locations[loc_id], target)
+        except FailoverInProgressError as e:
+            batch['conflicts'][loc_id] = e.job['id']
+            continue
+        batch['jobs'][loc_id] = job['id']
+
+    cache.set(_batch_key(batch['id']), batch, timeout=JOB_TTL)
+    logger.info(
+            'bulk failover to %s queued for %d locations; batch(%s)' %
+            (target, len(batch['jobs']), batch['id']))
+    return _batch_report(batch)
+
+
+def get_batch_report(batch_id):
+    """return report of bulk failover `batch_id`, or None if unknown."""
+    batch = cache.get(_batch_key(batch_id))
+    return None if batch is None else _batch_report(batch)
+
+
+def _batch_report(batch):
+    """per-location state of jobs in `batch`, and count of jobs per state."""
+    loc_ids = sorted(batch['jobs'].keys())
+    jobs = cache.get_many(*[_job_key(batch['jobs'][l]) for l in loc_ids]) \
+            if loc_ids else []
+
+    report = {}
+    for (loc_id, job) in zip(loc_ids, [_check_lost(j) for j in jobs]):
+        if job is None:
+            report[loc_id] = {
+                    'job_id': batch['jobs'][loc_id], 'state': 'unknown',
+                    'active_livestream': None, 'error': 'job status expired'}
+        else:
+            report[loc_id] = {
+                    'job_id': job['id'], 'state': job['state'],
+                    'active_livestream': job['active_livestream'],
+                    'error': job['error']}
+    for loc_id in batch['not_found']:
+        report[loc_id] = {
+                'job_id': None, 'state': FAILED,
+                'active_livestream': None, 'error': 'location not found'}
+    for (loc_id, job_id) in batch.get('conflicts', {}).items():
+        report[loc_id] = {
+                'job_id': None, 'state': FAILED, 'active_livestream': None,
+                'error': 'failover to other target in progress; job(%s)' % job_id}
+
+    summary = {}
+    for r in report.values():
+        summary[r['state']] = summary.get(r['state'], 0) + 1
+
+    return {
+            'id': batch['id'],
+            'target': batch['target'],
+            'created': batch['created'],
+            'finished': all(
+                r['state'] in (DONE, FAILED, 'unknown') for r in report.values()),
+            'summary': summary,
+            'locations': report,
+            }
+
+
+def _run_job(app, job, location_dict):
+    with app.app_context():
+        try:
+            run_failover(job, location_dict)
+        except Exception as e:
+            logger = logging.getLogger(__name__)
+            logger.error(
+                    'failover job(%s) for location(%s) failed: %s' %
+                    (job['id'], job['loc_id'], e))
+            job['error'] = str(e)
+            if not is_finished(job):
+                _transition(job, FAILED)
+        finally:
+            _add_pending(-1)
+
+
+def run_failover(job, location_dict):
+    """run failover `job` to completion, saving state at each step."""
+    logger = logging.getLogger(__name__)
+    location = location_from_dict(location_dict)
+
+    if location.active_livestream is None:
+        job['error'] = 'no active livestream; nothing to switch'
+        _transition(job, FAILED)
+        return job
+
+    set_epipearl_client(location.primary_ca)
+    set_epipearl_client(location.secondary_ca)
+
+    # each step waits for the device to apply the publish_type, no longer
+    config = current_app.config
+    _transition(job, SWITCHING)
+    for (step, ca, publish_type) in failover_steps(location, job['target']):
+        _update_step(job, step)
+        logger.debug('failover job(%s): %s' % (job['id'], step))
+        ca.write_live_status(publish_type)
+        secs = ca.wait_for_publish_type(
+                publish_type,
+                deadline=config['REDUNLIVE_FAILOVER_SETTLE_DEADLINE'],
+                interval=config['REDUNLIVE_FAILOVER_SETTLE_INTERVAL'])
+        job.setdefault('settle_times', []).append({
+                'step': step,
+                'serial_number': ca.serial_number,
+                'publish_type': publish_type,
+                'secs': secs})
+
+    # make sure we have the device status
+    _transition(job, SYNCING, 'sync capture agents status')
+    location.primary_ca.sync_live_status()
+    location.secondary_ca.sync_live_status()
+    update_snapshot_location(location)
+
+    job['active_livestream'] = location.active_livestream
+    if job['active_livestream'] == job['target']:
+        _transition(job, DONE)
+    else:
+        job['error'] = 'active livestream is %s after failover' % \
+                job['active_livestream']
+        _transition(job, FAILED)
+    return job
+
+
+def _update_step(job, step):
+    job['step'] = step
+    _save_job(job)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""rendered html of redunlive locations, cached per process."""
+import hashlib
+import threading
+
+from flask import current_app
+from flask import Markup
+from flask import render_template
+from flask import request
+
+from cadash.redunlive.snapshot import location_from_dict
+
+__all__ = ('FragmentCache', 'get_fragment_cache', 'render_location',
+           'render_locations')
+
+
+LOCATION_TEMPLATE = 'redunlive/_location.html'
+
+
+class FragmentCache(object):
+    """
+    rendered fragments by key, up to `max_size`.
+
+    when full, all fragments are dropped; they are rendered again as
+    requested, so the cache only holds what current pages use.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._fragments = {}
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key):
+        fragment = self._fragments.get(key)
+        if fragment is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return fragment
+
+
+    def set(self, key, fragment):
+        with self._lock:
+            if len(self._fragments) >= self.max_size:
+                self._fragments.clear()
+            self._fragments[key] = fragment
+
+
+    def __len__(self):
+        return len(self._fragments)
+
+
+def get_fragment_cache():
+    """fragment cache of current app."""
+    fragments = current_app.extensions.get('redunlive_fragments')
+    if fragments is None:
+        fragments = current_app.extensions.setdefault(
+                'redunlive_fragments',
+                FragmentCache(current_app.config['REDUNLIVE_FRAGMENT_CACHE_SIZE']))
+    return fragments
+
+
+def template_version(name):
+    """
+    hash of the source of template `name`; recomputed when the template
+    changes on disk, if jinja is set to auto reload.
+    """
+    versions = current_app.extensions.setdefault(
+            'redunlive_template_versions', {})
+    (version, uptodate) = versions.get(name, (None, None))
+    if version is None or (current_app.jinja_env.auto_reload and
+                           uptodate is not None and not uptodate()):
+        (source, filename, uptodate) = current_app.jinja_env.loader.get_source(
+                current_app.jinja_env, name)
+        version = hashlib.sha1(source.encode('utf-8')).hexdigest()
+        versions[name] = (version, uptodate)
+    return version
+
+
+def _ca_key(ca):
+    if ca is None:
+        return (None, None)
+    return (ca['address'], ca['channels']['live']['publish_type'])
+
+
+def render_key(loc_dict):
+    """
+    what the rendered location depends on, in location dict `loc_dict`:
+    its id and name, and address and live publish_type of its primary and
+    secondary capture agents.
+    """
+    return (loc_dict['id'], loc_dict['name']) + \
+        _ca_key(loc_dict['primary_ca']) + _ca_key(loc_dict['secondary_ca'])
+
+
+def render_locations(loc_dicts):
+    """
+    list of html of location dicts `loc_dicts`, as in the location template.
+
+    only locations not rendered before in the same state are rendered.
+    """
+    # urls in the fragment depend on where the app is mounted
+    prefix = (template_version(LOCATION_TEMPLATE), request.script_root)
+    fragments = get_fragment_cache()
+    result = []
+    for loc_dict in loc_dicts:
+        key = prefix + render_key(loc_dict)
+        fragment = fragments.get(key)
+        if fragment is None:
+            fragment = Markup(render_template(
+                LOCATION_TEMPLATE, loc=location_from_dict(loc_dict)))
+            fragments.set(key, fragment)
+        result.append(fragment)
+    return result
+
+
+def render_location(loc_dict):
+    """html of location dict `loc_dict`, as in the location template."""
+    return render_locations([loc_dict])[0]
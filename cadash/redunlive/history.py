@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""history of publish_type transitions per capture agent."""
+from array import array
+import struct
+import sys
+import threading
+
+from redis.exceptions import WatchError
+from werkzeug.contrib.cache import RedisCache
+
+__all__ = ('HistoryRecorder', 'StatusHistory')
+
+
+CHANNELS = ('live', 'lowBR')
+NOT_AVAILABLE = -1
+
+
+def _encode_publish_type(publish_type):
+    try:
+        value = int(publish_type)
+    except (TypeError, ValueError):
+        return NOT_AVAILABLE
+    return value if 0 <= value < 128 else NOT_AVAILABLE
+
+
+def _decode_publish_type(value):
+    return 'not available' if value == NOT_AVAILABLE else str(value)
+
+
+# arrays are stored big-endian, as the header and entries
+_SWAP = sys.byteorder == 'little'
+
+
+def _tobytes(a):
+    if _SWAP and a.itemsize > 1:
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes() if hasattr(a, 'tobytes') else a.tostring()
+
+
+def _frombytes(a, data):
+    if hasattr(a, 'frombytes'):
+        a.frombytes(data)
+    else:
+        a.fromstring(data)
+    if _SWAP and a.itemsize > 1:
+        a.byteswap()
+
+
+class StatusHistory(object):
+    """
+    fixed-size ring buffer of (timestamp, channel, publish_type, latency).
+
+    entries are kept in parallel arrays, so an entry takes 18 bytes and a
+    full history `capacity` * 18 bytes; when full, the oldest entry is
+    overwritten.
+    """
+
+    # capacity, start, count
+    HEADER = struct.Struct('!HHH')
+    # timestamp, latency, channel, publish_type; one entry as recorded
+    ENTRY = struct.Struct('!ddbb')
+
+    def __init__(self, capacity=64):
+        """create instance."""
+        self.capacity = capacity
+        self._timestamps = array('d', [0.0] * capacity)
+        self._latencies = array('d', [0.0] * capacity)
+        self._channels = array('b', [0] * capacity)
+        self._publish_types = array('b', [0] * capacity)
+        self._start = 0
+        self._count = 0
+
+
+    def __len__(self):
+        return self._count
+
+
+    def append(self, timestamp, channel, publish_type, latency):
+        """add entry, overwriting the oldest one if full."""
+        if self._count < self.capacity:
+            i = (self._start + self._count) % self.capacity
+            self._count += 1
+        else:
+            i = self._start
+            self._start = (self._start + 1) % self.capacity
+        self._timestamps[i] = timestamp
+        self._latencies[i] = latency
+        self._channels[i] = CHANNELS.index(channel)
+        self._publish_types[i] = _encode_publish_type(publish_type)
+
+
+    def append_packed(self, data):
+        """add entry packed with `pack_entry`."""
+        (timestamp, latency, channel, publish_type) = self.ENTRY.unpack(data)
+        self.append(
+                timestamp, CHANNELS[channel],
+                _decode_publish_type(publish_type), latency)
+
+
+    @classmethod
+    def pack_entry(cls, timestamp, channel, publish_type, latency):
+        return cls.ENTRY.pack(
+                timestamp, latency, CHANNELS.index(channel),
+                _encode_publish_type(publish_type))
+
+
+    def entries(self, since=None):
+        """list of entries as dicts, oldest first; only newer than `since`."""
+        result = []
+        for n in range(self._count):
+            i = (self._start + n) % self.capacity
+            if since is not None and self._timestamps[i] <= since:
+                continue
+            result.append({
+                    'timestamp': self._timestamps[i],
+                    'channel': CHANNELS[self._channels[i]],
+                    'publish_type': _decode_publish_type(self._publish_types[i]),
+                    'latency': self._latencies[i]})
+        return result
+
+
+    def to_bytes(self):
+        """compact binary form, to store in cache."""
+        return self.HEADER.pack(self.capacity, self._start, self._count) + \
+                _tobytes(self._timestamps) + _tobytes(self._latencies) + \
+                _tobytes(self._channels) + _tobytes(self._publish_types)
+
+
+    @classmethod
+    def from_bytes(cls, data, capacity=None):
+        """
+        history from `to_bytes` output.
+
+        if `capacity` differs from the stored one, the newest entries that
+        fit are kept.
+        """
+        (stored_capacity, start, count) = cls.HEADER.unpack_from(data)
+        history = cls(stored_capacity)
+        offset = cls.HEADER.size
+        for (a, size) in [
+                (history._timestamps, 8), (history._latencies, 8),
+                (history._channels, 1), (history._publish_types, 1)]:
+            del a[:]
+            _frombytes(a, data[offset:offset + size * stored_capacity])
+            offset += size * stored_capacity
+        history._start = start
+        history._count = count
+
+        if capacity is None or capacity == stored_capacity:
+            return history
+        resized = cls(capacity)
+        for e in history.entries():
+            resized.append(
+                    e['timestamp'], e['channel'], e['publish_type'], e['latency'])
+        return resized
+
+
+def _last_publish_type(packed_entries, channel):
+    """publish_type code of newest entry for `channel`, or None."""
+    code = CHANNELS.index(channel)
+    for data in reversed(packed_entries):
+        entry = StatusHistory.ENTRY.unpack(data)
+        if entry[2] == code:
+            return entry[3]
+    return None
+
+
+class HistoryRecorder(object):
+    """
+    records publish_type transitions of capture agents in a cache.
+
+    the history of a device is a list of packed entries, oldest first: with
+    redis as cache, a redis list appended with optimistic locking (WATCH on
+    the list), so workers never drop each other's entries. other caches
+    keep the list as one value, updated under a lock of this process.
+    """
+
+    KEY_PREFIX = 'redunlive:history:list:'
+
+    # for caches other than redis, which are per process anyway
+    _local_lock = threading.Lock()
+
+    def __init__(self, backend, capacity=64, timeout=7 * 24 * 3600):
+        """create instance; `backend` is a werkzeug cache."""
+        self._backend = backend
+        self.capacity = capacity
+        self.timeout = timeout
+
+
+    def _key(self, device):
+        return '%s%s' % (self.KEY_PREFIX, device)
+
+
+    def get(self, device):
+        """StatusHistory of `device`; empty if nothing recorded."""
+        history = StatusHistory(self.capacity)
+        for data in self._entries(device):
+            history.append_packed(data)
+        return history
+
+
+    def _entries(self, device):
+        if isinstance(self._backend, RedisCache):
+            name = self._backend.key_prefix + self._key(device)
+            return self._backend._client.lrange(name, 0, -1)
+        return self._backend.get(self._key(device)) or []
+
+
+    def record(self, device, timestamp, channel, publish_type, latency):
+        """
+        add entry for `device` channel, if `publish_type` is a transition
+        from the newest entry stored for that channel; return True if added.
+
+        always compared with the stored entries, as other capture agent
+        objects, e.g. of failover jobs, record for the same device.
+        """
+        code = _encode_publish_type(publish_type)
+        entry = StatusHistory.pack_entry(timestamp, channel, publish_type, latency)
+        if isinstance(self._backend, RedisCache):
+            return self._record_redis(device, channel, code, entry)
+        return self._record_local(device, channel, code, entry)
+
+
+    def _record_redis(self, device, channel, code, entry):
+        name = self._backend.key_prefix + self._key(device)
+        with self._backend._client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(name)
+                    if _last_publish_type(pipe.lrange(name, 0, -1), channel) == code:
+                        pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    pipe.rpush(name, entry)
+                    pipe.ltrim(name, -self.capacity, -1)
+                    pipe.expire(name, self.timeout)
+                    pipe.execute()
+                    return True
+                except WatchError:
+                    # another worker added an entry; look again
+                    continue
+
+
+    def _record_local(self, device, channel, code, entry):
+        key = self._key(device)
+        with self._local_lock:
+            entries = self._backend.get(key) or []
+            if _last_publish_type(entries, channel) == code:
+                return False
+            entries = (entries + [entry])[-self.capacity:]
+            self._backend.set(key, entries, timeout=self.timeout)
+            return True
@@ -2,8 +2,126 @@
 """models for redunlive module."""
 import arrow
 import logging
+from numbers import Real
+import time
 
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # python 2
+    from collections import MutableMapping
+
+from cadash import tracing
 from cadash import utils
+from cadash.metrics import outcome
+from cadash.redunlive.poller import call_concurrently
+
+
+NOT_AVAILABLE = 'not available'
+
+# channel numbers and publish_types repeat across the whole fleet; keep one
+# copy of each, up to a max so bogus device responses don't grow the table
+_STATES_MAX = 1024
+_states = {NOT_AVAILABLE: NOT_AVAILABLE}
+
+
+def _intern(value):
+    interned = _states.get(value)
+    if interned is not None:
+        return interned
+    if len(_states) < _STATES_MAX:
+        _states[value] = value
+    return value
+
+
+# capture agent slot of each channel field
+_FIELDS = {
+        'live': {
+            'channel': '_live_channel',
+            'publish_type': '_live_publish_type'},
+        'lowBR': {
+            'channel': '_lowBR_channel',
+            'publish_type': '_lowBR_publish_type'},
+        }
+
+
+class ChannelView(MutableMapping):
+    """
+    dict-like view of a capture agent channel, with keys 'channel' and
+    'publish_type'; reads and writes the capture agent fields.
+    """
+
+    __slots__ = ('_ca', '_fields')
+
+    def __init__(self, ca, chan_name):
+        self._ca = ca
+        self._fields = _FIELDS[chan_name]
+
+
+    def __getitem__(self, key):
+        return getattr(self._ca, self._fields[key])
+
+
+    def __setitem__(self, key, value):
+        setattr(self._ca, self._fields[key], _intern(value))
+
+
+    def __delitem__(self, key):
+        raise TypeError('capture agent channel fields cannot be deleted')
+
+
+    def __iter__(self):
+        return iter(('channel', 'publish_type'))
+
+
+    def __len__(self):
+        return 2
+
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class ChannelsView(MutableMapping):
+    """
+    dict-like view of capture agent channels 'live' and 'lowBR'.
+
+    setting a channel replaces it, as in the dict it used to be: fields not
+    given are 'not available'.
+    """
+
+    __slots__ = ('_ca',)
+
+    def __init__(self, ca):
+        self._ca = ca
+
+
+    def __getitem__(self, chan_name):
+        return ChannelView(self._ca, chan_name)
+
+
+    def __setitem__(self, chan_name, value):
+        fields = _FIELDS[chan_name]
+        for key in value:
+            if key not in fields:
+                raise KeyError(key)
+        for (key, slot) in fields.items():
+            setattr(self._ca, slot, _intern(value.get(key, NOT_AVAILABLE)))
+
+
+    def __delitem__(self, chan_name):
+        raise TypeError('capture agent channels cannot be deleted')
+
+
+    def __iter__(self):
+        return iter(('live', 'lowBR'))
+
+
+    def __len__(self):
+        return 2
+
+
+    def __repr__(self):
+        return repr(dict((k, dict(v)) for (k, v) in self.items()))
 
 
 class CaptureAgent(object):
@@ -12,8 +130,20 @@ class CaptureAgent(object):
 
     the device is the source of truth, and when unreachable, the proxy status
     is 'not available'
+
+    one instance per device is kept in every app worker, so state is kept in
+    slots rather than dicts; `channels` is a dict-like view of it, created
+    on each access. hot paths use `channel` and `publish_type` instead.
     """
 
+    __slots__ = (
+            '_serial_number', '_address', '_name', 'client', 'breaker',
+            'history', 'metrics', '_last_update', '_live_channel', '_live_publish_type',
+            '_lowBR_channel', '_lowBR_publish_type')
+
+    # 2000-01-01T00:00:00+00:00
+    NEVER_UPDATED = 946684800.0
+
     def __init__(self, serial_number, address):
         self._serial_number = serial_number
         self._address = address
@@ -22,17 +152,16 @@ class CaptureAgent(object):
         self._name = self.clean_name(name)
 
         self.client = None
-        self._last_update = arrow.get(2000, 1, 1)
+        self.breaker = None
+        self.history = None
+        self.metrics = None
+        self._last_update = self.NEVER_UPDATED
 
         # for now, the livestream channel# must be set externally
-        self.channels = {
-                'live': {
-                    'channel': 'not available',
-                    'publish_type': 'not available'},
-                'lowBR': {
-                    'channel': 'not available',
-                    'publish_type': 'not available'},
-            }
+        self._live_channel = NOT_AVAILABLE
+        self._live_publish_type = NOT_AVAILABLE
+        self._lowBR_channel = NOT_AVAILABLE
+        self._lowBR_publish_type = NOT_AVAILABLE
 
 
     @staticmethod
@@ -40,6 +169,21 @@ class CaptureAgent(object):
         return utils.clean_name(name)
 
 
+    def copy(self):
+        """copy of this capture agent; client, breaker, history are shared."""
+        other = CaptureAgent.__new__(CaptureAgent)
+        for attr in CaptureAgent.__slots__:
+            setattr(other, attr, getattr(self, attr))
+        return other
+
+
+    def copy_live_status(self, other):
+        """set publish_types and last_update as in capture agent `other`."""
+        self._live_publish_type = other._live_publish_type
+        self._lowBR_publish_type = other._lowBR_publish_type
+        self._last_update = other._last_update
+
+
     @property
     def serial_number(self):
         return self._serial_number
@@ -50,8 +194,44 @@ class CaptureAgent(object):
         return self._address
 
 
+    @property
+    def channels(self):
+        return ChannelsView(self)
+
+
+    def channel(self, chan_name):
+        """channel number of `chan_name` ('live' or 'lowBR')."""
+        return getattr(self, _FIELDS[chan_name]['channel'])
+
+
+    def publish_type(self, chan_name):
+        """publish_type of `chan_name` ('live' or 'lowBR')."""
+        return getattr(self, _FIELDS[chan_name]['publish_type'])
+
+
+    def set_channel(self, chan_name, value):
+        setattr(self, _FIELDS[chan_name]['channel'], _intern(value))
+
+
+    def set_publish_type(self, chan_name, value):
+        setattr(self, _FIELDS[chan_name]['publish_type'], _intern(value))
+
+
     @property
     def last_update(self):
+        return arrow.get(self._last_update)
+
+    @last_update.setter
+    def last_update(self, value):
+        if isinstance(value, Real):
+            self._last_update = float(value)
+        else:
+            self._last_update = arrow.get(value).float_timestamp
+
+
+    @property
+    def last_update_timestamp(self):
+        """last_update as epoch secs."""
         return self._last_update
 
 
@@ -61,77 +241,134 @@ class CaptureAgent(object):
 
 
     def __get_channel_publish_type(self, chan_name):
-        chan = self.channels[chan_name]
+        channel = self.channel(chan_name)
 
         logger = logging.getLogger(__name__)
         logger.debug(
                 'device(%s) channel(%s) is (%s)' %
-                (self.name, chan_name, chan['channel']))
+                (self.name, chan_name, channel))
 
-        if chan['channel'] == 'not available' or self.client is None:
+        if channel == 'not available' or self.client is None:
             return 'not available'
 
+        start = time.time()
         try:
             response = self.client.get_params(
-                    channel=chan['channel'], params={'publish_type': ''})
-            self._last_update = arrow.utcnow()
+                    channel=channel, params={'publish_type': ''})
+            self._last_update = time.time()
 
             logger.debug(
                     'device(%s) channel(%s)=(%s) publish_type=(%s)' %
-                    (self.name, chan_name, chan['channel'], response))
+                    (self.name, chan_name, channel, response))
 
         except Exception as e:
             logger.warning(
-                    'CA(%s) unable to get channel(%s) publish_type. error: %s' %
-                    (self.name, chan_name, e.message))
+                    'CA(%s) unable to get channel(%s) publish_type. error: %r' %
+                    (self.name, chan_name, e))
+            self.__record_request('get_params', chan_name, time.time() - start, e)
+            self.__record_call(False)
+            self.__record_transition(
+                    chan_name, 'not available', time.time() - start)
 
             return 'not available'
         else:
-            return response['publish_type'] \
+            self.__record_request('get_params', chan_name, time.time() - start)
+            self.__record_call(True)
+            publish_type = response['publish_type'] \
                     if 'publish_type' in response else 'not available'
+            self.__record_transition(
+                    chan_name, publish_type, time.time() - start)
+            return publish_type
 
 
     def __set_channel_publish_type(self, chan_name, value):
-        chan = self.channels[chan_name]
-        if chan['channel'] == 'not available' or self.client is None:
+        channel = self.channel(chan_name)
+        if channel == 'not available' or self.client is None:
             return 'not available'
 
         logger = logging.getLogger(__name__)
+        start = time.time()
         try:
             self.client.set_params(
-                    channel=self.channels[chan_name]['channel'],
-                    params={'publish_type': value})
-            self._last_update = arrow.utcnow()
+                    channel=channel, params={'publish_type': value})
+            self._last_update = time.time()
         except Exception as e:
             logger.warning(
-                    'CA(%s) unable to set channel(%s) publish_type to %s. error: %s'
-                    % (self.name, chan_name, value, e.message))
+                    'CA(%s) unable to set channel(%s) publish_type to %s. error: %r'
+                    % (self.name, chan_name, value, e))
+            self.__record_request('set_params', chan_name, time.time() - start, e)
+            self.__record_call(False)
+            self.__record_transition(
+                    chan_name, 'not available', time.time() - start)
             return 'not available'
 
         else:
+            self.__record_request('set_params', chan_name, time.time() - start)
+            self.__record_call(True)
+            self.__record_transition(chan_name, value, time.time() - start)
             logger.warning(
                     'CA(%s) channel(%s) publish_type set to %s'
                     % (self.name, chan_name, value))
             return value
 
 
+    def __record_call(self, success):
+        if self.breaker is not None:
+            if success:
+                self.breaker.record_success(self.serial_number)
+            else:
+                self.breaker.record_failure(self.serial_number)
+
+
+    def __record_request(self, call, chan_name, latency, error=None):
+        tracing.record('device_%s' % call, time.time() - latency, latency)
+        if self.metrics is not None:
+            self.metrics.inc(
+                    'cadash_device_calls_total', device=self.name,
+                    channel=chan_name, call=call, outcome=outcome(error))
+            self.metrics.observe(
+                    'cadash_device_call_seconds', latency, device=self.name,
+                    channel=chan_name, call=call)
+
+
+    def __record_transition(self, chan_name, publish_type, latency):
+        # only changes of publish_type go into history; the recorder compares
+        # with the newest stored entry, as this object may be new
+        if self.history is not None:
+            self.history.record(
+                    self.serial_number, time.time(), chan_name, publish_type,
+                    latency)
+
+
     def sync_live_status(self):
         """
         refresh status of local object with info from capture agent.
 
-        read publish_type from capture agent, both 'live' and 'lowBR' channels,
-        and refresh status of local object
+        read publish_type from capture agent, both 'live' and 'lowBR' channels
+        at the same time, and refresh status of local object
         if channels have diverging live status, try to set 'lowBR' publish_type
         as the same as 'live'
+        if the circuit breaker for the device is open, the device is not polled
+        and the status is 'not available'
         """
         logger = logging.getLogger(__name__)
         logger.debug('in sync_live_status for device(%s)' % self.name)
-        live = self.__get_channel_publish_type('live')
-        lowBR = self.__get_channel_publish_type('lowBR')
+
+        # skip devices known to be unreachable
+        if self.breaker is not None and \
+                not self.breaker.allow(self.serial_number):
+            logger.debug('CA(%s) breaker is open; not polled' % self.name)
+            self.mark_not_available()
+            return
+
+        # one round trip to the device for both channels
+        (live, lowBR) = call_concurrently(
+                (self.__get_channel_publish_type, 'live'),
+                (self.__get_channel_publish_type, 'lowBR'))
 
         if live == lowBR:
-            self.channels['live']['publish_type'] = live
-            self.channels['lowBR']['publish_type'] = lowBR
+            self.set_publish_type('live', live)
+            self.set_publish_type('lowBR', lowBR)
         else:
             logger.warning(
                     'CA(%s) publish_type for live/lowBR (%s/%s); trying to fix...'
@@ -148,22 +385,69 @@ class CaptureAgent(object):
                         % (self.name, live))
 
             # finally set channels to whatever was possible to set
-            self.channels['live']['publish_type'] = live
-            self.channels['lowBR']['publish_type'] = value
+            self.set_publish_type('live', live)
+            self.set_publish_type('lowBR', value)
+
+
+    def mark_not_available(self):
+        """set live status as unknown, for when the device can't be reached."""
+        self.set_publish_type('live', 'not available')
+        self.set_publish_type('lowBR', 'not available')
 
 
     def write_live_status(self, publish_type):
-        """set capture agent live status for both 'live' and 'lowBR' channels."""
-        self.channels['live']['publish_type'] = \
-            self.__set_channel_publish_type('live', publish_type)
-        self.channels['lowBR']['publish_type'] = \
-            self.__set_channel_publish_type('lowBR', publish_type)
+        """set capture agent live status for 'live' and 'lowBR' channels at once."""
+        (live, lowBR) = call_concurrently(
+                (self.__set_channel_publish_type, 'live', publish_type),
+                (self.__set_channel_publish_type, 'lowBR', publish_type))
+        self.set_publish_type('live', live)
+        self.set_publish_type('lowBR', lowBR)
 
         # not ideal, but check that live and lowBR have the correct publish_type
         # is left to the user...
         return publish_type
 
 
+    def wait_for_publish_type(
+            self, publish_type, deadline, interval=0.1, max_interval=1.0):
+        """
+        poll capture agent until its channels report `publish_type`.
+
+        checks at growing intervals, starting at `interval` secs and doubling
+        up to `max_interval`, for at most `deadline` secs; channels not
+        configured are ignored.
+        returns secs the device took to settle, or None if it did not settle
+        before the deadline.
+        """
+        logger = logging.getLogger(__name__)
+        start = time.time()
+        while True:
+            (live, lowBR) = call_concurrently(
+                    (self.__get_channel_publish_type, 'live'),
+                    (self.__get_channel_publish_type, 'lowBR'))
+            self.set_publish_type('live', live)
+            self.set_publish_type('lowBR', lowBR)
+            elapsed = time.time() - start
+
+            pending = [
+                    c for c in ('live', 'lowBR')
+                    if self.channel(c) != 'not available'
+                    and self.publish_type(c) != publish_type]
+            if not pending:
+                logger.info(
+                        'CA(%s) publish_type %s settled in %.3fs'
+                        % (self.name, publish_type, elapsed))
+                return elapsed
+            if elapsed >= deadline:
+                logger.warning(
+                        'CA(%s) publish_type %s not settled after %.3fs; channels(%s)'
+                        % (self.name, publish_type, elapsed, pending))
+                return None
+
+            time.sleep(min(interval, deadline - elapsed))
+            interval = min(2 * interval, max_interval)
+
+
     def __repr__(self):
         return u'%s_%s' % (self._name, self._serial_number)
 
@@ -181,16 +465,19 @@ class CaptureAgent(object):
         """ % (self._name,
                self._serial_number,
                self._address,
-               self.channels['live']['channel'],
-               self.channels['live']['publish_type'],
-               self.channels['lowBR']['channel'],
-               self.channels['lowBR']['publish_type'],
-               self._last_update.to('local').format('YYYY-MM-DD HH:mm:ss ZZ'))
+               self.channel('live'),
+               self.publish_type('live'),
+               self.channel('lowBR'),
+               self.publish_type('lowBR'),
+               self.last_update.to('local').format('YYYY-MM-DD HH:mm:ss ZZ'))
 
 
 
 class CaLocation(object):
 
+    __slots__ = (
+            '_id', '_primary_ca', '_secondary_ca', 'name', 'experimental_cas')
+
     def __init__(self, name):
         self._id = self.clean_name(name)
         self._primary_ca = None
@@ -241,11 +528,11 @@ class CaLocation(object):
     @property
     def active_livestream(self):
         if self._primary_ca is not None:
-            if self._primary_ca.channels['live']['publish_type'] == '6':
+            if self._primary_ca.publish_type('live') == '6':
                 return 'primary'
 
         if self._secondary_ca is not None:
-            if self._secondary_ca.channels['live']['publish_type'] == '6':
+            if self._secondary_ca.publish_type('live') == '6':
                 return 'secondary'
 
         # there's no active livestream
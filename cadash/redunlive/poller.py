@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""concurrent polling of capture agents for redunlive."""
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+import logging
+import threading
+import time
+
+from cadash import tracing
+
+__all__ = ('call_concurrently', 'set_channel_max_workers', 'sync_all')
+
+
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_DEADLINE = 20  # seconds
+
+# max channel requests in flight, per process, unless set by the app
+DEFAULT_CHANNEL_MAX_WORKERS = 32
+
+# pool for requests to channels of the same device, created on first use;
+# separate from the pools in sync_all, so a device sync never waits for
+# a thread busy syncing another device
+_channel_executor = None
+_channel_max_workers = DEFAULT_CHANNEL_MAX_WORKERS
+_channel_executor_lock = threading.Lock()
+
+
+def set_channel_max_workers(max_workers):
+    """size the channel pool; a pool of another size is replaced."""
+    global _channel_executor, _channel_max_workers
+    with _channel_executor_lock:
+        _channel_max_workers = max_workers
+        if _channel_executor is not None and \
+                _channel_executor._max_workers != max_workers:
+            # requests in flight finish in the old pool
+            _channel_executor.shutdown(wait=False)
+            _channel_executor = None
+
+
+def _get_channel_executor():
+    global _channel_executor
+    if _channel_executor is None:
+        with _channel_executor_lock:
+            if _channel_executor is None:
+                _channel_executor = ThreadPoolExecutor(
+                        max_workers=_channel_max_workers)
+    return _channel_executor
+
+
+def call_concurrently(*calls):
+    """
+    run calls concurrently; return list of results, in same order as calls.
+
+    each call is a tuple (fn, arg1, arg2, ...); the first call runs in the
+    calling thread, the others in the channel pool. exceptions are raised
+    to the caller, after all calls are done.
+
+    :param: calls: tuples of callable and its args
+    :return: list of results
+    """
+    if len(calls) < 2:
+        return [c[0](*c[1:]) for c in calls]
+
+    futures = [_get_channel_executor().submit(tracing.wrap(c[0]), *c[1:])
+               for c in calls[1:]]
+    try:
+        first = calls[0][0](*calls[0][1:])
+    finally:
+        wait(futures)
+    return [first] + [f.result() for f in futures]
+
+
+def sync_all(cas, max_workers=DEFAULT_MAX_WORKERS, deadline=DEFAULT_DEADLINE):
+    """
+    sync live status of capture agents, in parallel.
+
+    at most `max_workers` devices are polled at the same time, and the whole
+    poll must finish within `deadline` seconds; capture agents still pending
+    when the deadline expires are marked as 'not available'.
+
+    :param: cas: iterable of redunlive.models.CaptureAgent, with clients set
+    :param: max_workers: max number of devices polled concurrently
+    :param: deadline: max seconds to wait for all devices
+    :return: list of capture agents that missed the deadline
+    """
+    cas = list(cas)
+    if not cas:
+        return []
+
+    logger = logging.getLogger(__name__)
+    start = time.time()
+
+    # each device is synced into a copy, and its status copied back if done
+    # in time; a sync abandoned at the deadline changes only its copy when
+    # it finishes, never a capture agent that may be published already
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(cas))))
+    try:
+        futures = {}
+        for ca in cas:
+            polled = ca.copy()
+            futures[executor.submit(tracing.wrap(polled.sync_live_status))] = \
+                (ca, polled)
+        (done, not_done) = wait(futures.keys(), timeout=deadline)
+    finally:
+        # do not block on devices that missed the deadline
+        executor.shutdown(wait=False)
+
+    for f in done:
+        (ca, polled) = futures[f]
+        if f.exception() is not None:
+            logger.warning(
+                    'CA(%s) failed to sync live status. error: %s'
+                    % (ca.name, f.exception()))
+            ca.mark_not_available()
+        else:
+            ca.copy_live_status(polled)
+
+    missed = []
+    for f in not_done:
+        # queued devices never get polled; running ones are abandoned
+        f.cancel()
+        ca = futures[f][0]
+        ca.mark_not_available()
+        missed.append(ca)
+
+    if missed:
+        logger.warning(
+                'sync of %d out of %d capture agents missed deadline(%ss): %s'
+                % (len(missed), len(cas), deadline, missed))
+    logger.debug(
+            'synced %d capture agents in %.3fs' % (len(cas), time.time() - start))
+    return missed
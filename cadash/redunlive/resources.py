@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""rest resources redunlive section."""
+import hashlib
+import json
+
+from flask import current_app
+from flask import request
+from flask_login import login_required
+from flask_restful import Resource
+from flask_restful import abort
+from flask_restful import reqparse
+
+from cadash.redunlive.snapshot import get_snapshot
+from cadash.redunlive.snapshot import location_item
+from cadash.redunlive.views import required_groups
+from cadash.utils import requires_roles
+
+# clients may keep responses, but must check they are current before use
+CACHE_CONTROL = 'private, no-cache'
+
+
+def register_resources(api):
+    """add resources to rest-api."""
+    api.add_resource(
+            Location_API,
+            '/api/redunlive/locations/<loc_id>',
+            endpoint='api_redunlive_location')
+    api.add_resource(
+            Location_ListAPI,
+            '/api/redunlive/locations',
+            endpoint='api_redunlive_locations')
+
+
+def _not_modified(etag):
+    """304 response if request has `etag` in If-None-Match, else None."""
+    if etag not in request.if_none_match:
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+class Location_ListAPI(Resource):
+    """
+    locations in fleet snapshot.
+
+    with `since=<version>`, only locations that changed after that snapshot
+    version, and ids of locations removed since. when changes since that
+    version are not known anymore, all locations are returned, as for no
+    `since`; `full` in the response tells which one it is.
+    """
+
+    def __init__(self):
+        """create instance."""
+        super(Location_ListAPI, self).__init__()
+
+        # arg parser for deltas
+        self._parser_get = reqparse.RequestParser()
+        self._parser_get.add_argument(
+                'since', type=int, location='args',
+                help='snapshot version expected for since')
+        # decorators for authenticated rest-endpoints
+        self.method_decorators = [
+                requires_roles(required_groups), login_required]
+
+
+    def get(self):
+        args = self._parser_get.parse_args()
+        snapshot = get_snapshot()
+        since = args['since']
+        if since is not None and not (
+                snapshot['deltas_since'] <= since <= snapshot['version']):
+            since = None
+
+        # a snapshot version is not reused, but the counter may be reset
+        # with the cache, hence the creation time
+        etag = '%d-%x-%s' % (
+                snapshot['version'], int(snapshot['created'] * 1000),
+                'full' if since is None else since)
+        response = _not_modified(etag)
+        if response is not None:
+            return response
+
+        changed = snapshot['changed']
+        if since is None:
+            result = {
+                    'version': snapshot['version'],
+                    'full': True,
+                    'locations': [
+                        location_item(d, changed[loc_id])
+                        for (loc_id, d) in sorted(snapshot['locations'].items())],
+                    'removed': []}
+        else:
+            result = {
+                    'version': snapshot['version'],
+                    'since': since,
+                    'full': False,
+                    'locations': [
+                        location_item(d, changed[loc_id])
+                        for (loc_id, d) in sorted(snapshot['locations'].items())
+                        if changed[loc_id] > since],
+                    'removed': sorted(
+                        loc_id for (loc_id, v) in snapshot['removed'].items()
+                        if v > since)}
+        return result, 200, {'ETag': '"%s"' % etag, 'Cache-Control': CACHE_CONTROL}
+
+
+class Location_API(Resource):
+    """one location in fleet snapshot."""
+
+    def __init__(self):
+        """create instance."""
+        super(Location_API, self).__init__()
+
+        # decorators for authenticated rest-endpoints
+        self.method_decorators = [
+                requires_roles(required_groups), login_required]
+
+
+    def get(self, loc_id):
+        snapshot = get_snapshot()
+        if loc_id not in snapshot['locations']:
+            abort(404, message='location({}) not found'.format(loc_id))
+
+        item = location_item(
+                snapshot['locations'][loc_id], snapshot['changed'][loc_id])
+        # last_update of capture agents is in the item, but not in `changed`
+        etag = hashlib.sha1(
+                json.dumps(item, sort_keys=True).encode('utf-8')).hexdigest()
+        response = _not_modified(etag)
+        if response is not None:
+            return response
+        return item, 200, {'ETag': '"%s"' % etag, 'Cache-Control': CACHE_CONTROL}
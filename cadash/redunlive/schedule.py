@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""polling schedule for capture agents, by priority."""
+import heapq
+
+__all__ = ('PollSchedule',)
+
+
+class PollSchedule(object):
+    """
+    next time each capture agent is due for a poll, in a heap by due time.
+
+    capture agents in rooms with an active livestream, or whose live status
+    changed in the last `recent_window` secs, are polled every `live_interval`
+    secs; idle or unreachable ones every `idle_interval` secs.
+    """
+
+    def __init__(self, live_interval=30, idle_interval=300, recent_window=300):
+        """create instance."""
+        self.live_interval = live_interval
+        self.idle_interval = idle_interval
+        self.recent_window = recent_window
+        self._heap = []
+        self._due = {}
+        self._changed_at = {}
+
+
+    def __len__(self):
+        return len(self._due)
+
+
+    def due_at(self, serial_number):
+        """time `serial_number` is due for a poll, or None if not scheduled."""
+        return self._due.get(serial_number)
+
+
+    def next_due(self):
+        """time of the next poll due, or None if nothing scheduled."""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+
+    def schedule(self, serial_number, due):
+        """poll `serial_number` at time `due`; replaces previous schedule."""
+        self._due[serial_number] = due
+        heapq.heappush(self._heap, (due, serial_number))
+
+
+    def pop_due(self, now):
+        """unschedule and return serial numbers due at `now`, earliest first."""
+        due = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            (t, serial_number) = heapq.heappop(self._heap)
+            del self._due[serial_number]
+            due.append(serial_number)
+
+
+    def retain(self, serial_numbers):
+        """forget capture agents not in `serial_numbers`."""
+        keep = set(serial_numbers)
+        for serial_number in list(self._due.keys()):
+            if serial_number not in keep:
+                del self._due[serial_number]
+                self._changed_at.pop(serial_number, None)
+        if len(self._heap) > 2 * len(self._due):
+            self._heap = [(t, s) for (t, s) in self._heap if self._due.get(s) == t]
+            heapq.heapify(self._heap)
+
+
+    def reschedule(self, ca, live, changed, now):
+        """
+        schedule next poll of `ca`, just polled at `now`.
+
+        :param: ca: redunlive.models.CaptureAgent
+        :param: live: True if the room of `ca` has an active livestream
+        :param: changed: True if live status of `ca` changed in this poll
+        :return: time of next poll
+        """
+        if changed:
+            self._changed_at[ca.serial_number] = now
+        changed_at = self._changed_at.get(ca.serial_number)
+        recent = changed_at is not None and now - changed_at < self.recent_window
+        unreachable = ca.channel('live') != 'not available' and \
+                ca.publish_type('live') == 'not available'
+
+        if (live or recent) and not unreachable:
+            interval = self.live_interval
+        else:
+            interval = self.idle_interval
+        self.schedule(ca.serial_number, now + interval)
+        return now + interval
+
+
+    def _drop_stale(self):
+        # heap entries replaced by a later schedule() are skipped lazily
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""coalescing of concurrent calls doing the same work."""
+import threading
+import uuid
+
+from werkzeug.contrib.cache import SimpleCache
+
+__all__ = ('CacheLease', 'SingleFlight')
+
+
+class _Call(object):
+    """a call in flight; followers wait on `done`."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    run at most one call per key at a time, within a process.
+
+    callers arriving while a call for the same key is in flight do not run
+    the work again; they wait for the in-flight call and get its result, or
+    its exception.
+    """
+
+    def __init__(self):
+        """create instance."""
+        self._lock = threading.Lock()
+        self._calls = {}
+
+
+    def do(self, key, fn, *args, **kwargs):
+        """run `fn(*args, **kwargs)` for `key`, or wait for the one in flight."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn(*args, **kwargs)
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class CacheLease(object):
+    """
+    exclusive lease on `key` in a cache shared by all app workers.
+
+    the lease expires after `ttl` seconds, so a worker that dies while
+    holding it does not block the others forever.
+    """
+
+    def __init__(self, backend, key, ttl):
+        """create instance; `backend` is a werkzeug cache."""
+        self._backend = backend
+        self._key = key
+        self._ttl = ttl
+        self._token = uuid.uuid4().hex
+
+
+    def acquire(self):
+        """return True if lease acquired."""
+        if self._backend.add(self._key, self._token, timeout=self._ttl):
+            return True
+
+        # simple cache keeps expired keys around, and then add() fails
+        if isinstance(self._backend, SimpleCache) and \
+                not self._backend.has(self._key):
+            self._backend.delete(self._key)
+            return bool(self._backend.add(self._key, self._token, timeout=self._ttl))
+        return False
+
+
+    def release(self):
+        """release lease, if still held by this instance."""
+        if self._backend.get(self._key) == self._token:
+            self._backend.delete(self._key)
@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+"""shared snapshot of redunlive locations and capture agents state."""
+from contextlib import contextmanager
+import logging
+import time
+
+from flask import current_app
+from werkzeug.contrib.cache import RedisCache
+
+from cadash import tracing
+from cadash.extensions import cache
+from cadash.redunlive.codec import decode_location
+from cadash.redunlive.codec import decode_snapshot
+from cadash.redunlive.codec import encode_snapshot
+from cadash.redunlive.codec import location_state
+from cadash.redunlive.codec import read_header
+from cadash.redunlive.codec import replace_locations
+from cadash.redunlive.data_masseuse import prep_redunlive_data
+from cadash.redunlive.errors import SnapshotFormatError
+from cadash.redunlive.events import get_event_bus
+from cadash.redunlive.models import CaptureAgent
+from cadash.redunlive.models import CaLocation
+from cadash.redunlive.singleflight import CacheLease
+from cadash.redunlive.singleflight import SingleFlight
+
+__all__ = ('fresh_snapshot', 'get_snapshot', 'load_location', 'load_snapshot', 'location_item',
+           'publish_snapshot', 'refresh_snapshot', 'snapshot_events',
+           'snapshot_locations', 'update_snapshot_location')
+
+
+SNAPSHOT_KEY = 'redunlive:snapshot'
+# versions are allocated from a counter; the version of the snapshot in
+# cache is set after it is written, and tells workers to decode it again
+SNAPSHOT_VERSION_KEY = 'redunlive:snapshot:version'
+SNAPSHOT_PUBLISHED_KEY = 'redunlive:snapshot:published'
+REFRESH_LEASE_KEY = 'redunlive:snapshot:refresh_lease'
+WRITE_LEASE_KEY = 'redunlive:snapshot:write_lease'
+
+# secs between checks for the snapshot published by another worker
+REFRESH_WAIT_INTERVAL = 0.2
+
+# snapshot writes are serialized across workers: secs a writer may hold the
+# write lease, and between tries to get it
+WRITE_LEASE_TTL = 10
+WRITE_WAIT_INTERVAL = 0.01
+
+# removed locations remembered for deltas; changes since versions older
+# than the oldest forgotten are no longer known
+REMOVED_MAX = 1000
+
+# refreshes in flight in this process
+_refresh_flight = SingleFlight()
+
+
+def ca_to_dict(ca):
+    """plain dict with state of capture agent `ca`; no client."""
+    return {
+            'serial_number': ca.serial_number,
+            'address': ca.address,
+            'last_update': ca.last_update_timestamp,
+            'channels': {
+                'live': {
+                    'channel': ca.channel('live'),
+                    'publish_type': ca.publish_type('live')},
+                'lowBR': {
+                    'channel': ca.channel('lowBR'),
+                    'publish_type': ca.publish_type('lowBR')}},
+            }
+
+
+def ca_from_dict(d):
+    """capture agent from dict created by `ca_to_dict`; client not set."""
+    if d is None:
+        return None
+    ca = CaptureAgent(d['serial_number'], d['address'])
+    for chan_name in ('live', 'lowBR'):
+        ca.set_channel(chan_name, d['channels'][chan_name]['channel'])
+        ca.set_publish_type(chan_name, d['channels'][chan_name]['publish_type'])
+    ca.last_update = d['last_update']
+    return ca
+
+
+def location_to_dict(loc):
+    """plain dict with state of location `loc`."""
+    return {
+            'id': loc.id,
+            'name': loc.name,
+            'primary_ca': ca_to_dict(loc.primary_ca) if loc.primary_ca else None,
+            'secondary_ca': ca_to_dict(loc.secondary_ca) if loc.secondary_ca else None,
+            'experimental_cas': [ca_to_dict(c) for c in loc.experimental_cas],
+            }
+
+
+def location_from_dict(d):
+    """location from dict created by `location_to_dict`."""
+    loc = CaLocation(d['name'])
+    if d['primary_ca'] is not None:
+        loc.primary_ca = ca_from_dict(d['primary_ca'])
+    if d['secondary_ca'] is not None:
+        loc.secondary_ca = ca_from_dict(d['secondary_ca'])
+    loc.experimental_cas = [ca_from_dict(c) for c in d['experimental_cas']]
+    return loc
+
+
+def location_item(loc_dict, changed):
+    """json object for location in snapshot, as served to browsers."""
+    item = dict(loc_dict)
+    item['active_livestream'] = location_from_dict(loc_dict).active_livestream
+    item['changed'] = changed
+    return item
+
+
+def load_snapshot():
+    """
+    return current snapshot from cache, or None if not available.
+
+    the snapshot decoded last is kept per process, and reused while the
+    published version in cache stays the same; do not modify it.
+    """
+    published = cache.cache.get(SNAPSHOT_PUBLISHED_KEY)
+    snapshot = _memo_snapshot(_memo(), published)
+    if snapshot is not None:
+        return snapshot
+
+    data = _load_data()
+    if data is None:
+        return None
+    snapshot = decode_snapshot(data)
+    _remember(snapshot, published)
+    return snapshot
+
+
+def load_location(loc_id):
+    """
+    return location dict for `loc_id` in current snapshot, or None.
+
+    decodes only that location, unless the whole snapshot is decoded already.
+    """
+    snapshot = _memo_snapshot(_memo(), cache.cache.get(SNAPSHOT_PUBLISHED_KEY))
+    if snapshot is not None:
+        return snapshot['locations'].get(loc_id)
+
+    data = _load_data()
+    return None if data is None else decode_location(data, loc_id)
+
+
+def _memo():
+    return current_app.extensions.setdefault('redunlive_snapshot', {})
+
+
+def _memo_snapshot(memo, published):
+    """
+    snapshot decoded last, if decoded since `published` was set.
+
+    the published version is read before the snapshot, and set after it is
+    written, so a snapshot written since is never taken for the one read.
+    """
+    if published is None or memo.get('published') != published:
+        return None
+    return memo.get('snapshot')
+
+
+def _remember(snapshot, published):
+    _memo().update(snapshot=snapshot, published=published)
+
+
+def _set_published(snapshot):
+    cache.cache.set(SNAPSHOT_PUBLISHED_KEY, snapshot['version'], timeout=0)
+    _remember(snapshot, snapshot['version'])
+
+
+def _load_data():
+    data = cache.get(SNAPSHOT_KEY)
+    if data is None:
+        return None
+    try:
+        read_header(data)
+    except SnapshotFormatError as e:
+        # e.g. left in cache by an older release; will be replaced
+        logger = logging.getLogger(__name__)
+        logger.warning('ignoring redunlive snapshot in cache: %s' % e)
+        return None
+    return data
+
+
+def publish_snapshot(locations):
+    """
+    publish a new version of the snapshot in cache.
+
+    :param: locations: dict of CaLocation by location id
+    :return: the published snapshot
+    """
+    return _publish(dict(
+        (loc_id, location_to_dict(loc)) for (loc_id, loc) in locations.items()))
+
+
+def _next_version():
+    backend = cache.cache
+    if isinstance(backend, RedisCache):
+        # atomic across workers, and does not expire
+        return backend.inc(SNAPSHOT_VERSION_KEY)
+
+    # in-process caches: inc() would set the counter with default timeout
+    version = (backend.get(SNAPSHOT_VERSION_KEY) or 0) + 1
+    backend.set(SNAPSHOT_VERSION_KEY, version, timeout=0)
+    return version
+
+
+@contextmanager
+def _write_lease():
+    """
+    hold the snapshot write lease, so read-modify-write of the snapshot by
+    concurrent workers, e.g. failover jobs, do not drop each other's changes.
+    """
+    lease = CacheLease(cache.cache, WRITE_LEASE_KEY, WRITE_LEASE_TTL)
+    give_up = time.time() + WRITE_LEASE_TTL
+    while not lease.acquire():
+        if time.time() > give_up:
+            # holder died, and the lease expires about now
+            logger = logging.getLogger(__name__)
+            logger.warning('timed out waiting for redunlive snapshot write lease')
+            break
+        time.sleep(WRITE_WAIT_INTERVAL)
+    try:
+        yield
+    finally:
+        lease.release()
+
+
+def _publish(location_dicts):
+    with _write_lease():
+        snapshot = _write_snapshot(location_dicts)
+    _announce(snapshot)
+    return snapshot
+
+
+def _write_snapshot(location_dicts):
+    """write a new snapshot version with `location_dicts`; hold write lease."""
+    previous = load_snapshot()
+    version = _next_version()
+    snapshot = _track_changes({
+            'version': version,
+            'created': time.time(),
+            'locations': location_dicts,
+            }, previous)
+    data = encode_snapshot(snapshot)
+    cache.set(SNAPSHOT_KEY, data, timeout=0)
+    _set_published(snapshot)
+
+    logger = logging.getLogger(__name__)
+    logger.debug(
+            'published redunlive snapshot version(%s) with %d locations in %d bytes'
+            % (version, len(location_dicts), len(data)))
+    return snapshot
+
+
+def _track_changes(snapshot, previous):
+    """
+    set in `snapshot` the version each location last changed, and the
+    locations removed, since `previous` snapshot.
+    """
+    version = snapshot['version']
+    locations = snapshot['locations']
+    if previous is None:
+        snapshot['changed'] = dict((loc_id, version) for loc_id in locations)
+        snapshot['removed'] = {}
+        snapshot['deltas_since'] = version
+        return snapshot
+
+    changed = {}
+    for (loc_id, d) in locations.items():
+        old = previous['locations'].get(loc_id)
+        if old is not None and location_state(old) == location_state(d):
+            changed[loc_id] = previous['changed'][loc_id]
+        else:
+            changed[loc_id] = version
+
+    removed = dict((loc_id, v) for (loc_id, v) in previous['removed'].items()
+                   if loc_id not in locations)
+    for loc_id in previous['locations']:
+        if loc_id not in locations:
+            removed[loc_id] = version
+
+    deltas_since = previous['deltas_since']
+    if len(removed) > REMOVED_MAX:
+        forgotten = sorted(removed, key=removed.get)[:len(removed) - REMOVED_MAX]
+        deltas_since = max(deltas_since, max(removed[k] for k in forgotten))
+        for loc_id in forgotten:
+            del removed[loc_id]
+
+    snapshot['changed'] = changed
+    snapshot['removed'] = removed
+    snapshot['deltas_since'] = deltas_since
+    return snapshot
+
+
+def snapshot_events(snapshot, since):
+    """
+    list of events for locations changed or removed in `snapshot` after
+    version `since`; None if those changes are not known.
+    """
+    version = snapshot['version']
+    if since is None or not (snapshot['deltas_since'] <= since <= version):
+        return None
+
+    events = []
+    for loc_id in sorted(snapshot['locations'].keys()):
+        changed = snapshot['changed'][loc_id]
+        if changed > since:
+            events.append({
+                'event': 'location', 'id': version,
+                'data': location_item(snapshot['locations'][loc_id], changed)})
+    for loc_id in sorted(snapshot['removed'].keys()):
+        if snapshot['removed'][loc_id] > since:
+            events.append({
+                'event': 'removed', 'id': version, 'data': {'id': loc_id}})
+    return events
+
+
+def _announce(snapshot):
+    """publish events for locations changed in this `snapshot` version."""
+    # none for a first snapshot, with no previous to compare
+    events = snapshot_events(snapshot, snapshot['version'] - 1) or []
+    if not events:
+        return
+    bus = get_event_bus()
+    try:
+        for event in events:
+            bus.publish(event)
+    except Exception as e:
+        # browsers catch up when they reconnect or reload
+        logger = logging.getLogger(__name__)
+        logger.warning('failed to publish redunlive events: %s' % e)
+
+
+@tracing.traced('refresh_snapshot')
+def refresh_snapshot():
+    """
+    pull ca_stats, sync all capture agents, and publish a new snapshot.
+
+    concurrent refreshes are coalesced: within a process, callers share the
+    refresh in flight; across workers, only the holder of the refresh lease
+    polls the fleet, and the others wait for the snapshot it publishes.
+    """
+    previous = load_snapshot()
+    return _refresh_flight.do(
+            SNAPSHOT_KEY, _leased_refresh,
+            0 if previous is None else previous['version'])
+
+
+def _leased_refresh(previous_version):
+    ttl = current_app.config['REDUNLIVE_REFRESH_LEASE_TTL']
+    lease = CacheLease(cache.cache, REFRESH_LEASE_KEY, ttl)
+    give_up = time.time() + 2 * ttl
+    while True:
+        # another worker refreshed meanwhile; use its snapshot
+        snapshot = load_snapshot()
+        if snapshot is not None and snapshot['version'] > previous_version:
+            return snapshot
+
+        if lease.acquire():
+            try:
+                return _refresh()
+            finally:
+                lease.release()
+
+        if time.time() > give_up:
+            logger = logging.getLogger(__name__)
+            logger.warning(
+                    'timed out waiting for redunlive snapshot from another worker')
+            return _refresh()
+
+        time.sleep(REFRESH_WAIT_INTERVAL)
+
+
+def _refresh():
+    start = time.time()
+    data = prep_redunlive_data()
+    with _write_lease():
+        # reloaded after the poll, so a failover published while the fleet
+        # was polled is kept
+        latest = load_snapshot()
+        if latest is not None:
+            _adopt_newer_state(data, latest, start)
+        snapshot = _write_snapshot(dict(
+            (loc_id, location_to_dict(loc))
+            for (loc_id, loc) in data['all_locations'].items()))
+    _announce(snapshot)
+    return snapshot
+
+
+def _adopt_newer_state(data, snapshot, polled_at):
+    """
+    update capture agents in `data` with newer state in `snapshot`, e.g.
+    when a location was toggled since they were last polled.
+
+    capture agents polled in this refresh, started at `polled_at`, take
+    state written after the poll started only.
+    """
+    synced = set(ca.serial_number for ca in data['synced_cas'])
+    for loc in snapshot['locations'].values():
+        for d in [loc['primary_ca'], loc['secondary_ca']] + loc['experimental_cas']:
+            if d is None:
+                continue
+            ca = data['all_cas'].get(d['serial_number'])
+            if ca is None or d['last_update'] <= ca.last_update_timestamp:
+                continue
+            if d['serial_number'] in synced and d['last_update'] <= polled_at:
+                continue
+            ca.set_publish_type('live', d['channels']['live']['publish_type'])
+            ca.set_publish_type('lowBR', d['channels']['lowBR']['publish_type'])
+            ca.last_update = d['last_update']
+
+
+def update_snapshot_location(location):
+    """
+    publish a new snapshot version with the state of one `location`.
+
+    other locations are copied from the current snapshot without decoding.
+    """
+    loc_dict = location_to_dict(location)
+    with _write_lease():
+        data = _load_data()
+        if data is None:
+            snapshot = _write_snapshot({location.id: loc_dict})
+        else:
+            previous_version = read_header(data)[0]
+            version = _next_version()
+            created = time.time()
+            data = replace_locations(data, version, created, {location.id: loc_dict})
+            cache.set(SNAPSHOT_KEY, data, timeout=0)
+
+            previous = _memo().get('snapshot')
+            if previous is not None and previous['version'] == previous_version:
+                locations = dict(previous['locations'])
+                locations[location.id] = loc_dict
+                snapshot = _track_changes({
+                        'version': version,
+                        'created': created,
+                        'locations': locations,
+                        }, previous)
+            else:
+                snapshot = decode_snapshot(data)
+            _set_published(snapshot)
+    _announce(snapshot)
+    return snapshot
+
+
+def get_snapshot():
+    """
+    return current snapshot, refreshing it if missing or too old.
+
+    the snapshot is expected to be kept fresh by the fleet poller; the
+    refresh here is just a fallback for when there is no poller running.
+    """
+    snapshot = fresh_snapshot()
+    if snapshot is None:
+        snapshot = refresh_snapshot()
+    return snapshot
+
+
+def fresh_snapshot():
+    """
+    return current snapshot from cache, or None if not available or older
+    than `REDUNLIVE_SNAPSHOT_MAX_AGE`; never refreshes.
+    """
+    snapshot = load_snapshot()
+    max_age = current_app.config['REDUNLIVE_SNAPSHOT_MAX_AGE']
+    if snapshot is None or time.time() - snapshot['created'] > max_age:
+        return None
+    return snapshot
+
+
+def snapshot_locations(snapshot):
+    """list of CaLocation in `snapshot`, sorted by location id."""
+    return [location_from_dict(snapshot['locations'][loc_id])
+            for loc_id in sorted(snapshot['locations'].keys())]
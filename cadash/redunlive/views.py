@@ -1,20 +1,43 @@
 # -*- coding: utf-8 -*-
 """redunlive section."""
-import json
 import logging
-import time
 
+import arrow
+from flask import abort
 from flask import Blueprint
 from flask import current_app
 from flask import flash
+from flask import jsonify
+from flask import redirect
 from flask import render_template
 from flask import request
+from flask import Response
+from flask import stream_with_context
+from flask import url_for
 from flask_login import login_required
 
 from cadash import __version__ as app_version
-from cadash.utils import pull_data
+from cadash.compat import string_types
 from cadash.utils import requires_roles
-from cadash.redunlive.data_masseuse import map_redunlive_ca_loc
+from cadash.redunlive.data_masseuse import get_history_recorder
+from cadash.redunlive.data_masseuse import load_ca_stats_entries
+from cadash.redunlive.errors import CaStatsUnavailableError
+from cadash.redunlive.errors import FailoverInProgressError
+from cadash.redunlive.events import event_stream
+from cadash.redunlive.events import get_event_bus
+from cadash.redunlive.failover import get_batch_report
+from cadash.redunlive.failover import get_job
+from cadash.redunlive.failover import submit_bulk_failover
+from cadash.redunlive.failover import submit_failover
+from cadash.redunlive.fragments import render_location
+from cadash.redunlive.fragments import render_locations
+from cadash.redunlive.snapshot import fresh_snapshot
+from cadash.redunlive.snapshot import get_snapshot
+from cadash.redunlive.snapshot import load_location
+from cadash.redunlive.snapshot import load_snapshot
+from cadash.redunlive.snapshot import refresh_snapshot
+from cadash.redunlive.snapshot import snapshot_events
+from cadash.redunlive.worker import refresh_in_background
 
 required_groups = ['deadmin']
 
@@ -24,17 +47,6 @@ blueprint = Blueprint(
         url_prefix='/redunlive')
 
 
-def prep_redunlive_data():
-    """read and parse data for redunlive."""
-    json_text = pull_data(
-            current_app.config['CA_STATS_JSON_URL'],
-            creds={
-                'user': current_app.config['CA_STATS_USER'],
-                'pwd': current_app.config['CA_STATS_PASSWD']
-                })
-    return map_redunlive_ca_loc(json.loads(json_text))
-
-
 @blueprint.route('/', methods=['GET', 'POST'])
 @login_required
 @requires_roles(required_groups)
@@ -44,48 +56,228 @@ def home():
     logger = logging.getLogger(__name__)
     logger.info('----- this is a log message from app: %s' % __name__)
 
-    # init location-ca list
-    data = prep_redunlive_data()
-    locations = sorted(data['all_locations'].values(), key=lambda t: t.id)
-
     if current_app.config['ENV'] == 'dev' \
             and 'loc_id' in request.form.keys():
         flash('form input loc-id %s' % request.form['loc_id'])
         logger.debug('request.form loc-id is %s' % (request.form['loc_id']))
 
-    # form submitted
+    # form submitted: failover runs in background, page shows its progress
     if request.method == 'POST':
-        # get location to toggle
-        location = data['all_locations'][request.form['loc_id']]
-
-        if location.active_livestream is None:
-            pass  # do not start/stop if no active streaming!
-        else:
-            # toggling from backup to primary requires a start over
-            if request.form['active_device'] == 'primary':
-                # start primary streaming
-                location.primary_ca.write_live_status('6')
-                time.sleep(2)
-                # stop backup streaming so akamai detect that for sure
-                location.secondary_ca.write_live_status('0')
-                time.sleep(1)
-                # start backup streaming again
-                location.secondary_ca.write_live_status('6')
-            else:
-                # make sure secondary is streaming
-                location.secondary_ca.write_live_status('6')
-                time.sleep(2)
-                # stop streaming primary
-                location.primary_ca.write_live_status('0')
-                time.sleep(1)
-
-            # make sure we have the device status
-            location.primary_ca.sync_live_status()
-            location.secondary_ca.sync_live_status()
-        # end -- there is active livestreaming
+        target = request.form.get('active_device')
+        if target not in ('primary', 'secondary'):
+            if request_wants_json():
+                response = jsonify({'error': 'expected active_device primary|secondary'})
+                response.status_code = 400
+                return response
+            abort(400)
+
+        # only the location toggled is read from the snapshot
+        location = load_location(request.form['loc_id'])
+        if location is None:
+            # no snapshot yet, or location added since
+            location = get_snapshot()['locations'].get(request.form['loc_id'])
+        if location is None:
+            abort(404)
+        try:
+            job = submit_failover(location, target)
+        except FailoverInProgressError as e:
+            # not queued; page shows the job in the way instead
+            if request_wants_json():
+                response = jsonify({'error': str(e), 'job': e.job})
+                response.status_code = 409
+                return response
+            flash('%s; not queued' % e, 'warning')
+            return redirect(url_for('redunlive.home', job=e.job['id']))
+
+        if request_wants_json():
+            response = jsonify(job)
+            response.status_code = 202
+            response.headers['Location'] = url_for(
+                    'redunlive.failover_status', job_id=job['id'])
+            return response
+
+        return redirect(url_for('redunlive.home', job=job['id']))
 
+    job = get_job(request.args['job']) if 'job' in request.args else None
+
+    # location-ca list as last polled by fleet poller; when not fresh, the
+    # page lists locations in ca_stats and the browser loads each one from
+    # `redunlive.location`, so the page does not wait for the fleet poll
+    snapshot = fresh_snapshot()
+    if snapshot is not None:
+        # rendered only for locations changed since last rendered
+        loc_dicts = [snapshot['locations'][loc_id]
+                     for loc_id in sorted(snapshot['locations'].keys())]
+        rows = [(d['id'], d['name'], fragment)
+                for (d, fragment) in zip(loc_dicts, render_locations(loc_dicts))]
+    else:
+        rows = [(loc_id, name, None)
+                for (loc_id, name) in sorted(_location_names().items())]
     return render_template(
-            'redunlive/home.html', version=app_version, locations=locations)
+            'redunlive/home.html', version=app_version, rows=rows, job=job,
+            snapshot_version=None if snapshot is None else snapshot['version'])
+
+
+def _location_names():
+    """location names by id in ca_stats, or in a stale snapshot if down."""
+    try:
+        return load_ca_stats_entries().location_names
+    except CaStatsUnavailableError:
+        snapshot = load_snapshot()
+        if snapshot is None:
+            raise
+        return dict((loc_id, d['name'])
+                    for (loc_id, d) in snapshot['locations'].items())
+
+
+@blueprint.route('/locations/<loc_id>', methods=['GET'])
+@login_required
+@requires_roles(required_groups)
+def location(loc_id):
+    """one location of the home page, as html fragment."""
+    snapshot = fresh_snapshot()
+    if snapshot is None:
+        # a stale snapshot is served as is, while refreshed in background;
+        # requests wait for the refresh, shared by all, only when there is
+        # nothing to serve for the location
+        snapshot = load_snapshot()
+        if snapshot is not None:
+            refresh_in_background(current_app._get_current_object())
+        if snapshot is None or loc_id not in snapshot['locations']:
+            snapshot = refresh_snapshot()
+    if loc_id not in snapshot['locations']:
+        abort(404)
+    return render_location(snapshot['locations'][loc_id])
+
+
+@blueprint.route('/failover/<job_id>', methods=['GET'])
+@login_required
+@requires_roles(required_groups)
+def failover_status(job_id):
+    """status of failover job, as json."""
+    job = get_job(job_id)
+    if job is None:
+        response = jsonify({'error': 'failover job not found (%s)' % job_id})
+        response.status_code = 404
+        return response
+    return jsonify(job)
+
+
+@blueprint.route('/failover', methods=['POST'])
+@login_required
+@requires_roles(required_groups)
+def bulk_failover():
+    """
+    failover many locations to the same device; returns batch report as json.
+
+    expects json {"loc_ids": [...], "target": "primary"|"secondary"}, or a
+    form with multiple `loc_id` and a `target`.
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        loc_ids = data.get('loc_ids')
+        target = data.get('target')
+    elif data is not None:
+        (loc_ids, target) = (None, None)
+    else:
+        loc_ids = request.form.getlist('loc_id')
+        target = request.form.get('target')
+
+    if target not in ('primary', 'secondary') or not loc_ids or \
+            not isinstance(loc_ids, list) or \
+            not all(isinstance(l, string_types) for l in loc_ids):
+        response = jsonify({
+            'error': 'expected list of loc_ids and target primary|secondary'})
+        response.status_code = 400
+        return response
+
+    snapshot = get_snapshot()
+    report = submit_bulk_failover(snapshot['locations'], loc_ids, target)
+    response = jsonify(report)
+    response.status_code = 202
+    response.headers['Location'] = url_for(
+            'redunlive.bulk_failover_status', batch_id=report['id'])
+    return response
+
+
+@blueprint.route('/failover/batch/<batch_id>', methods=['GET'])
+@login_required
+@requires_roles(required_groups)
+def bulk_failover_status(batch_id):
+    """per-location report of bulk failover, as json."""
+    report = get_batch_report(batch_id)
+    if report is None:
+        response = jsonify({'error': 'failover batch not found (%s)' % batch_id})
+        response.status_code = 404
+        return response
+    return jsonify(report)
+
+
+@blueprint.route('/history/<serial_number>', methods=['GET'])
+@login_required
+@requires_roles(required_groups)
+def ca_history(serial_number):
+    """
+    publish_type transitions of capture agent, oldest first, as json.
+
+    `since` query arg (epoch secs) returns only later transitions.
+    """
+    try:
+        since = float(request.args['since']) if 'since' in request.args else None
+    except ValueError:
+        response = jsonify({'error': 'expected epoch secs for since'})
+        response.status_code = 400
+        return response
+
+    history = get_history_recorder().get(serial_number)
+    entries = history.entries(since=since)
+    for e in entries:
+        e['time'] = arrow.get(e['timestamp']).isoformat()
+    return jsonify({
+        'serial_number': serial_number,
+        'capacity': history.capacity,
+        'entries': entries})
+
+
+@blueprint.route('/events', methods=['GET'])
+@login_required
+@requires_roles(required_groups)
+def events():
+    """
+    server-sent events stream of locations changed or removed.
+
+    events resume after snapshot version in `Last-Event-ID` header, sent by
+    the browser on reconnect, or `since` query arg, the version the page was
+    rendered from; a `reload` event when those changes are not known.
+    """
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        response = jsonify({'error': 'expected snapshot version for since'})
+        response.status_code = 400
+        return response
+
+    # subscribe before reading the snapshot, so no change falls in between
+    subscription = get_event_bus().subscribe()
+    replay = []
+    if since is not None:
+        snapshot = load_snapshot()
+        replay = None if snapshot is None else snapshot_events(snapshot, since)
+
+    stream = event_stream(
+            subscription, replay,
+            current_app.config['REDUNLIVE_EVENTS_HEARTBEAT'],
+            current_app.config['REDUNLIVE_EVENTS_MAX_AGE'])
+    return Response(
+            stream_with_context(stream), mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def request_wants_json():
+    best = request.accept_mimetypes.best_match(['application/json', 'text/html'])
+    return best == 'application/json' and \
+            request.accept_mimetypes[best] > request.accept_mimetypes['text/html']
 
 # @blueprint.route('/logout/')
 # def logout():
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""background worker to keep the redunlive snapshot fresh."""
+import logging
+import threading
+
+from cadash import tracing
+from cadash.redunlive.snapshot import refresh_snapshot
+
+__all__ = ('FleetPoller', 'refresh_in_background', 'start_fleet_poller')
+
+
+# refresh started by `refresh_in_background` and not finished yet
+_background_refresh = [None]
+_background_refresh_lock = threading.Lock()
+
+
+class FleetPoller(object):
+    """
+    polls all capture agents every `interval` seconds.
+
+    each poll publishes a new redunlive snapshot in the app cache, so
+    requests to redunlive just render the latest snapshot.
+    """
+
+    def __init__(self, app, interval):
+        """create instance."""
+        self.app = app
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+
+    def poll_once(self):
+        """refresh snapshot; return the snapshot or None if it failed."""
+        logger = logging.getLogger(__name__)
+        with self.app.app_context(), tracing.trace('fleet poller') as t:
+            try:
+                return refresh_snapshot()
+            except Exception as e:
+                logger.error('failed to refresh redunlive snapshot: %s' % e)
+                return None
+            finally:
+                t.finish()
+                if self.app.config['TRACING_ENABLED'] and \
+                        t.duration >= self.app.config['TRACING_LOG_THRESHOLD']:
+                    logger.info('timing %s' % t.summary())
+
+
+    def run(self):
+        """poll until stopped."""
+        while not self._stop_event.is_set():
+            self.poll_once()
+            self._stop_event.wait(self.interval)
+
+
+    def start(self):
+        """poll in a daemon thread."""
+        self._thread = threading.Thread(target=self.run, name='redunlive-poller')
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def stop(self, timeout=None):
+        """stop polling, and wait for thread to finish."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def start_fleet_poller(app):
+    """start a fleet poller thread for `app`."""
+    poller = FleetPoller(app, app.config['REDUNLIVE_POLL_INTERVAL'])
+    poller.start()
+    return poller
+
+
+def refresh_in_background(app):
+    """
+    refresh snapshot of `app` once, in a daemon thread.
+
+    at most one such refresh runs per process; return False if one is
+    running already.
+    """
+    with _background_refresh_lock:
+        thread = _background_refresh[0]
+        if thread is not None and thread.is_alive():
+            return False
+        poller = FleetPoller(app, 0)
+        thread = threading.Thread(
+                target=poller.poll_once, name='redunlive-refresh')
+        thread.daemon = True
+        _background_refresh[0] = thread
+        thread.start()
+        return True
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """Application configuration."""
 import os
+import tempfile
 
 
 class Config(object):
@@ -27,11 +28,87 @@ class Config(object):
     CA_STATS_JSON_URL = 'http://ca_stats_fake_url.com'
     CA_STATS_USER = 'ca_stats_fake_user'
     CA_STATS_PASSWD = 'ca_stats_fake_passwd'
+    # secs to wait for ca_stats; and local copy for when it's unchanged or down
+    CA_STATS_TIMEOUT = float(os.environ.get('CA_STATS_TIMEOUT', 10))
+    CA_STATS_CACHE_FILE = os.environ.get(
+            'CA_STATS_CACHE_FILE', os.path.join(tempfile.gettempdir(), 'cadash_ca_stats.json'))
 
     # epipearl creds (to talk to capture agents) mandatory
     EPIPEARL_USER = 'epipearl_fake_user'
     EPIPEARL_PASSWD = 'epipearl_fake_passwd'
 
+    # pooled http sessions for ca_stats and epipearl: max connections kept
+    # per host, connect/read timeouts in secs, and retries on connect errors
+    HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 10))
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+    HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 10))
+    HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 1))
+    HTTP_RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF', 0.2))
+
+    # redunlive polling: max devices polled at once, and max secs for all
+    REDUNLIVE_POLL_WORKERS = int(os.environ.get('REDUNLIVE_POLL_WORKERS', 16))
+    REDUNLIVE_POLL_DEADLINE = float(os.environ.get('REDUNLIVE_POLL_DEADLINE', 20))
+    # poll devices with asyncio in a single thread (python 3.5+ only), and max
+    # devices polled at once in that case
+    REDUNLIVE_ASYNC_POLLING = os.environ.get('REDUNLIVE_ASYNC_POLLING', '') == 'true'
+    REDUNLIVE_ASYNC_MAX_CONCURRENCY = int(os.environ.get('REDUNLIVE_ASYNC_MAX_CONCURRENCY', 1000))
+    # circuit breaker for unreachable capture agents: consecutive failed
+    # requests to open it, and secs until first probe, doubling up to max
+    REDUNLIVE_BREAKER_THRESHOLD = int(os.environ.get('REDUNLIVE_BREAKER_THRESHOLD', 3))
+    REDUNLIVE_BREAKER_BACKOFF = float(os.environ.get('REDUNLIVE_BREAKER_BACKOFF', 10))
+    REDUNLIVE_BREAKER_MAX_BACKOFF = float(os.environ.get('REDUNLIVE_BREAKER_MAX_BACKOFF', 600))
+    # max failover jobs running at once, per process; also caps bulk failover
+    REDUNLIVE_FAILOVER_WORKERS = int(os.environ.get('REDUNLIVE_FAILOVER_WORKERS', 8))
+    # failover waits for each device to report the new publish_type: secs
+    # between checks, doubling up to 1s, and max secs to wait per device
+    REDUNLIVE_FAILOVER_SETTLE_INTERVAL = float(os.environ.get('REDUNLIVE_FAILOVER_SETTLE_INTERVAL', 0.1))
+    REDUNLIVE_FAILOVER_SETTLE_DEADLINE = float(os.environ.get('REDUNLIVE_FAILOVER_SETTLE_DEADLINE', 5))
+    # secs a failover job may go without progress before reported failed, as
+    # when its worker died; queued jobs get that per batch of jobs ahead
+    REDUNLIVE_FAILOVER_JOB_TIMEOUT = float(os.environ.get('REDUNLIVE_FAILOVER_JOB_TIMEOUT', 120))
+    # max requests to a device second channel in flight, per process: one
+    # per device polled or failed over at once
+    REDUNLIVE_CHANNEL_WORKERS = int(os.environ.get(
+        'REDUNLIVE_CHANNEL_WORKERS', REDUNLIVE_POLL_WORKERS + REDUNLIVE_FAILOVER_WORKERS))
+    # only poll capture agents whose ca_stats entry changed since last poll,
+    # or that are due: every LIVE_INTERVAL secs for rooms streaming live or
+    # devices that changed status in the last RECENT_WINDOW secs, and every
+    # IDLE_INTERVAL secs for idle or unreachable devices
+    REDUNLIVE_INCREMENTAL_MAPPING = os.environ.get('REDUNLIVE_INCREMENTAL_MAPPING', 'true') == 'true'
+    REDUNLIVE_POLL_LIVE_INTERVAL = float(os.environ.get('REDUNLIVE_POLL_LIVE_INTERVAL', 30))
+    REDUNLIVE_POLL_IDLE_INTERVAL = float(os.environ.get('REDUNLIVE_POLL_IDLE_INTERVAL', 300))
+    REDUNLIVE_POLL_RECENT_WINDOW = float(os.environ.get('REDUNLIVE_POLL_RECENT_WINDOW', 300))
+    # publish_type transitions kept per capture agent, and secs to keep the
+    # history of a device after its last transition
+    REDUNLIVE_HISTORY_SIZE = int(os.environ.get('REDUNLIVE_HISTORY_SIZE', 256))
+    REDUNLIVE_HISTORY_TTL = int(os.environ.get('REDUNLIVE_HISTORY_TTL', 7 * 24 * 3600))
+
+    # redunlive fleet poller: secs between polls, and whether to run it as a
+    # thread in the app process (rather than `manage.py poll`)
+    REDUNLIVE_POLL_INTERVAL = float(os.environ.get('REDUNLIVE_POLL_INTERVAL', 30))
+    REDUNLIVE_POLLER_THREAD = os.environ.get('REDUNLIVE_POLLER_THREAD', '') == 'true'
+    # secs before a snapshot is considered stale and refreshed in-request
+    REDUNLIVE_SNAPSHOT_MAX_AGE = float(os.environ.get('REDUNLIVE_SNAPSHOT_MAX_AGE', 120))
+    # secs a worker holds the lease to refresh the snapshot on behalf of all
+    REDUNLIVE_REFRESH_LEASE_TTL = int(os.environ.get('REDUNLIVE_REFRESH_LEASE_TTL', 60))
+    # server-sent events of location changes: secs between keepalives, and
+    # secs a stream is kept open before the browser reconnects
+    REDUNLIVE_EVENTS_HEARTBEAT = float(os.environ.get('REDUNLIVE_EVENTS_HEARTBEAT', 15))
+    REDUNLIVE_EVENTS_MAX_AGE = float(os.environ.get('REDUNLIVE_EVENTS_MAX_AGE', 300))
+    # rendered locations kept per process, to assemble the redunlive page
+    REDUNLIVE_FRAGMENT_CACHE_SIZE = int(os.environ.get('REDUNLIVE_FRAGMENT_CACHE_SIZE', 8192))
+
+    # secs between flushes of metrics of a worker to the app cache, and
+    # bearer token required by /metrics, if any
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 15))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', None)
+
+    # timed spans per request: logged for requests slower than threshold
+    # secs, and sent in a Server-Timing header if enabled
+    TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'true') == 'true'
+    TRACING_LOG_THRESHOLD = float(os.environ.get('TRACING_LOG_THRESHOLD', 1.0))
+    TRACING_SERVER_TIMING = os.environ.get('TRACING_SERVER_TIMING', '') == 'true'
+
     # ldap info is mandatory
     LDAP_HOST = 'fake_ldap_server.fake.com'
     LDAP_BASE_SEARCH = 'dc=fake,dc=com'
@@ -72,6 +149,8 @@ class Config(object):
             self.SQLALCHEMY_DATABASE_URI = 'sqlite://'
             self.CACHE_TYPE = 'simple'  # Can be "memcached", "redis", etc.
             self.WTF_CSRF_ENABLED = False  # Allows form testing
+            self.CA_STATS_CACHE_FILE = None  # do not share ca_stats between tests
+            self.REDUNLIVE_FAILOVER_SETTLE_DEADLINE = 0.5  # fake devices never settle
 
             if login_disabled:
                 # disabled login_required for unit tests
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+timed spans of a request, or of a background task, to tell where time goes.
+
+a trace collects the spans of one request; spans opened in a thread nest in
+the span open in that thread. threads running work for the request, as the
+pools polling capture agents, get the trace with `wrap`. outside a trace,
+spans cost a thread-local lookup.
+
+totals per span name are logged at the end of requests slower than
+`TRACING_LOG_THRESHOLD`, and sent in a `Server-Timing` header if
+`TRACING_SERVER_TIMING` is set.
+"""
+from contextlib import contextmanager
+from functools import wraps
+import logging
+import threading
+import time
+
+from flask import request
+from flask import signals
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+__all__ = ('Trace', 'current_trace', 'init_app', 'record', 'span', 'trace',
+           'traced', 'wrap')
+
+
+# spans kept in detail per trace; totals per name are kept for all
+MAX_SPANS = 1000
+
+_local = threading.local()
+
+
+class Trace(object):
+    """spans of one request or task; spans may be added from any thread."""
+
+    def __init__(self, name):
+        """create instance."""
+        self.name = name
+        self.start = time.time()
+        self.duration = None
+        self._lock = threading.Lock()
+        # (name, start, duration, depth), in order finished
+        self.spans = []
+        # name: [count, total secs, first start, depth of first]
+        self._totals = {}
+
+
+    def add(self, name, start, duration, depth=0):
+        with self._lock:
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append((name, start, duration, depth))
+            totals = self._totals.get(name)
+            if totals is None:
+                self._totals[name] = [1, duration, start, depth]
+            else:
+                totals[0] += 1
+                totals[1] += duration
+                if start < totals[2]:
+                    totals[2:] = [start, depth]
+
+
+    def finish(self):
+        self.duration = time.time() - self.start
+
+
+    def totals(self):
+        """list of (name, count, total secs, depth), by first start."""
+        with self._lock:
+            items = sorted(self._totals.items(), key=lambda i: i[1][2])
+        return [(name, t[0], t[1], t[3]) for (name, t) in items]
+
+
+    def summary(self):
+        """one line with totals per span name, nested ones indented by '.'."""
+        parts = []
+        for (name, count, total, depth) in self.totals():
+            parts.append('%s%s=%.1fms%s' % (
+                '.' * depth, name, total * 1000,
+                '' if count == 1 else '/%d' % count))
+        return '%s %.1fms: %s' % (
+                self.name, (self.duration or 0) * 1000, ', '.join(parts))
+
+
+    def server_timing(self):
+        """value for a Server-Timing header; concurrent spans add up."""
+        values = ['total;dur=%.1f' % ((self.duration or 0) * 1000)]
+        for (name, count, total, depth) in self.totals():
+            value = '%s;dur=%.1f' % (name, total * 1000)
+            if count > 1:
+                value += ';desc="%d calls"' % count
+            values.append(value)
+        return ', '.join(values)
+
+
+def current_trace():
+    """trace of this thread, or None."""
+    return getattr(_local, 'trace', None)
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _activate(t, stack):
+    previous = (getattr(_local, 'trace', None), getattr(_local, 'stack', None))
+    (_local.trace, _local.stack) = (t, stack)
+    return previous
+
+
+@contextmanager
+def trace(name):
+    """collect spans of this thread in a new trace, until done."""
+    t = Trace(name)
+    previous = _activate(t, [])
+    try:
+        yield t
+    finally:
+        t.finish()
+        _activate(*previous)
+
+
+@contextmanager
+def span(name):
+    """time the block as span `name`, nested in the span open, if any."""
+    t = current_trace()
+    if t is None:
+        yield
+        return
+    stack = _stack()
+    start = time.time()
+    stack.append(name)
+    try:
+        yield
+    finally:
+        stack.pop()
+        t.add(name, start, time.time() - start, len(stack))
+
+
+def record(name, start, duration):
+    """add span `name` already timed, from its `start` and `duration`."""
+    t = current_trace()
+    if t is not None:
+        t.add(name, start, duration, len(_stack()))
+
+
+def traced(name):
+    """decorator: time calls of the function as span `name`."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def wrap(f):
+    """`f` that runs in the trace and span of the caller, from any thread."""
+    t = current_trace()
+    if t is None:
+        return f
+    parents = list(_stack())
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        previous = _activate(t, list(parents))
+        try:
+            return f(*args, **kwargs)
+        finally:
+            _activate(*previous)
+    return wrapper
+
+
+def _start_request_trace():
+    _local.render_starts = []
+    _local.request_previous = _activate(
+            Trace('%s %s' % (request.method, request.path)), [])
+
+
+def _report_request_trace(app):
+    def after_request(response):
+        t = current_trace()
+        if t is None or getattr(_local, 'request_previous', None) is None:
+            return response
+        # a streamed body is sent after this, and not timed
+        t.finish()
+        if t.duration >= app.config['TRACING_LOG_THRESHOLD']:
+            logger = logging.getLogger(__name__)
+            logger.info('timing %s' % t.summary())
+        if app.config['TRACING_SERVER_TIMING']:
+            response.headers['Server-Timing'] = t.server_timing()
+        return response
+    return after_request
+
+
+def _end_request_trace(exc=None):
+    previous = getattr(_local, 'request_previous', None)
+    if previous is not None:
+        _local.request_previous = None
+        _activate(*previous)
+
+
+def _render_starts():
+    starts = getattr(_local, 'render_starts', None)
+    if starts is None:
+        starts = _local.render_starts = []
+    return starts
+
+
+def _before_render(sender, template, context, **extra):
+    if current_trace() is not None:
+        _stack().append('render')
+        _render_starts().append(time.time())
+
+
+def _rendered(sender, template, context, **extra):
+    if current_trace() is None:
+        return
+    stack = _stack()
+    starts = _render_starts()
+    if stack and stack[-1] == 'render' and starts:
+        stack.pop()
+        start = starts.pop()
+        record('render', start, time.time() - start)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_trace() is not None:
+        conn.info.setdefault('tracing_start', []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('tracing_start')
+    if starts and current_trace() is not None:
+        start = starts.pop()
+        record('db', start, time.time() - start)
+
+
+_engine_events = []
+
+
+def init_app(app):
+    """trace requests of `app`, if `TRACING_ENABLED`."""
+    if not app.config['TRACING_ENABLED']:
+        return
+    app.before_request(_start_request_trace)
+    app.after_request(_report_request_trace(app))
+    app.teardown_request(_end_request_trace)
+    signals.before_render_template.connect(_before_render, app)
+    signals.template_rendered.connect(_rendered, app)
+
+    # db statements of all engines, listened once per process
+    if not _engine_events:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _engine_events.append(True)
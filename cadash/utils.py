@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
 """Helper utilities and decorators."""
+from collections import namedtuple
+import io
+import json
 import os
 import logging
 import logging.config
 import platform
 import re
 import sys
+import tempfile
+import time
 import yaml
 
 from flask import current_app
@@ -19,6 +24,8 @@ import requests
 from requests.auth import HTTPBasicAuth
 
 from cadash import __version__
+from cadash import tracing
+from cadash.extensions import http_sessions
 from cadash.user.models import BaseUser
 
 
@@ -58,6 +65,7 @@ def clean_name(name):
     return re.sub('[^0-9a-zA-Z]+', '_', name.strip()).lower()
 
 
+@tracing.traced('pull_data')
 def pull_data(url, creds=None):
     """
     get text file from `url`.
@@ -77,8 +85,9 @@ def pull_data(url, creds=None):
             headers.update({'X-REQUESTED-AUTH': 'Basic'})
 
     try:
-        response = requests.get(url, headers=headers, auth=au)
-    except requests.HTTPError as e:
+        response = http_sessions.session(url).get(
+                url, headers=headers, auth=au, timeout=http_sessions.timeout)
+    except requests.RequestException as e:
         logger = logging.getLogger(__name__)
         logger.warning('data from url(%s) is unavailable. Error: %s' % (url, e))
         return None
@@ -86,6 +95,249 @@ def pull_data(url, creds=None):
         return response.text
 
 
+# text from `pull_data_cached`; `modified` is False when `text` is the same
+# as in the previous call, and `fetched_at` is when `text` was downloaded
+FetchResult = namedtuple('FetchResult', ['text', 'modified', 'fetched_at'])
+
+# chars read at a time from `stream_data_cached` responses
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class FetchStream(object):
+    """
+    text from `stream_data_cached`, read in chunks while iterated.
+
+    `modified` and `fetched_at` are as in FetchResult. close when done, or
+    use as a context manager, to release the connection; a stream not read
+    to the end is not cached.
+    """
+
+    def __init__(self, chunks, modified, fetched_at, response=None):
+        """create instance."""
+        self._chunks = chunks
+        self.modified = modified
+        self.fetched_at = fetched_at
+        self._response = response
+
+
+    def __iter__(self):
+        return self._chunks
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def read(self):
+        """all remaining text."""
+        return u''.join(self._chunks)
+
+
+    def close(self):
+        self._chunks.close()
+        if self._response is not None:
+            self._response.close()
+
+
+def pull_data_cached(url, cache_file=None, creds=None, timeout=None):
+    """
+    get text file from `url`, with a copy cached on disk.
+
+    sends a conditional request with validators (etag, last-modified) of the
+    copy in `cache_file`; when the server replies 304-not-modified, or is
+    unavailable, returns the cached copy instead.
+    if `cache_file` is None, nothing is cached.
+
+    :return: FetchResult, or None if no data is available
+    """
+    stream = stream_data_cached(
+            url, cache_file=cache_file, creds=creds, timeout=timeout)
+    if stream is None:
+        return None
+    with stream:
+        return FetchResult(stream.read(), stream.modified, stream.fetched_at)
+
+
+@tracing.traced('pull_data')
+def stream_data_cached(
+        url, cache_file=None, creds=None, timeout=None,
+        chunk_size=STREAM_CHUNK_SIZE):
+    """
+    same as `pull_data_cached`, but text is read in chunks as consumed.
+
+    the body is never held whole in memory; a downloaded body is written to
+    `cache_file` while read.
+
+    :return: FetchStream, or None if no data is available
+    """
+    logger = logging.getLogger(__name__)
+    cached = _read_cached_data(cache_file, url)
+
+    headers = {
+            'User-Agent': default_useragent(),
+            'Accept-Encoding': 'gzip, deflate',
+            'Accept': 'text/html, text/*'
+            }
+    if cached is not None:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+    au = None
+    if creds is not None:
+        if 'user' in creds and 'pwd' in creds:
+            au = HTTPBasicAuth(creds['user'], creds['pwd'])
+            headers.update({'X-REQUESTED-AUTH': 'Basic'})
+
+    try:
+        response = http_sessions.session(url).get(
+                url, headers=headers, auth=au, stream=True,
+                timeout=timeout or http_sessions.timeout)
+    except requests.RequestException as e:
+        logger.warning('data from url(%s) is unavailable. Error: %s' % (url, e))
+        response = None
+
+    if response is not None and response.status_code == 200:
+        fetched_at = time.time()
+        # json, the usual payload, is utf-8 when no charset is given
+        if response.encoding is None:
+            response.encoding = 'utf-8'
+        chunks = response.iter_content(chunk_size, decode_unicode=True)
+        return FetchStream(
+                _cache_chunks(chunks, cache_file, url, response, fetched_at),
+                True, fetched_at, response)
+
+    if response is not None:
+        response.close()
+    if response is not None and response.status_code == 304 and cached is not None:
+        return _cached_stream(cache_file, cached, chunk_size)
+
+    if response is not None:
+        logger.warning(
+                'data from url(%s) is unavailable. Status: %s'
+                % (url, response.status_code))
+    if cached is None:
+        return None
+
+    logger.warning(
+            'serving cached data from url(%s), downloaded at %s'
+            % (url, time.ctime(cached['fetched_at'])))
+    return _cached_stream(cache_file, cached, chunk_size)
+
+
+def stream_cached_data(url, cache_file, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    copy of `url` cached in `cache_file` by `stream_data_cached`, no request.
+
+    for when a download broke off while read, and the copy is left intact.
+
+    :return: FetchStream, or None if no copy is cached
+    """
+    cached = _read_cached_data(cache_file, url)
+    if cached is None:
+        return None
+    return _cached_stream(cache_file, cached, chunk_size)
+
+
+def _cached_stream(cache_file, cached, chunk_size):
+    return FetchStream(
+            _read_cached_chunks(cache_file, chunk_size), False,
+            cached['fetched_at'])
+
+
+def _read_cached_data(cache_file, url):
+    """validators for data cached in `cache_file`; None if no usable copy."""
+    if cache_file is None:
+        return None
+    try:
+        with open('%s.meta' % cache_file, 'r') as f:
+            meta = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if meta.get('url') != url or not os.path.exists(cache_file):
+        return None
+    return meta
+
+
+def _read_cached_chunks(cache_file, chunk_size):
+    with io.open(cache_file, 'r', encoding='utf-8') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _cache_chunks(chunks, cache_file, url, response, fetched_at):
+    """
+    yield `chunks` of body of `response`, writing them in `cache_file`.
+
+    body and validators are written to temp files, and moved in place only
+    when the whole body was read.
+    """
+    if cache_file is None:
+        for chunk in chunks:
+            yield chunk
+        return
+
+    logger = logging.getLogger(__name__)
+    meta = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': fetched_at,
+            }
+    cache_dir = os.path.dirname(os.path.abspath(cache_file))
+    tmp_body = None
+    f = None
+    try:
+        try:
+            (fd, tmp_body) = tempfile.mkstemp(dir=cache_dir)
+            f = io.open(fd, 'w', encoding='utf-8')
+        except (IOError, OSError) as e:
+            logger.warning(
+                    'unable to cache data from url(%s) in (%s). error: %s'
+                    % (url, cache_file, e))
+
+        for chunk in chunks:
+            if f is not None:
+                f.write(chunk)
+            yield chunk
+
+        if f is not None:
+            f.close()
+            f = None
+            _commit_cached_data(cache_file, url, tmp_body, meta)
+            tmp_body = None
+    finally:
+        if f is not None:
+            f.close()
+        if tmp_body is not None and os.path.exists(tmp_body):
+            os.remove(tmp_body)
+
+
+def _commit_cached_data(cache_file, url, tmp_body, meta):
+    """move body in `tmp_body` to `cache_file`, with validators in `meta`."""
+    cache_dir = os.path.dirname(os.path.abspath(cache_file))
+    try:
+        (fd, tmp_meta) = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f)
+        # body first: stale validators only cost a full download next time,
+        # but new validators with the old body would serve it on a 304
+        os.rename(tmp_body, cache_file)
+        os.rename(tmp_meta, '%s.meta' % cache_file)
+    except (IOError, OSError) as e:
+        logger = logging.getLogger(__name__)
+        logger.warning(
+                'unable to cache data from url(%s) in (%s). error: %s'
+                % (url, cache_file, e))
+
+
 def default_useragent():
     """Return a string representing the default user agent."""
     _implementation = platform.python_implementation()
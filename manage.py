@@ -10,7 +10,9 @@ from flask_script import Command, Manager, Option, Server, Shell
 from flask_script.commands import Clean, ShowUrls
 
 from cadash.app import create_app
+from cadash.compat import ASYNCIO
 from cadash.database import db
+from cadash.redunlive.worker import FleetPoller
 from cadash.settings import Config
 from cadash.user.models import BaseUser
 
@@ -63,7 +65,31 @@ class Lint(Command):
 
         if fix_imports:
             execute_tool('Fixing import order', 'isort', '-rc')
-        execute_tool('Checking code style', 'flake8')
+        flake8 = ['flake8']
+        if not ASYNCIO:
+            # async/await is a syntax error before python 3.5
+            flake8 += ['--exclude', '.git,__pycache__,aio.py,test_redunlive_aio.py']
+        execute_tool('Checking code style', *flake8)
+
+
+class PollRedunlive(Command):
+    """Poll all capture agents and keep the redunlive snapshot fresh."""
+
+    def get_options(self):
+        """Command line options."""
+        return (
+            Option('-i', '--interval', type=float, dest='interval', default=None,
+                   help='Seconds between polls (default: REDUNLIVE_POLL_INTERVAL)'),
+            Option('--once', action='store_true', dest='once', default=False,
+                   help='Poll once and exit'),
+        )
+
+    def run(self, interval, once):
+        """Run command."""
+        poller = FleetPoller(app, interval or app.config['REDUNLIVE_POLL_INTERVAL'])
+        if once:
+            return 0 if poller.poll_once() is not None else 1
+        poller.run()
 
 
 manager.add_command('server', Server())
@@ -72,6 +98,7 @@ manager.add_command('db', MigrateCommand)
 manager.add_command('urls', ShowUrls())
 manager.add_command('clean', Clean())
 manager.add_command('lint', Lint())
+manager.add_command('poll', PollRedunlive())
 
 if __name__ == '__main__':
     manager.run()
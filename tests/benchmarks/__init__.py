@@ -0,0 +1 @@
+"""Benchmarks for the app; run as scripts, not collected by pytest."""
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+memory held parsing ca_stats, whole payload vs streaming, by fleet size.
+
+run from the repo root:
+
+    python -m tests.benchmarks.bench_ca_stats [number_of_agents ...]
+
+"whole" is the text plus `json.loads` of it, as held before streaming;
+with streaming, "buffer" is the largest text held by the parser, and
+"entries" what `read_ca_stats` keeps for the mapping.
+"""
+import json
+import sys
+
+from cadash.redunlive import ca_stats
+from cadash.redunlive.ca_stats import _ChunkReader
+from cadash.redunlive.ca_stats import iter_json_array
+from cadash.redunlive.ca_stats import read_ca_stats
+from cadash.utils import STREAM_CHUNK_SIZE
+
+from tests.benchmarks.bench_models_memory import deep_size
+
+
+def ca_item(i):
+    return {
+            'location': 'Room %05d' % (i // 2),
+            'role': 'Primary' if i % 2 else 'Secondary',
+            'address': 'epiphan%05d.example.edu' % i,
+            'ca_attributes': {
+                'serial_number': 'SERIAL%05d' % i,
+                'product_name': 'Epiphan Pearl',
+                'channel_status': {'uptime': 1000 + i, 'state': 'ok'},
+                'channels': dict(
+                    (str(c), {'name': name, 'publish_type': '6',
+                              'activeInputs': '2', 'uptime': 1000 + i})
+                    for (c, name) in enumerate(
+                        ['SDI-A', 'SDI-B', 'Live', 'Live lowBR'], 1)),
+                },
+            }
+
+
+class MeasuredReader(_ChunkReader):
+    largest = 0
+
+    def fill(self):
+        filled = _ChunkReader.fill(self)
+        MeasuredReader.largest = max(MeasuredReader.largest, sys.getsizeof(self.buf))
+        return filled
+
+
+def main(argv):
+    sizes = [int(n) for n in argv[1:]] or [1000, 10000, 50000]
+    ca_stats._ChunkReader = MeasuredReader
+    print('%8s %12s %14s %10s %14s' % (
+        'agents', 'payload', 'whole', 'buffer', 'entries'))
+    for n in sizes:
+        text = json.dumps([ca_item(i) for i in range(n)])
+        whole = sys.getsizeof(text) + deep_size(json.loads(text))
+
+        MeasuredReader.largest = 0
+        chunks = (text[i:i + STREAM_CHUNK_SIZE]
+                  for i in range(0, len(text), STREAM_CHUNK_SIZE))
+        entries = read_ca_stats(iter_json_array(chunks))
+        print('%8d %12d %14d %10d %14d' % (
+            n, len(text), whole, MeasuredReader.largest, deep_size(entries)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
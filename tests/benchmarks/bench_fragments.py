@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+time to render the redunlive locations, full template pass vs fragments.
+
+run from the repo root:
+
+    python -m tests.benchmarks.bench_fragments [number_of_locations]
+
+"template" renders every location with the location template, as before
+fragments were cached; "cold" renders through the fragment cache when
+empty, and "warm" when only one location changed since.
+"""
+import sys
+import timeit
+
+from flask import render_template
+from mock import patch
+
+from cadash.app import create_app
+from cadash.ldap import LdapClient
+from cadash.redunlive.fragments import LOCATION_TEMPLATE
+from cadash.redunlive.fragments import get_fragment_cache
+from cadash.redunlive.fragments import render_locations
+from cadash.redunlive.snapshot import location_from_dict
+from cadash.redunlive.snapshot import location_to_dict
+from cadash.settings import Config
+
+from tests.test_redunlive_snapshot import make_location
+
+
+def best_ms(f, repeat=5):
+    return 1000 * min(timeit.repeat(f, number=1, repeat=repeat))
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 2000
+    with patch.object(LdapClient, 'is_authenticated', return_value=True):
+        app = create_app(Config(environment='test', login_disabled=True))
+
+    with app.test_request_context():
+        loc_dicts = [location_to_dict(make_location('room%05d' % i))
+                     for i in range(n)]
+
+        def template():
+            return u''.join(render_template(
+                LOCATION_TEMPLATE, loc=location_from_dict(d)) for d in loc_dicts)
+
+        def cold():
+            get_fragment_cache()._fragments.clear()
+            return u''.join(render_locations(loc_dicts))
+
+        renamed = [0]
+
+        def warm():
+            # one location in a state not rendered before
+            renamed[0] += 1
+            loc_dicts[0] = dict(loc_dicts[0], name='Room renamed %d' % renamed[0])
+            return u''.join(render_locations(loc_dicts))
+
+        print('locations: %d' % n)
+        print('render ms, template: %.1f  cold: %.1f  warm: %.1f' % (
+            best_ms(template), best_ms(cold), best_ms(warm)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+memory per capture agent in a fleet snapshot, before and after slots.
+
+run from the repo root:
+
+    python -m tests.benchmarks.bench_models_memory [number_of_agents]
+
+"before" is the previous layout of CaptureAgent, kept here for reference:
+an instance dict, nested channel dicts and an arrow last_update.
+"""
+import gc
+import sys
+import time
+import types
+
+import arrow
+
+from cadash.redunlive.models import CaptureAgent
+
+
+class DictCaptureAgent(object):
+    """CaptureAgent state as laid out before slots."""
+
+    def __init__(self, serial_number, address):
+        self._serial_number = serial_number
+        self._address = address
+        self._name = address.split('.', 1)[0]
+        self.client = None
+        self.breaker = None
+        self.history = None
+        self._last_update = arrow.get(2000, 1, 1)
+        self.channels = {
+                'live': {
+                    'channel': 'not available',
+                    'publish_type': 'not available'},
+                'lowBR': {
+                    'channel': 'not available',
+                    'publish_type': 'not available'},
+                }
+
+
+def _device_value(value):
+    # values parsed from device responses are new string objects
+    return ''.join(list(value))
+
+
+def _fill(ca, i):
+    ca.channels['live']['channel'] = _device_value('1')
+    ca.channels['lowBR']['channel'] = _device_value('2')
+    pt = _device_value('6' if i % 10 else 'not available')
+    ca.channels['live']['publish_type'] = pt
+    ca.channels['lowBR']['publish_type'] = _device_value(pt)
+    if isinstance(ca, CaptureAgent):
+        ca.last_update = time.time()
+    else:
+        ca._last_update = arrow.utcnow()
+
+
+_SKIP = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType)
+
+
+def deep_size(root):
+    """bytes of all objects reachable from `root`, each counted once."""
+    seen = set()
+    todo = [root]
+    size = 0
+    while todo:
+        obj = todo.pop()
+        if id(obj) in seen or isinstance(obj, _SKIP):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        todo.extend(gc.get_referents(obj))
+    return size
+
+
+def measure(cls, n):
+    cas = []
+    for i in range(n):
+        ca = cls('SERIAL%06d' % i, 'fake%06d.example.edu' % i)
+        _fill(ca, i)
+        cas.append(ca)
+    # the list itself and per-agent serial/address/name are the same in both
+    return deep_size(cas) / float(n)
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 10000
+    before = measure(DictCaptureAgent, n)
+    after = measure(CaptureAgent, n)
+    print('capture agents: %d' % n)
+    print('bytes per agent, before (dicts): %8.1f' % before)
+    print('bytes per agent, after (slots):  %8.1f' % after)
+    print('saved: %.1f%%' % (100 * (before - after) / before))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+redunlive pipeline at fleet scale, stage by stage, against the fake farm.
+
+run from the repo root:
+
+    python -m tests.benchmarks.bench_pipeline [--agents 10 100 1000 10000]
+        [--latency constant:0.005] [--output results.json]
+        [--compare previous.json]
+
+stages are run in order for each fleet size:
+
+    pull_data    pull ca_stats from the farm feed and parse it
+    map          map capture agents to locations, devices not polled
+    sync         poll all devices (sync_live_status)
+    render       render the redunlive page, fragment cache empty
+    render_warm  render it again, as for the next request
+
+for each stage: wall secs and device requests, from a run without memory
+tracing; peak bytes and allocated blocks, from a second run with
+tracemalloc (python 3 only; on python 2, max rss of the process). results
+are written as json, with the cadash and python versions, so runs of two
+releases can be compared with `--compare`.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from flask import render_template
+from mock import patch
+
+from cadash import __version__ as cadash_version
+from cadash.app import create_app
+from cadash.ldap import LdapClient
+from cadash.redunlive import data_masseuse
+from cadash.redunlive.data_masseuse import load_ca_stats_entries
+from cadash.redunlive.data_masseuse import map_redunlive_ca_loc
+from cadash.redunlive.data_masseuse import sync_cas
+from cadash.redunlive.fragments import render_locations
+from cadash.redunlive.snapshot import publish_snapshot
+from cadash.settings import Config
+
+from tests.fakefarm import FakeFarm
+
+STAGES = ('pull_data', 'map', 'sync', 'render', 'render_warm')
+
+
+class StageMeter(object):
+    """wall time, device requests and memory of each stage."""
+
+    def __init__(self, farm, trace):
+        self.farm = farm
+        self.trace = trace and tracemalloc is not None
+        self.stages = {}
+
+
+    def run(self, name, f, *args):
+        self.farm.counts(reset=True)
+        if self.trace:
+            tracemalloc.start()
+            blocks = sys.getallocatedblocks()
+        start = time.time()
+        result = f(*args)
+        wall = time.time() - start
+
+        stage = {'wall_secs': wall, 'device_requests': sum(
+            n for (kind, n) in self.farm.counts().items() if kind != 'ca_stats')}
+        if self.trace:
+            stage['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            stage['allocated_blocks'] = sys.getallocatedblocks() - blocks
+            tracemalloc.stop()
+        elif resource is not None:
+            stage['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.stages[name] = stage
+        return result
+
+
+def run_pipeline(app, farm, trace):
+    meter = StageMeter(farm, trace)
+    with app.test_request_context():
+        # a fresh process: no ca_stats parsed, no fragments rendered
+        app.extensions.pop('redunlive', None)
+        app.extensions.pop('redunlive_fragments', None)
+
+        entries = meter.run('pull_data', load_ca_stats_entries)
+        with patch.object(data_masseuse, 'sync_cas', return_value=[]):
+            mapping = meter.run('map', map_redunlive_ca_loc, entries)
+        missed = meter.run('sync', sync_cas, mapping['synced_cas'])
+
+        snapshot = publish_snapshot(mapping['all_locations'])
+
+        def render():
+            loc_dicts = [snapshot['locations'][loc_id]
+                         for loc_id in sorted(snapshot['locations'].keys())]
+            rows = [(d['id'], d['name'], fragment) for (d, fragment)
+                    in zip(loc_dicts, render_locations(loc_dicts))]
+            return render_template(
+                    'redunlive/home.html', version=cadash_version, rows=rows,
+                    job=None, snapshot_version=snapshot['version'])
+
+        meter.run('render', render)
+        meter.run('render_warm', render)
+    return (meter.stages, len(missed))
+
+
+def bench(agents, args):
+    with patch.object(LdapClient, 'is_authenticated', return_value=True):
+        app = create_app(Config(environment='test', login_disabled=True))
+    app.config['DEBUG_TB_ENABLED'] = False
+    app.config['REDUNLIVE_POLL_DEADLINE'] = args.deadline
+
+    with FakeFarm(locations=agents // 2, latency=args.latency,
+                  seed=args.seed) as farm:
+        app.config['CA_STATS_JSON_URL'] = farm.ca_stats_url
+        with patch.dict(os.environ, {'HTTP_PROXY': farm.url, 'NO_PROXY': ''}):
+            (stages, missed) = run_pipeline(app, farm, trace=False)
+            (traced, traced_missed) = run_pipeline(app, farm, trace=True)
+
+    for name in STAGES:
+        for (key, value) in traced[name].items():
+            if key not in ('wall_secs', 'device_requests'):
+                stages[name][key] = value
+    return {'agents': agents, 'missed_deadline': missed, 'stages': stages}
+
+
+def print_result(result, previous=None):
+    print('agents: %d  missed deadline: %d' % (
+        result['agents'], result['missed_deadline']))
+    for name in STAGES:
+        stage = result['stages'][name]
+        line = '  %-12s %9.3fs %8d reqs' % (
+                name, stage['wall_secs'], stage['device_requests'])
+        if 'peak_bytes' in stage:
+            line += ' %12d peak bytes %10d blocks' % (
+                    stage['peak_bytes'], stage['allocated_blocks'])
+        elif 'max_rss_kb' in stage:
+            line += ' %10d max rss kb' % stage['max_rss_kb']
+        if previous is not None and previous['stages'][name]['wall_secs'] > 0:
+            line += '  x%.2f wall' % (
+                    stage['wall_secs'] / previous['stages'][name]['wall_secs'])
+        print(line)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+            prog='python -m tests.benchmarks.bench_pipeline',
+            description='redunlive pipeline at fleet scale')
+    parser.add_argument('--agents', type=int, nargs='+',
+                        default=[10, 100, 1000, 10000])
+    parser.add_argument('--latency', default='constant:0.005',
+                        help='device latency distribution, as in fakefarm')
+    parser.add_argument('--deadline', type=float, default=600,
+                        help='secs for the sync stage')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None,
+                        help='json file for results; default '
+                             'bench_pipeline-<version>.json')
+    parser.add_argument('--compare', default=None,
+                        help='json file of an earlier run to compare with')
+    args = parser.parse_args(argv[1:])
+
+    # debug lines per device call would be most of the sync stage
+    logging.disable(logging.DEBUG)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = dict(
+                    (r['agents'], r) for r in json.load(f)['results'])
+
+    results = []
+    for agents in args.agents:
+        result = bench(agents, args)
+        results.append(result)
+        print_result(result, previous.get(agents))
+
+    output = args.output or 'bench_pipeline-%s.json' % cadash_version
+    with open(output, 'w') as f:
+        json.dump({
+            'cadash_version': cadash_version,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'created': time.time(),
+            'latency': args.latency,
+            'results': results}, f, indent=2, sort_keys=True)
+    print('results in %s' % output)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
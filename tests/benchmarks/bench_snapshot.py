@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+size and load time of the redunlive snapshot, pickled dicts vs codec.
+
+run from the repo root:
+
+    python -m tests.benchmarks.bench_snapshot [number_of_locations]
+"""
+import sys
+import timeit
+
+try:
+    import cPickle as pickle  # as werkzeug cache does on python 2
+except ImportError:
+    import pickle
+
+from cadash.redunlive.codec import decode_location
+from cadash.redunlive.codec import decode_snapshot
+from cadash.redunlive.codec import encode_snapshot
+from cadash.redunlive.codec import replace_locations
+
+
+def _ca(serial_number, address, publish_type):
+    return {
+            'serial_number': serial_number,
+            'address': address,
+            'last_update': 1500000000.0,
+            'channels': {
+                'live': {'channel': '1', 'publish_type': publish_type},
+                'lowBR': {'channel': '2', 'publish_type': publish_type}},
+            }
+
+
+def fleet(n):
+    locations = {}
+    for i in range(n):
+        loc_id = 'room%05d' % i
+        locations[loc_id] = {
+                'id': loc_id,
+                'name': 'Room %05d' % i,
+                'primary_ca': _ca('P%05d' % i, 'p%05d.example.edu' % i, '6'),
+                'secondary_ca': _ca('S%05d' % i, 's%05d.example.edu' % i, '0'),
+                'experimental_cas': [],
+                }
+    return locations
+
+
+def best_ms(f, repeat=5):
+    return 1000 * min(timeit.repeat(f, number=1, repeat=repeat))
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 10000
+    locations = fleet(n)
+    snapshot = {'version': 1, 'created': 1500000000.0, 'locations': locations}
+    pickled = pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL)
+    packed = encode_snapshot(snapshot)
+    some_id = 'room%05d' % (n // 2)
+    one = {some_id: locations[some_id]}
+
+    print('locations: %d' % n)
+    print('bytes, pickle: %d  codec: %d' % (len(pickled), len(packed)))
+    print('full load ms, pickle: %.2f  codec: %.2f' % (
+        best_ms(lambda: pickle.loads(pickled)),
+        best_ms(lambda: decode_snapshot(packed))))
+    print('one location ms, pickle: %.2f  codec: %.3f' % (
+        best_ms(lambda: pickle.loads(pickled)['locations'][some_id]),
+        best_ms(lambda: decode_location(packed, some_id))))
+    print('update one location ms, pickle: %.2f  codec: %.2f' % (
+        best_ms(lambda: pickle.dumps(pickle.loads(pickled), pickle.HIGHEST_PROTOCOL)),
+        best_ms(lambda: replace_locations(packed, 2, 1500000001.0, one))))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+"""
+fake farm of epiphan pearls, and the ca_stats feed listing them.
+
+serves the epipearl http api used by redunlive,
+
+    GET /admin/channel<N>/get_params.cgi?publish_type
+    GET /admin/channel<N>/set_params.cgi?publish_type=<value>
+
+for thousands of virtual devices on one port, with latency, failures and
+publish_type settle delays drawn from configurable distributions. devices
+are told apart by host name, so point the app at the farm as http proxy:
+
+    python -m tests.fakefarm --locations 2000 --port 8099
+
+    export HTTP_PROXY=http://127.0.0.1:8099
+    export CA_STATS_JSON_URL=http://ca-stats.fakefarm.example.edu/ca_stats.json
+
+requests that are not through the proxy (host 127.0.0.1) get the ca_stats
+feed at any path ending in `ca_stats.json`.
+
+distributions are given as `name:args`, in secs: `constant:0.05`,
+`uniform:0.01,0.2`, `lognormal:<median>,<sigma>`, or `exponential:<mean>`.
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import socket
+import sys
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+    from urlparse import urlsplit
+except ImportError:
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+    from urllib.parse import urlsplit
+
+
+FEED_HOST = 'ca-stats.fakefarm.example.edu'
+DEVICE_DOMAIN = 'fakefarm.example.edu'
+
+# channels as set up in the dce pearls: live and lowBR channels by name
+CHANNELS = [('1', 'SDI-A'), ('2', 'SDI-B'),
+            ('3', 'MergedLive'), ('4', 'MergedLive_LowBR')]
+LIVE_CHANNELS = ('3', '4')
+
+PUBLISH_LIVE = '6'
+PUBLISH_OFF = '0'
+
+
+def parse_distribution(spec):
+    """
+    function returning a random value, as in `spec`.
+
+    :param: spec: 'constant:<x>', 'uniform:<a>,<b>',
+        'lognormal:<median>,<sigma>' or 'exponential:<mean>'
+    """
+    (name, _, args) = spec.partition(':')
+    args = [float(a) for a in args.split(',')] if args else []
+    if name == 'constant' and len(args) == 1:
+        return lambda r: args[0]
+    if name == 'uniform' and len(args) == 2:
+        return lambda r: r.uniform(args[0], args[1])
+    if name == 'lognormal' and len(args) == 2:
+        mu = math.log(args[0])
+        return lambda r: r.lognormvariate(mu, args[1])
+    if name == 'exponential' and len(args) == 1:
+        return lambda r: r.expovariate(1.0 / args[0]) if args[0] > 0 else 0.0
+    raise ValueError('invalid distribution(%s)' % spec)
+
+
+class FakePearl(object):
+    """virtual device: publish_type of channels, as set by set_params."""
+
+    def __init__(self, serial_number, address, location, role, publish_type,
+                 unreachable=False):
+        self.serial_number = serial_number
+        self.address = address
+        self.location = location
+        self.role = role
+        self.unreachable = unreachable
+        self.lock = threading.Lock()
+        self._publish_types = dict(
+                (chan, publish_type if chan in LIVE_CHANNELS else PUBLISH_OFF)
+                for (chan, name) in CHANNELS)
+        # channel -> (publish_type, time it takes effect)
+        self._pending = {}
+
+
+    def get_publish_type(self, channel, now):
+        with self.lock:
+            pending = self._pending.get(channel)
+            if pending is not None and pending[1] <= now:
+                self._publish_types[channel] = pending[0]
+                del self._pending[channel]
+            return self._publish_types.get(channel)
+
+
+    def set_publish_type(self, channel, value, settle_at):
+        with self.lock:
+            if channel not in self._publish_types:
+                return False
+            self._pending[channel] = (value, settle_at)
+            return True
+
+
+    def ca_stats_item(self, now):
+        channels = {}
+        for (chan, name) in CHANNELS:
+            channels[chan] = {
+                    'activeInputs': '1', 'name': name,
+                    'publish_type': self.get_publish_type(chan, now),
+                    'state': '', 'totalInputs': '2', 'uptime': 0}
+        return {
+                'address': self.address,
+                'location': self.location,
+                'name': self.address.split('.', 1)[0],
+                'role': self.role,
+                'vendor': 'Epiphan',
+                'disabled': 'false',
+                'pingable': not self.unreachable,
+                'ca_attributes': {
+                    'serial_number': self.serial_number,
+                    'product_name': 'Matterhorn',
+                    'channels': channels},
+                }
+
+
+class FarmServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # connections dropped on purpose, or by clients timing out
+        pass
+
+
+class FarmHandler(BaseHTTPRequestHandler):
+    # keep-alive, as the app pools connections to devices
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def do_GET(self):
+        farm = self.server.farm
+        parts = urlsplit(self.path)
+        host = parts.netloc or self.headers.get('Host', '')
+        host = host.split(':', 1)[0].lower()
+
+        device = farm.devices_by_address.get(host)
+        if device is None:
+            if host == FEED_HOST or parts.path.endswith('ca_stats.json'):
+                return self._feed()
+            farm.count('not_found')
+            return self._reply(404, 'unknown host(%s)\n' % host)
+        return self._device(device, parts)
+
+
+    def _feed(self):
+        farm = self.server.farm
+        farm.count('ca_stats')
+        (body, etag) = farm.ca_stats_body()
+        if self.headers.get('If-None-Match') == etag:
+            return self._reply(304, '', {'ETag': etag})
+        return self._reply(
+                200, body, {'ETag': etag, 'Content-Type': 'application/json'})
+
+
+    def _device(self, device, parts):
+        farm = self.server.farm
+        if device.unreachable:
+            farm.count('unreachable')
+            # as a proxy that cannot connect: no response at all
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+
+        time.sleep(farm.draw_latency())
+        outcome = farm.draw_outcome()
+        if outcome == 'hang':
+            farm.count('hung')
+            time.sleep(farm.hang)
+            self.close_connection = True
+            return
+        if outcome == 'fail':
+            farm.count('failed')
+            return self._reply(503, 'service unavailable\n')
+
+        segments = parts.path.strip('/').split('/')
+        query = parse_qs(parts.query, keep_blank_values=True)
+        if len(segments) != 3 or segments[0] != 'admin' or \
+                not segments[1].startswith('channel'):
+            farm.count('not_found')
+            return self._reply(404, 'not found\n')
+        channel = segments[1][len('channel'):]
+
+        now = time.time()
+        if segments[2] == 'get_params.cgi':
+            farm.count('get_params')
+            publish_type = device.get_publish_type(channel, now)
+            if publish_type is None:
+                return self._reply(404, 'no channel(%s)\n' % channel)
+            return self._reply(200, 'publish_type = %s\n' % publish_type)
+
+        if segments[2] == 'set_params.cgi' and 'publish_type' in query:
+            farm.count('set_params')
+            settle_at = now + farm.draw_settle()
+            if not device.set_publish_type(
+                    channel, query['publish_type'][0], settle_at):
+                return self._reply(404, 'no channel(%s)\n' % channel)
+            return self._reply(200, '')
+
+        farm.count('not_found')
+        return self._reply(404, 'not found\n')
+
+
+    def _reply(self, status, body, headers={}):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        if 'Content-Type' not in headers:
+            self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+
+class FakeFarm(object):
+    """
+    pearls of `locations` rooms, a primary and a secondary each.
+
+    :param: live_ratio: fraction of rooms streaming live, on the primary
+    :param: latency: distribution of secs to respond to a device request
+    :param: settle: distribution of secs for set_params to take effect
+    :param: failure_rate: fraction of device requests answered with 503
+    :param: hang_rate: fraction of device requests never answered; the
+        connection is closed after `hang` secs
+    :param: unreachable_ratio: fraction of devices that drop every request
+    :param: feed_interval: secs the ca_stats feed stays the same, as it is
+        collected periodically
+    """
+
+    def __init__(self, locations=100, live_ratio=0.5,
+                 latency='constant:0', settle='constant:0',
+                 failure_rate=0.0, hang_rate=0.0, hang=30.0,
+                 unreachable_ratio=0.0, feed_interval=60.0, seed=None):
+        self.random = random.Random(seed)
+        self._latency = parse_distribution(latency)
+        self._settle = parse_distribution(settle)
+        self.failure_rate = failure_rate
+        self.hang_rate = hang_rate
+        self.hang = hang
+        self.feed_interval = feed_interval
+
+        self.devices = []
+        for i in range(locations):
+            live = self.random.random() < live_ratio
+            for (role, suffix, streaming) in [
+                    ('Primary', 'a', live), ('Secondary', 'b', False)]:
+                self.devices.append(FakePearl(
+                    serial_number='FAKE%05d%s' % (i, suffix.upper()),
+                    address='pearl%05d%s.%s' % (i, suffix, DEVICE_DOMAIN),
+                    location='Fake Room %05d' % i,
+                    role=role,
+                    publish_type=PUBLISH_LIVE if streaming else PUBLISH_OFF,
+                    unreachable=self.random.random() < unreachable_ratio))
+        self.devices_by_address = dict((d.address, d) for d in self.devices)
+
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._feed = (None, None, 0)
+        self._server = None
+        self._thread = None
+
+
+    def draw_latency(self):
+        return max(0.0, self._latency(self.random))
+
+
+    def draw_settle(self):
+        return max(0.0, self._settle(self.random))
+
+
+    def draw_outcome(self):
+        """'fail', 'hang' or 'ok' for a device request."""
+        x = self.random.random()
+        if x < self.failure_rate:
+            return 'fail'
+        if x < self.failure_rate + self.hang_rate:
+            return 'hang'
+        return 'ok'
+
+
+    def count(self, kind):
+        with self._lock:
+            self._counts[kind] = self._counts.get(kind, 0) + 1
+
+
+    def counts(self, reset=False):
+        """requests served by kind since started, or since last reset."""
+        with self._lock:
+            counts = dict(self._counts)
+            if reset:
+                self._counts.clear()
+        return counts
+
+
+    def ca_stats(self):
+        """ca_stats items of all devices, with current publish_types."""
+        now = time.time()
+        return [d.ca_stats_item(now) for d in self.devices]
+
+
+    def ca_stats_body(self):
+        """(json text of ca_stats, etag), regenerated every feed_interval."""
+        with self._lock:
+            (body, etag, created) = self._feed
+            if body is None or time.time() - created >= self.feed_interval:
+                body = json.dumps(self.ca_stats())
+                etag = '"%s"' % hashlib.sha1(body.encode('utf-8')).hexdigest()
+                self._feed = (body, etag, time.time())
+        return (body, etag)
+
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self._server.server_address[:2]
+
+
+    @property
+    def ca_stats_url(self):
+        return 'http://%s/ca_stats.json' % FEED_HOST
+
+
+    def start(self, host='127.0.0.1', port=0):
+        """serve in a background thread; return url of the farm."""
+        self._server = FarmServer((host, port), FarmHandler)
+        self._server.farm = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self.url
+
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+            prog='python -m tests.fakefarm',
+            description='fake farm of epiphan pearls and ca_stats feed')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--locations', type=int, default=1000)
+    parser.add_argument('--live-ratio', type=float, default=0.5)
+    parser.add_argument('--latency', default='lognormal:0.05,0.5')
+    parser.add_argument('--settle', default='uniform:0.5,2')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--hang-rate', type=float, default=0.0)
+    parser.add_argument('--hang', type=float, default=30.0)
+    parser.add_argument('--unreachable-ratio', type=float, default=0.0)
+    parser.add_argument('--feed-interval', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv[1:])
+
+    farm = FakeFarm(
+            locations=args.locations, live_ratio=args.live_ratio,
+            latency=args.latency, settle=args.settle,
+            failure_rate=args.failure_rate, hang_rate=args.hang_rate,
+            hang=args.hang, unreachable_ratio=args.unreachable_ratio,
+            feed_interval=args.feed_interval, seed=args.seed)
+    url = farm.start(args.host, args.port)
+    print('fake farm of %d pearls at %s' % (len(farm.devices), url))
+    print('    export HTTP_PROXY=%s' % url)
+    print('    export CA_STATS_JSON_URL=%s' % farm.ca_stats_url)
+    try:
+        while True:
+            time.sleep(10)
+            print('requests: %s' % farm.counts(reset=True))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        farm.stop()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -2,12 +2,21 @@
 """Tests for `data_masseuse` module."""
 import os
 import pytest
+import shutil
+import tempfile
 
+import copy
 import json
 import httpretty
+from mock import patch
+import requests
 
+from cadash.compat import ASYNCIO
 from cadash.redunlive.models import CaLocation
+from cadash.redunlive.models import CaptureAgent
+from cadash.redunlive.data_masseuse import load_ca_stats_entries
 from cadash.redunlive.data_masseuse import map_redunlive_ca_loc
+from cadash.redunlive.data_masseuse import sync_cas
 
 data_filename = os.path.join(
         os.path.abspath(os.path.dirname(__file__)), 'ca_loc_shortmap.json')
@@ -152,3 +161,127 @@ class TestDataMasseuse(object):
         assert loc.primary_ca.channels['live']['channel'] == 'not available'
         assert loc.active_livestream == 'secondary'
 
+
+    @httpretty.activate
+    def test_redunlive_incremental(self):
+        for device in ['033', '017', '089', '088']:
+            for channel in ['3', '4']:
+                httpretty.register_uri(
+                        httpretty.GET,
+                        'http://fake-epiphan%s.dce.harvard.edu/admin/channel%s/get_params.cgi'
+                        % (device, channel),
+                        body='publish_type = 6' if device == '017' else 'publish_type = 0')
+
+        first = map_redunlive_ca_loc(self.json_data)
+        assert len(first['synced_cas']) == 4
+        requests_count = len(httpretty.HTTPretty.latest_requests)
+
+        # nothing changed: no device polled, same objects
+        second = map_redunlive_ca_loc(self.json_data, previous=first)
+        assert second['synced_cas'] == []
+        assert len(httpretty.HTTPretty.latest_requests) == requests_count
+        assert second['all_locations']['fake_room'] is first['all_locations']['fake_room']
+        for serial, ca in first['all_cas'].items():
+            assert second['all_cas'][serial] is ca
+
+        # one ca changed: only that one is polled
+        changed_data = copy.deepcopy(self.json_data)
+        changed = changed_data[0]
+        changed['ca_attributes']['channels']['3']['publish_type'] = '0'
+        changed_serial = changed['ca_attributes']['serial_number']
+
+        third = map_redunlive_ca_loc(changed_data, previous=second)
+        assert [ca.serial_number for ca in third['synced_cas']] == [changed_serial]
+        assert third['all_locations']['fake_room'] is not second['all_locations']['fake_room']
+        for serial, ca in second['all_cas'].items():
+            if serial != changed_serial:
+                assert third['all_cas'][serial] is ca
+
+        # one ca dropped from ca_stats
+        dropped_data = [item for item in changed_data if item is not changed]
+        fourth = map_redunlive_ca_loc(dropped_data, previous=third)
+        assert fourth['synced_cas'] == []
+        assert changed_serial not in fourth['all_cas']
+        assert len(fourth['all_cas']) == 3
+
+
+    @httpretty.activate
+    def test_redunlive_scheduled_polls(self):
+        for device in ['033', '017', '089', '088']:
+            for channel in ['3', '4']:
+                httpretty.register_uri(
+                        httpretty.GET,
+                        'http://fake-epiphan%s.dce.harvard.edu/admin/channel%s/get_params.cgi'
+                        % (device, channel),
+                        body='publish_type = 6' if device == '017' else 'publish_type = 0')
+
+        first = map_redunlive_ca_loc(self.json_data)
+        schedule = first['schedule']
+        live = set()
+        for loc in first['all_locations'].values():
+            if loc.active_livestream is not None:
+                live.update([loc.primary_ca.serial_number, loc.secondary_ca.serial_number])
+        idle = set(first['all_cas'].keys()) - live
+        assert live and idle
+
+        # live rooms are polled more often than idle ones
+        live_due = max(schedule.due_at(s) for s in live)
+        idle_due = min(schedule.due_at(s) for s in idle)
+        assert idle_due - live_due > 200
+
+        # reused ca due for a poll is polled again
+        due_serial = sorted(idle)[0]
+        schedule.schedule(due_serial, 0)
+        second = map_redunlive_ca_loc(self.json_data, previous=first)
+        assert [ca.serial_number for ca in second['synced_cas']] == [due_serial]
+        assert second['all_cas'][due_serial] is first['all_cas'][due_serial]
+        assert schedule.due_at(due_serial) > idle_due
+
+
+    @pytest.mark.skipif(ASYNCIO, reason='fallback to threads only before python 3.5')
+    def test_async_polling_falls_back_to_threads(self, app):
+        app.config['REDUNLIVE_ASYNC_POLLING'] = True
+        ca = CaptureAgent('SERIAL0001', 'fake0001.example.edu')
+        with patch('cadash.redunlive.data_masseuse.sync_all', return_value=[]) as s:
+            assert sync_cas([ca]) == []
+        assert s.call_count == 1
+
+
+class TestLoadCaStatsEntries(object):
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmpdir, 'ca_stats.json')
+        with open(data_filename, 'r') as f:
+            self.raw_data = f.read()
+        httpretty.enable()
+
+
+    def teardown(self):
+        httpretty.disable()
+        httpretty.reset()
+        shutil.rmtree(self.tmpdir)
+
+
+    def test_body_broken_off_reads_cached(self, app):
+        url = 'http://ca_stats_fake_url.com/ca_stats.json'
+        app.config['CA_STATS_JSON_URL'] = url
+        app.config['CA_STATS_CACHE_FILE'] = self.cache_file
+        httpretty.register_uri(
+                httpretty.GET, url, body=self.raw_data, etag='"v1"')
+        first = load_ca_stats_entries()
+        assert first.location_entries
+
+        # a new version of ca_stats, that breaks off after its first item
+        httpretty.register_uri(
+                httpretty.GET, url, body='[]', etag='"v2"')
+
+        def broken(response, *args, **kwargs):
+            yield u'[{"location": "Room Gone", "address": "x", "role": "primary", '
+            raise requests.exceptions.ChunkedEncodingError('connection broken')
+
+        with patch.object(requests.Response, 'iter_content', broken):
+            second = load_ca_stats_entries()
+        assert second == first
+        with open(self.cache_file, 'r') as f:
+            assert f.read() == self.raw_data
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Tests for the fake farm of pearls used in benchmarks."""
+import os
+
+from mock import patch
+import pytest
+import requests
+
+from cadash.redunlive.data_masseuse import prep_redunlive_data
+from cadash.redunlive.failover import submit_failover
+from cadash.redunlive.snapshot import location_to_dict
+
+from tests.fakefarm import FakeFarm
+from tests.fakefarm import parse_distribution
+
+
+@pytest.yield_fixture
+def farm():
+    with FakeFarm(locations=3, live_ratio=1.0, seed=1) as f:
+        yield f
+
+
+def device_url(device, path):
+    return 'http://%s/admin/%s' % (device.address, path)
+
+
+class TestFakeFarm(object):
+
+    def test_distributions(self):
+        r = FakeFarm(locations=0, seed=1).random
+        assert parse_distribution('constant:0.5')(r) == 0.5
+        assert 0.1 <= parse_distribution('uniform:0.1,0.2')(r) <= 0.2
+        assert parse_distribution('lognormal:0.05,0.5')(r) > 0
+        with pytest.raises(ValueError):
+            parse_distribution('normal:1')
+
+
+    def test_get_set_params(self, farm):
+        proxies = {'http': farm.url}
+        primary = farm.devices[0]
+        url = device_url(primary, 'channel3/get_params.cgi')
+
+        res = requests.get(url, params={'publish_type': ''}, proxies=proxies)
+        assert res.text == 'publish_type = 6\n'
+
+        requests.get(device_url(primary, 'channel3/set_params.cgi'),
+                     params={'publish_type': '0'}, proxies=proxies)
+        res = requests.get(url, params={'publish_type': ''}, proxies=proxies)
+        assert res.text == 'publish_type = 0\n'
+        assert farm.counts() == {'get_params': 2, 'set_params': 1}
+
+
+    def test_settle_failures_unreachable(self):
+        with FakeFarm(locations=1, live_ratio=1.0, settle='constant:60',
+                      failure_rate=1.0) as farm:
+            primary = farm.devices[0]
+            res = requests.get(
+                    device_url(primary, 'channel3/get_params.cgi'),
+                    proxies={'http': farm.url})
+            assert res.status_code == 503
+
+            farm.failure_rate = 0
+            requests.get(device_url(primary, 'channel3/set_params.cgi'),
+                         params={'publish_type': '0'}, proxies={'http': farm.url})
+            res = requests.get(device_url(primary, 'channel3/get_params.cgi'),
+                               proxies={'http': farm.url})
+            # not settled yet
+            assert res.text == 'publish_type = 6\n'
+
+            primary.unreachable = True
+            with pytest.raises(requests.ConnectionError):
+                requests.get(device_url(primary, 'channel3/get_params.cgi'),
+                             proxies={'http': farm.url})
+
+
+    def test_feed(self, farm):
+        res = requests.get(farm.url + '/ca_stats.json')
+        assert len(res.json()) == 6
+        assert res.json()[0]['role'] == 'Primary'
+
+        res = requests.get(farm.url + '/ca_stats.json',
+                           headers={'If-None-Match': res.headers['ETag']})
+        assert res.status_code == 304
+
+
+    def test_redunlive_against_farm(self, app, farm):
+        app.config['CA_STATS_JSON_URL'] = farm.ca_stats_url
+        with patch.dict(os.environ, {'HTTP_PROXY': farm.url, 'NO_PROXY': ''}):
+            data = prep_redunlive_data()
+            assert len(data['all_locations']) == 3
+            assert len(data['synced_cas']) == 6
+            loc = data['all_locations']['fake_room_00000']
+            assert loc.active_livestream == 'primary'
+
+            # failover runs right away, not in the background
+            with patch('cadash.redunlive.failover._get_executor') as executor:
+                executor.return_value.submit.side_effect = \
+                    lambda f, *args: f(*args)
+                job = submit_failover(location_to_dict(loc), 'secondary')
+
+        assert job['state'] == 'done'
+        assert job['active_livestream'] == 'secondary'
+        assert farm.devices[1].get_publish_type('3', 0) == '6'
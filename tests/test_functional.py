@@ -4,11 +4,16 @@
 See: http://webtest.readthedocs.org/
 """
 import os
+import time
 
 import httpretty
 from flask import url_for
 from mock import patch
 
+from cadash.redunlive.snapshot import publish_snapshot
+
+from tests.test_redunlive_snapshot import make_location
+
 data_filename = os.path.join(
         os.path.abspath(os.path.dirname(__file__)), 'ca_loc_shortmap.json')
 
@@ -19,6 +24,17 @@ def get_json_data():
     return raw_data
 
 
+def wait_for_failover(testapp, job_id, timeout=10):
+    """poll failover status until job is finished; return last status."""
+    give_up = time.time() + timeout
+    while time.time() < give_up:
+        status = testapp.get('/redunlive/failover/%s' % job_id).json
+        if status['state'] in ('done', 'failed'):
+            return status
+        time.sleep(0.1)
+    raise AssertionError('failover job(%s) did not finish' % job_id)
+
+
 @patch('cadash.ldap.LdapClient.is_authenticated', return_value=True)
 @patch('cadash.ldap.LdapClient.fetch_groups', return_value=['can_bow','can_rollover'])
 class TestLoggingIn(object):
@@ -72,13 +88,24 @@ class TestRedunlive(object):
         httpretty.enable()
         self.register_uri_for_http()
 
+        # no snapshot yet: locations listed from ca_stats, devices not polled
         res = testapp_login_disabled.get('/redunlive/')
+        assert 'data-loc-id="fake_room"' in res
+        assert 'fake_epiphan017' not in res
+        assert not httpretty.last_request().path.startswith('/admin')
 
+        # each location loads separately
+        res = testapp_login_disabled.get('/redunlive/locations/fake_room')
         assert 'fake_epiphan017' in res
         assert 'fake_epiphan033' in res
+        radio = res.forms['fake_room']['active_device']
+        assert radio.value == 'secondary'
 
+        # fresh snapshot: all locations in the page
+        res = testapp_login_disabled.get('/redunlive/')
         radio = res.forms['fake_room']['active_device']
         assert radio.value == 'secondary'
+        testapp_login_disabled.get('/redunlive/locations/nowhere', status=404)
 
         httpretty.disable()
         httpretty.reset()
@@ -89,13 +116,19 @@ class TestRedunlive(object):
         httpretty.enable()
         self.register_uri_for_http()
 
+        testapp_login_disabled.get('/redunlive/locations/fake_room')
         res = testapp_login_disabled.get('/redunlive/')
         form = res.forms['fake_room']
         form['active_device'] = 'primary'
 
         # toggle active_device from secondary to primary
         res = form.submit()
+        assert res.status_code == 302
+        job_id = res.location.split('job=')[1]
+        wait_for_failover(testapp_login_disabled, job_id)
 
+        res = res.follow()
+        assert 'done' in res
         radio = res.forms['fake_room']['active_device']
         assert radio.value == 'primary'
 
@@ -103,6 +136,45 @@ class TestRedunlive(object):
         httpretty.reset()
 
 
+    def test_toggle_to_unknown_device(self, testapp_login_disabled):
+        """toggle to other than primary/secondary is refused, no job queued."""
+        httpretty.enable()
+        self.register_uri_for_http()
+
+        testapp_login_disabled.get('/redunlive/locations/fake_room')
+        with patch('cadash.redunlive.views.submit_failover') as submit:
+            testapp_login_disabled.post(
+                    '/redunlive/',
+                    {'loc_id': 'fake_room', 'active_device': 'experimental'},
+                    status=400)
+            res = testapp_login_disabled.post(
+                    '/redunlive/', {'loc_id': 'fake_room'},
+                    headers={'Accept': 'application/json'}, status=400)
+            assert 'error' in res.json
+            assert not submit.called
+
+        httpretty.disable()
+        httpretty.reset()
+
+
+    def test_stale_snapshot_listed_when_ca_stats_down(
+            self, app_login_disabled, testapp_login_disabled):
+        """page lists locations from a stale snapshot when ca_stats is down."""
+        with app_login_disabled.test_request_context():
+            publish_snapshot({'room1': make_location('room1')})
+        app_login_disabled.config['REDUNLIVE_SNAPSHOT_MAX_AGE'] = -1
+        httpretty.enable()
+        httpretty.register_uri(
+                httpretty.GET, 'http://ca_stats_fake_url.com', status=503)
+
+        res = testapp_login_disabled.get('/redunlive/')
+        assert 'data-loc-id="room1"' in res
+        assert 'data-pending="true"' in res
+
+        httpretty.disable()
+        httpretty.reset()
+
+
     def register_uri_for_http(self):
         """register uri's for a normal request of redunlive homepage."""
         # pull info on all locations and cas via ca_stats
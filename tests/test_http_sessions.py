@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Tests for `http_sessions` module and pooled epipearl client."""
+import httpretty
+from mock import patch
+
+from cadash.http_sessions import SessionPool
+from cadash.redunlive.client import PooledEpipearl
+from cadash.redunlive.client import get_epipearl_client
+
+epiphan_url = 'http://fake.example.edu'
+
+
+class TestSessionPool(object):
+
+    def test_one_session_per_host(self):
+        pool = SessionPool()
+        s1 = pool.session('http://fake1.example.edu/admin/channel1/get_params.cgi')
+        s2 = pool.session('http://fake1.example.edu/admin/channel2/set_params.cgi')
+        s3 = pool.session('http://fake2.example.edu/admin/channel1/get_params.cgi')
+        s4 = pool.session('https://fake1.example.edu/admin/channel1/get_params.cgi')
+
+        assert s1 is s2
+        assert s1 is not s3
+        assert s1 is not s4
+
+
+    def test_init_app(self, app):
+        app.config['HTTP_POOL_MAXSIZE'] = 3
+        app.config['HTTP_CONNECT_TIMEOUT'] = 1
+        app.config['HTTP_READ_TIMEOUT'] = 2
+        app.config['HTTP_RETRIES'] = 4
+
+        pool = SessionPool()
+        old = pool.session(epiphan_url)
+        pool.init_app(app)
+
+        assert pool.timeout == (1, 2)
+        session = pool.session(epiphan_url)
+        assert session is not old
+        adapter = session.get_adapter(epiphan_url)
+        assert adapter._pool_maxsize == 3
+        assert adapter.max_retries.connect == 4
+        assert adapter.max_retries.read == 0
+
+
+class TestPooledEpipearl(object):
+
+    @httpretty.activate
+    def test_get_params_through_pool(self):
+        httpretty.register_uri(
+                httpretty.GET, '%s/admin/channel1/get_params.cgi' % epiphan_url,
+                body='publish_type = 6')
+        pool = SessionPool(connect_timeout=1, read_timeout=2)
+        client = PooledEpipearl(epiphan_url, 'user', 'passwd', session_pool=pool)
+
+        with patch.object(pool, 'session', wraps=pool.session) as session:
+            response = client.get_params(channel='1', params={'publish_type': ''})
+            response = client.get_params(channel='1', params={'publish_type': ''})
+
+        assert response == {'publish_type': '6'}
+        assert session.call_count == 2
+        assert httpretty.last_request().headers['Authorization'].startswith('Basic ')
+
+
+    @httpretty.activate
+    def test_set_params_through_pool(self):
+        httpretty.register_uri(
+                httpretty.GET, '%s/admin/channel1/set_params.cgi' % epiphan_url,
+                body='', status=201)
+        client = PooledEpipearl(epiphan_url, 'user', 'passwd', session_pool=SessionPool())
+
+        client.set_params(channel='1', params={'publish_type': '0'})
+        assert httpretty.last_request().querystring == {'publish_type': ['0']}
+
+
+    def test_clients_reused(self):
+        c1 = get_epipearl_client('fake1.example.edu', 'user', 'passwd')
+        c2 = get_epipearl_client('fake1.example.edu', 'user', 'passwd')
+        c3 = get_epipearl_client('fake2.example.edu', 'user', 'passwd')
+
+        assert c1 is c2
+        assert c1 is not c3
+        assert c1.url == 'http://fake1.example.edu'
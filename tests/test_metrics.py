@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Tests for `metrics` module."""
+import json
+import socket
+
+import httpretty
+from epipearl import Epipearl
+from mock import MagicMock
+import pytest
+from requests.exceptions import ConnectionError
+from requests.exceptions import ReadTimeout
+
+from cadash.metrics import MetricsRegistry
+from cadash.metrics import RedisMetricsStore
+from cadash.metrics import outcome
+from cadash.metrics import registry
+from cadash.metrics import render_metrics
+from cadash.redunlive.data_masseuse import load_ca_stats_entries
+from cadash.redunlive.data_masseuse import sync_cas
+from cadash.redunlive.errors import CaStatsUnavailableError
+from cadash.redunlive.models import CaptureAgent
+
+epiphan_url = 'http://fake.example.edu'
+
+
+class TestMetricsRegistry(object):
+
+    def test_counter(self):
+        r = MetricsRegistry()
+        r.inc('cadash_fleet_poll_missed_total', 2)
+        r.inc('cadash_fleet_poll_missed_total')
+        r.flush(None)
+
+        assert r.collect(None) == {('cadash_fleet_poll_missed_total', ()): 3}
+        assert r.pending() == {}
+
+
+    def test_histogram(self):
+        r = MetricsRegistry()
+        r.observe('cadash_ca_stats_fetch_seconds', 0.7, outcome='ok')
+        r.observe('cadash_ca_stats_fetch_seconds', 3, outcome='ok')
+        samples = r.collect(None)
+
+        labels = (('outcome', 'ok'),)
+        assert samples[('cadash_ca_stats_fetch_seconds_count', labels)] == 2
+        assert samples[('cadash_ca_stats_fetch_seconds_sum', labels)] == 3.7
+        assert samples[('cadash_ca_stats_fetch_seconds_bucket',
+                        (('le', '0.5'), ('outcome', 'ok')))] == 0
+        assert samples[('cadash_ca_stats_fetch_seconds_bucket',
+                        (('le', '1'), ('outcome', 'ok')))] == 1
+        assert samples[('cadash_ca_stats_fetch_seconds_bucket',
+                        (('le', '+Inf'), ('outcome', 'ok')))] == 2
+
+
+    def test_flush_due(self):
+        r = MetricsRegistry(flush_interval=3600)
+        r.inc('cadash_fleet_poll_missed_total')
+        r.flush_due(None)
+        assert len(r.pending()) == 1
+
+        r.flush_interval = 0
+        r.flush_due(None)
+        assert r.pending() == {}
+
+
+    def test_redis_store(self):
+        client = MagicMock()
+        store = RedisMetricsStore(client, 'metrics')
+        key = ('cadash_device_calls_total', (('call', 'get_params'), ('device', 'pearl1')))
+        store.add({key: 2})
+
+        field = json.dumps([key[0], key[1]])
+        pipe = client.pipeline.return_value
+        pipe.hincrbyfloat.assert_called_once_with('metrics', field, 2)
+        assert pipe.execute.called
+
+        client.hgetall.return_value = {field: '5'}
+        assert store.totals() == {key: 5.0}
+
+
+    def test_failed_flush_kept(self):
+        r = MetricsRegistry()
+        r.inc('cadash_fleet_poll_missed_total')
+        store = MagicMock()
+        store.add.side_effect = ConnectionError('redis down')
+        r.store = lambda backend: store
+        r.flush(None)
+
+        assert r.pending() == {('cadash_fleet_poll_missed_total', ()): 1}
+
+
+    def test_outcome(self):
+        assert outcome() == 'ok'
+        assert outcome(ReadTimeout()) == 'timeout'
+        assert outcome(socket.timeout()) == 'timeout'
+        assert outcome(ConnectionError()) == 'error'
+
+
+def test_render_metrics():
+    r = MetricsRegistry()
+    r.observe('cadash_device_call_seconds', 0.2, device='pearl"1',
+              channel='live', call='get_params')
+    r.inc('cadash_device_calls_total', device='pearl"1', channel='live',
+          call='get_params', outcome='ok')
+    lines = render_metrics(r.collect(None)).splitlines()
+
+    assert '# TYPE cadash_device_calls_total counter' in lines
+    assert 'cadash_device_calls_total{call="get_params",channel="live",' \
+        'device="pearl\\"1",outcome="ok"} 1' in lines
+    assert '# TYPE cadash_device_call_seconds histogram' in lines
+    labels = 'call="get_params",channel="live",device="pearl\\"1"'
+    i = lines.index('cadash_device_call_seconds_bucket{%s,le="0.025"} 0' % labels)
+    assert lines[i + 4] == 'cadash_device_call_seconds_bucket{%s,le="0.5"} 1' % labels
+    assert lines[i + 9] == 'cadash_device_call_seconds_bucket{%s,le="+Inf"} 1' % labels
+    assert lines[i + 10] == 'cadash_device_call_seconds_sum{%s} 0.2' % labels
+    assert lines[i + 11] == 'cadash_device_call_seconds_count{%s} 1' % labels
+
+
+class TestDeviceMetrics(object):
+
+    def setup(self):
+        p = CaptureAgent('ABCD1111', 'fake1.example.edu')
+        p.channels['live']['channel'] = '1'
+        p.channels['live']['publish_type'] = '0'
+        p.channels['lowBR']['channel'] = '2'
+        p.channels['lowBR']['publish_type'] = '0'
+        p.client = Epipearl(epiphan_url, 'user', 'passwd')
+        p.metrics = MetricsRegistry()
+        self.ca = p
+
+
+    @httpretty.activate
+    def test_calls_by_outcome(self):
+        httpretty.register_uri(
+                httpretty.GET, '%s/admin/channel1/get_params.cgi' % epiphan_url,
+                body='publish_type = 6')
+        httpretty.register_uri(
+                httpretty.GET, '%s/admin/channel2/get_params.cgi' % epiphan_url,
+                status=500)
+
+        self.ca.sync_live_status()
+        samples = self.ca.metrics.pending()
+
+        def calls(channel, result):
+            return samples.get(('cadash_device_calls_total', (
+                ('call', 'get_params'), ('channel', channel),
+                ('device', 'fake1'), ('outcome', result))))
+
+        assert calls('live', 'ok') == 1
+        assert calls('lowBR', 'error') == 1
+        assert samples[('cadash_device_call_seconds_count', (
+            ('call', 'get_params'), ('channel', 'live'), ('device', 'fake1')))] == 1
+
+
+class TestMetricsView(object):
+
+    def test_metrics(self, testapp):
+        registry.inc('cadash_fleet_poll_missed_total', 4)
+        res = testapp.get('/metrics')
+
+        assert res.content_type == 'text/plain'
+        assert 'cadash_fleet_poll_missed_total 4' in res.text.splitlines()
+
+
+    def test_token(self, app, testapp):
+        app.config['METRICS_TOKEN'] = 's3cret'
+        testapp.get('/metrics', status=401)
+        testapp.get('/metrics', headers={'Authorization': 'Bearer nope'}, status=401)
+        testapp.get('/metrics', headers={'Authorization': 'Bearer s3cret'}, status=200)
+
+
+    def test_fleet_poll_and_ca_stats(self, app):
+        sync_cas([])
+        assert registry.pending() == {}
+
+        app.config['CA_STATS_JSON_URL'] = 'http://127.0.0.1:1/ca_stats.json'
+        with pytest.raises(CaStatsUnavailableError):
+            load_ca_stats_entries()
+        assert registry.pending()[('cadash_ca_stats_fetch_seconds_count', (
+            ('outcome', 'unavailable'),))] == 1
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Tests for `aio` transport in redunlive webapp; python 3.5+ only."""
+import asyncio
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+import socket
+import threading
+import time
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+from mock import patch
+import pytest
+from werkzeug.contrib.cache import SimpleCache
+
+from cadash.redunlive import aio
+from cadash.redunlive.breaker import CircuitBreaker
+from cadash.redunlive.data_masseuse import sync_cas
+from cadash.redunlive.errors import DeviceRequestError
+from cadash.redunlive.history import HistoryRecorder
+from cadash.redunlive.models import CaptureAgent
+
+
+class FakePearlHandler(BaseHTTPRequestHandler):
+    """epiphan-pearl admin api, publish_type per channel in server.state."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        u = urlparse(self.path)
+        parts = u.path.strip('/').split('/')
+        if len(parts) != 3 or not parts[1].startswith('channel'):
+            return self.respond(404, '')
+        channel = parts[1][len('channel'):]
+        time.sleep(self.server.delay.get(channel, 0))
+
+        if parts[2] == 'get_params.cgi':
+            body = 'publish_type = %s\n' % self.server.state.get(channel, '0')
+            return self.respond(200, body)
+        if parts[2] == 'set_params.cgi':
+            self.server.state[channel] = parse_qs(u.query)['publish_type'][0]
+            return self.respond(201, '')
+        return self.respond(404, '')
+
+    def respond(self, status, body):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakePearl(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakePearlHandler)
+        self.state = {}
+        self.delay = {}
+        self.paths = []
+        self.connections = 0
+
+    @property
+    def address(self):
+        return '127.0.0.1:%s' % self.server_address[1]
+
+
+def make_ca(serial, address):
+    ca = CaptureAgent(serial, address)
+    ca.channels['live']['channel'] = '1'
+    ca.channels['lowBR']['channel'] = '2'
+    return ca
+
+
+def run(*coros):
+    """run coroutines one after the other in a new loop; return results."""
+    loop = asyncio.new_event_loop()
+    try:
+        return [loop.run_until_complete(c) for c in coros]
+    finally:
+        loop.close()
+
+
+class TestAsyncEpipearl(object):
+
+    def setup_method(self, method):
+        self.pearl = FakePearl()
+        self.thread = threading.Thread(target=self.pearl.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def teardown_method(self, method):
+        self.pearl.shutdown()
+        self.pearl.server_close()
+
+
+    def test_get_and_set_params(self):
+        client = aio.AsyncEpipearl(
+                'http://%s' % self.pearl.address, 'user', 'passwd', proxy='')
+
+        results = run(
+                client.get_params('1', {'publish_type': ''}),
+                client.set_params('1', {'publish_type': '6'}),
+                client.get_params('1', {'publish_type': ''}),
+                client.close())
+        assert results[:3] == [
+                {'publish_type': '0'}, True, {'publish_type': '6'}]
+        # one keep-alive connection for all requests
+        assert self.pearl.connections == 1
+
+
+    def test_error_status(self):
+        client = aio.AsyncEpipearl(
+                'http://%s' % self.pearl.address, 'user', 'passwd', proxy='')
+        with pytest.raises(DeviceRequestError):
+            run(client.get('admin/nowhere'))
+
+
+    def test_proxy(self):
+        client = aio.AsyncEpipearl(
+                'http://fake-epiphan001.example.edu', 'user', 'passwd',
+                proxy='http://%s' % self.pearl.address)
+        assert run(client.get_params('1')) == [{'publish_type': '0'}]
+        assert self.pearl.paths[-1].startswith(
+                'http://fake-epiphan001.example.edu/admin/channel1/')
+
+
+    def test_sync_all(self):
+        self.pearl.state = {'1': '6', '2': '0'}
+        cas = [make_ca('SERIAL%04d' % i, self.pearl.address) for i in range(50)]
+
+        missed = aio.sync_all(
+                cas, 'user', 'passwd', max_concurrency=20, proxy='')
+
+        assert missed == []
+        for ca in cas:
+            assert ca.channels['live']['publish_type'] == '6'
+            assert ca.channels['lowBR']['publish_type'] == '6'
+
+
+    def test_sync_all_deadline(self):
+        self.pearl.delay = {'1': 1}
+        ca = make_ca('SERIAL0001', self.pearl.address)
+        ca.channels['live']['publish_type'] = '6'
+
+        start = time.time()
+        missed = aio.sync_all([ca], 'user', 'passwd', deadline=0.2, proxy='')
+
+        assert time.time() - start < 1
+        assert missed == [ca]
+        assert ca.channels['live']['publish_type'] == 'not available'
+
+
+    def test_sync_all_records_breaker_and_history(self):
+        self.pearl.state = {'1': '6', '2': '6'}
+        backend = SimpleCache()
+        ca = make_ca('SERIAL0001', self.pearl.address)
+        ca.breaker = CircuitBreaker(backend, threshold=1)
+        ca.history = HistoryRecorder(backend)
+        ca.breaker.record_failure('SERIAL0001')
+        backend.set('redunlive:breaker:SERIAL0001:retry_at', 0)
+
+        assert aio.sync_all([ca], 'user', 'passwd', proxy='') == []
+        # probe succeeded: breaker closed, first state seen recorded
+        assert ca.breaker.state('SERIAL0001') is None
+        assert sorted(e['channel'] for e in ca.history.get('SERIAL0001').entries()) == [
+                'live', 'lowBR']
+
+
+class TestConnectRetries(object):
+
+    def test_connect_retried(self):
+        # nothing listens on a port just released
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+        s.close()
+
+        client = aio.AsyncEpipearl(
+                'http://127.0.0.1:%s' % port, 'user', 'passwd', proxy='',
+                retries=2, retry_backoff=0.1)
+        start = time.time()
+        with pytest.raises(OSError):
+            run(client.get_params('1'))
+        # waited 0.1 then 0.2 secs before the two retries
+        assert time.time() - start >= 0.3
+
+
+class TestSyncCas(object):
+
+    def test_async_polling(self, app):
+        app.config['REDUNLIVE_ASYNC_POLLING'] = True
+        ca = make_ca('SERIAL0001', 'fake0001.example.edu')
+        with patch('cadash.redunlive.aio.sync_all', return_value=[]) as s:
+            assert sync_cas([ca]) == []
+        assert s.call_args[0][0] == [ca]
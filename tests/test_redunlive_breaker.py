@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Tests for `breaker` in redunlive webapp."""
+from mock import MagicMock
+from mock import patch
+import pytest
+from werkzeug.contrib.cache import RedisCache
+
+from cadash.extensions import cache
+from cadash.redunlive.breaker import CircuitBreaker
+from cadash.redunlive.models import CaptureAgent
+
+
+class FailingClient(object):
+    """fake epipearl client for an unreachable device."""
+
+    def __init__(self):
+        self.calls = 0
+        self.fail = True
+
+    def get_params(self, channel, params={}):
+        self.calls += 1
+        if self.fail:
+            raise IOError('connection refused')
+        return {'publish_type': '6'}
+
+    def set_params(self, channel, params):
+        self.calls += 1
+        if self.fail:
+            raise IOError('connection refused')
+        return True
+
+
+def make_ca(client, breaker):
+    ca = CaptureAgent('SERIAL0001', 'fake0001.example.edu')
+    ca.channels['live']['channel'] = '1'
+    ca.channels['lowBR']['channel'] = '2'
+    ca.client = client
+    ca.breaker = breaker
+    return ca
+
+
+@pytest.mark.usefixtures('app')
+class TestCircuitBreaker(object):
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(cache.cache, threshold=3, backoff=10)
+        breaker.record_failure('dev1')
+        breaker.record_failure('dev1')
+        assert breaker.allow('dev1')
+        breaker.record_failure('dev1')
+        assert breaker.is_open('dev1')
+        assert not breaker.allow('dev1')
+        assert breaker.allow('dev2')
+
+
+    def test_single_probe_when_due(self):
+        breaker = CircuitBreaker(cache.cache, threshold=1, backoff=10)
+        with patch('cadash.redunlive.breaker.time.time', return_value=1000):
+            breaker.record_failure('dev1')
+        with patch('cadash.redunlive.breaker.time.time', return_value=1011):
+            assert breaker.allow('dev1')
+            assert not breaker.allow('dev1')
+
+
+    def test_backoff_grows_up_to_max(self):
+        breaker = CircuitBreaker(cache.cache, threshold=2, backoff=10, max_backoff=60)
+        assert breaker._next_backoff(2) == 10
+        assert breaker._next_backoff(3) == 20
+        assert breaker._next_backoff(4) == 40
+        assert breaker._next_backoff(5) == 60
+        assert breaker._next_backoff(100) == 60
+
+
+    def test_success_closes(self):
+        breaker = CircuitBreaker(cache.cache, threshold=1)
+        breaker.record_failure('dev1')
+        assert breaker.is_open('dev1')
+        breaker.record_success('dev1')
+        assert not breaker.is_open('dev1')
+        assert breaker.state('dev1') is None
+
+
+    def test_success_resets_failures_counted_elsewhere(self):
+        # two workers calling the same device
+        first = CircuitBreaker(cache.cache, threshold=3)
+        second = CircuitBreaker(cache.cache, threshold=3)
+        assert second.allow('dev1')
+        second.record_success('dev1')
+        for i in range(3):
+            first.record_failure('dev1')
+            second.record_success('dev1')
+        assert not first.is_open('dev1')
+        assert second.state('dev1') is None
+
+
+    def test_failures_counted_atomically_in_redis(self):
+        client = MagicMock()
+        client.pipeline.return_value.execute.return_value = [3, True]
+        backend = RedisCache(host=client, key_prefix='cadash:')
+        breaker = CircuitBreaker(backend, threshold=3, backoff=10, max_backoff=60)
+
+        breaker.record_failure('dev1')
+
+        pipe = client.pipeline.return_value
+        pipe.incr.assert_called_once_with('cadash:redunlive:breaker:dev1')
+        pipe.expire.assert_called_once_with('cadash:redunlive:breaker:dev1', 600)
+        # open: next probe time is set
+        assert client.setex.called
+
+
+@pytest.mark.usefixtures('app')
+class TestCaptureAgentBreaker(object):
+
+    def test_unreachable_ca_not_polled(self):
+        client = FailingClient()
+        # each poll is 2 requests, for live and lowBR channels
+        ca = make_ca(client, CircuitBreaker(cache.cache, threshold=4, backoff=10))
+
+        ca.sync_live_status()
+        ca.sync_live_status()
+        assert client.calls == 4
+        assert ca.channels['live']['publish_type'] == 'not available'
+
+        # breaker is open; device is skipped
+        ca.sync_live_status()
+        assert client.calls == 4
+        assert ca.channels['live']['publish_type'] == 'not available'
+
+
+    def test_recovered_ca_closes_breaker(self):
+        client = FailingClient()
+        breaker = CircuitBreaker(cache.cache, threshold=1, backoff=10)
+        ca = make_ca(client, breaker)
+        with patch('cadash.redunlive.breaker.time.time', return_value=1000):
+            ca.sync_live_status()
+        assert breaker.is_open(ca.serial_number)
+
+        # 2 failed requests, next probe in 20s
+        client.fail = False
+        with patch('cadash.redunlive.breaker.time.time', return_value=1021):
+            ca.sync_live_status()
+        assert not breaker.is_open(ca.serial_number)
+        assert ca.channels['live']['publish_type'] == '6'
+
+
+    def test_write_bypasses_open_breaker(self):
+        client = FailingClient()
+        breaker = CircuitBreaker(cache.cache, threshold=1, backoff=10)
+        ca = make_ca(client, breaker)
+        ca.sync_live_status()
+        assert breaker.is_open(ca.serial_number)
+
+        client.fail = False
+        ca.write_live_status('0')
+        assert not breaker.is_open(ca.serial_number)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Tests for `ca_stats` in redunlive webapp."""
+import json
+import os
+
+import pytest
+
+from cadash.redunlive.ca_stats import iter_json_array
+from cadash.redunlive.ca_stats import read_ca_stats
+from cadash.redunlive.errors import CaStatsFormatError
+
+data_filename = os.path.join(
+        os.path.abspath(os.path.dirname(__file__)), 'ca_loc_shortmap.json')
+
+
+def chunked(text, size):
+    return (text[i:i + size] for i in range(0, len(text), size))
+
+
+def ca_item(location, role, serial_number, address='fake.example.edu'):
+    return {'location': location, 'role': role, 'address': address,
+            'ca_attributes': {'serial_number': serial_number, 'channels': {}}}
+
+
+class TestIterJsonArray(object):
+
+    def setup(self):
+        with open(data_filename, 'r') as f:
+            self.text = f.read()
+
+
+    @pytest.mark.parametrize('size', [1, 7, 4096, 1000000])
+    def test_items_as_json_loads(self, size):
+        items = list(iter_json_array(chunked(self.text, size)))
+        assert items == json.loads(self.text)
+
+
+    def test_values_across_chunks(self):
+        text = u'[12345, "ab\\"c", {"a": [1, 2]}, true, null, -1.5e3]'
+        assert list(iter_json_array(chunked(text, 2))) == \
+            [12345, u'ab"c', {u'a': [1, 2]}, True, None, -1500.0]
+        assert list(iter_json_array([u'[12', u'34]'])) == [1234]
+
+
+    def test_empty(self):
+        assert list(iter_json_array([u' [ ', u' ] \n'])) == []
+
+
+    @pytest.mark.parametrize('text', [
+        u'{"a": 1}', u'[1, 2', u'[1 2]', u'[{"a": }]', u'[1] [2]', u''])
+    def test_invalid(self, text):
+        with pytest.raises(CaStatsFormatError):
+            list(iter_json_array(chunked(text, 3)))
+
+
+    def test_invalid_fails_fast(self):
+        def chunks():
+            yield u'[{"a": 1}, {"b": '
+            for i in range(10):
+                yield u'x' * 10
+            raise AssertionError('read more than needed')
+
+        with pytest.raises(CaStatsFormatError):
+            list(iter_json_array(chunks(), max_item=50))
+
+
+    def test_items_yielded_as_parsed(self):
+        def chunks():
+            yield u'[{"a": 1}, '
+            raise AssertionError('read more than needed')
+
+        assert next(iter_json_array(chunks())) == {u'a': 1}
+
+
+class TestReadCaStats(object):
+
+    def test_invalid_items_reported(self):
+        items = [
+                ca_item('Room 1', 'Primary', 'S1'),
+                {'location': 'Room 1', 'role': 'Secondary',
+                 'ca_attributes': {'serial_number': 'S2'}},
+                ca_item('Room 2', 'Primary', None),
+                'not a ca',
+                ca_item('Room 1', 'Secondary', 'S3'),
+                ]
+
+        entries = read_ca_stats(iter(items))
+
+        assert sorted(entries.location_entries.keys()) == ['room_1', 'room_2']
+        assert [s for (s, fp) in entries.location_entries['room_1']] == ['S1', 'S3']
+        assert entries.location_entries['room_2'] == []
+        assert [(e['index'], e['error']) for e in entries.errors] == [
+                (1, 'missing "address"'),
+                (2, 'missing "serial_number"'),
+                (3, 'not a json object')]
+        assert entries.errors[1]['location'] == 'Room 2'
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Tests for `codec` in redunlive webapp."""
+from mock import patch
+import pytest
+
+from cadash.extensions import cache
+from cadash.redunlive import snapshot as snapshot_module
+from cadash.redunlive.codec import decode_location
+from cadash.redunlive.codec import decode_snapshot
+from cadash.redunlive.codec import encode_snapshot
+from cadash.redunlive.codec import read_header
+from cadash.redunlive.codec import replace_locations
+from cadash.redunlive.errors import SnapshotFormatError
+from cadash.redunlive.models import CaptureAgent
+from cadash.redunlive.snapshot import load_location
+from cadash.redunlive.snapshot import load_snapshot
+from cadash.redunlive.snapshot import location_to_dict
+from cadash.redunlive.snapshot import publish_snapshot
+
+from tests.test_redunlive_snapshot import make_location
+
+
+def location_dicts(*names):
+    locs = [make_location(n) for n in names]
+    locs[0].experimental_cas.append(
+            CaptureAgent('EXP1', 'room-exp.example.edu'))
+    return dict((l.id, location_to_dict(l)) for l in locs)
+
+
+class TestCodec(object):
+
+    def test_roundtrip(self):
+        dicts = location_dicts('room2', u'sala-ñ', 'room1')
+        snapshot = {'version': 7, 'created': 1000.5, 'locations': dicts,
+                    'changed': {'room2': 7, 'sala_': 3, 'room1': 5},
+                    'removed': {u'old-ñ': 4}, 'deltas_since': 2}
+        data = encode_snapshot(snapshot)
+
+        assert read_header(data) == (7, 1000.5, 3)
+        assert decode_snapshot(data) == snapshot
+
+
+    def test_decode_location(self):
+        dicts = location_dicts(*['room%02d' % i for i in range(25)])
+        data = encode_snapshot({'version': 1, 'created': 1000, 'locations': dicts})
+
+        for loc_id in dicts:
+            assert decode_location(data, loc_id) == dicts[loc_id]
+        assert decode_location(data, 'room99') is None
+        empty = encode_snapshot({'version': 1, 'created': 1000, 'locations': {}})
+        assert decode_location(empty, 'room01') is None
+
+
+    def test_replace_locations(self):
+        dicts = location_dicts('room1', 'room2', 'room3')
+        data = encode_snapshot({'version': 1, 'created': 1000, 'locations': dicts,
+                                'removed': {'room0': 1}})
+
+        polled = location_to_dict(make_location('room3'))
+        polled['primary_ca']['last_update'] += 60
+        changed = location_to_dict(
+                make_location('room2', primary_pt='0', secondary_pt='6'))
+        added = location_to_dict(make_location('room0'))
+        data = replace_locations(
+                data, 2, 2000, {'room2': changed, 'room0': added, 'room3': polled})
+
+        snapshot = decode_snapshot(data)
+        assert snapshot['version'] == 2
+        assert sorted(snapshot['locations'].keys()) == [
+                'room0', 'room1', 'room2', 'room3']
+        assert snapshot['locations']['room2'] == changed
+        assert snapshot['locations']['room3'] == polled
+        assert snapshot['locations']['room1'] == dicts['room1']
+        assert decode_location(data, 'room0') == added
+        # only last_update of room3 differs
+        assert snapshot['changed'] == {
+                'room0': 2, 'room1': 1, 'room2': 2, 'room3': 1}
+        assert snapshot['removed'] == {}
+
+
+    def test_unknown_format(self):
+        with pytest.raises(SnapshotFormatError):
+            read_header({'version': 1})
+        data = encode_snapshot({'version': 1, 'created': 1000, 'locations': {}})
+        with pytest.raises(SnapshotFormatError):
+            read_header(data[:4] + b'\x09' + data[5:])
+
+
+@pytest.mark.usefixtures('app')
+class TestSnapshotStorage(object):
+
+    def test_partial_read(self):
+        publish_snapshot({'room1': make_location('room1'),
+                          'room2': make_location('room2')})
+        snapshot_module._memo().clear()
+
+        assert load_location('room2')['primary_ca']['serial_number'] == 'room2P'
+        assert load_location('room3') is None
+        assert 'snapshot' not in snapshot_module._memo()
+
+
+    def test_decoded_once_per_version(self):
+        publish_snapshot({'room1': make_location('room1')})
+        snapshot_module._memo().clear()
+
+        first = load_snapshot()
+        assert load_snapshot() is first
+
+        # published by another worker: snapshot, then its version
+        cache.set(snapshot_module.SNAPSHOT_KEY, encode_snapshot({
+            'version': first['version'] + 1, 'created': 2000,
+            'locations': location_dicts('room2')}), timeout=0)
+        cache.cache.set(
+                snapshot_module.SNAPSHOT_PUBLISHED_KEY, first['version'] + 1,
+                timeout=0)
+        second = load_snapshot()
+        assert list(second['locations'].keys()) == ['room2']
+        assert load_snapshot() is second
+
+
+    def test_memo_kept_when_counter_ahead(self):
+        first = publish_snapshot({'room1': make_location('room1')})
+
+        # version taken by a worker that died before writing its snapshot
+        snapshot_module._next_version()
+        with patch('cadash.redunlive.snapshot.decode_snapshot') as decode:
+            assert load_snapshot() is first
+            assert load_location('room1') is first['locations']['room1']
+        assert not decode.called
+
+        second = publish_snapshot({'room2': make_location('room2')})
+        assert second['version'] == first['version'] + 2
+        assert load_snapshot() is second
+
+
+    def test_old_format_ignored(self):
+        cache.set(snapshot_module.SNAPSHOT_KEY,
+                  {'version': 1, 'created': 1000, 'locations': {}}, timeout=0)
+        assert load_snapshot() is None
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Tests for `events` in redunlive webapp."""
+import json
+import threading
+
+from mock import MagicMock
+from mock import patch
+import pytest
+
+from cadash.redunlive.events import LocalEventBus
+from cadash.redunlive.events import RedisEventBus
+from cadash.redunlive.events import format_event
+from cadash.redunlive.events import get_event_bus
+from cadash.redunlive.snapshot import publish_snapshot
+from cadash.redunlive.snapshot import update_snapshot_location
+
+from tests.test_redunlive_snapshot import make_location
+
+
+def parse_events(body):
+    """list of (event, id, data) in server-sent events text `body`."""
+    events = []
+    for block in body.split('\n\n'):
+        fields = dict(
+                line.split(': ', 1) for line in block.split('\n')
+                if line and not line.startswith(':') and ': ' in line)
+        if 'event' in fields:
+            events.append((fields['event'], fields.get('id'),
+                           json.loads(fields['data'])))
+    return events
+
+
+class TestEventBus(object):
+
+    def test_local_fan_out(self):
+        bus = LocalEventBus()
+        (s1, s2) = (bus.subscribe(), bus.subscribe())
+        bus.publish({'event': 'location', 'id': 1, 'data': {}})
+        s2.close()
+        bus.publish({'event': 'location', 'id': 2, 'data': {}})
+
+        assert [s1.get(0.1)['id'], s1.get(0.1)['id']] == [1, 2]
+        assert s1.get(0.01) is None
+        assert s2.get(0.01)['id'] == 1
+        assert s2.get(0.01) is None
+
+
+    def test_local_slow_subscription_lost(self):
+        bus = LocalEventBus()
+        with patch('cadash.redunlive.events.SUBSCRIPTION_QUEUE_SIZE', 2):
+            s = bus.subscribe()
+        for i in range(3):
+            bus.publish({'event': 'location', 'id': i, 'data': {}})
+
+        assert s.lost
+        assert bus._subscriptions == set()
+
+
+    def test_redis(self):
+        client = MagicMock()
+        bus = RedisEventBus(client, 'events')
+        event = {'event': 'location', 'id': 3, 'data': {'id': 'room1'}}
+        bus.publish(event)
+        client.publish.assert_called_once_with('events', json.dumps(event))
+
+        pubsub = client.pubsub.return_value
+        pubsub.get_message.side_effect = [
+                None, {'type': 'message', 'data': json.dumps(event)}]
+        s = bus.subscribe()
+        pubsub.subscribe.assert_called_once_with('events')
+        assert s.get(1) == event
+        s.close()
+        assert pubsub.close.called
+
+
+    def test_format_event(self):
+        assert format_event({'event': 'removed', 'id': 4, 'data': {'id': 'r'}}) == \
+            'event: removed\nid: 4\ndata: {"id": "r"}\n\n'
+
+
+@pytest.mark.usefixtures('app')
+class TestAnnounce(object):
+
+    def test_changed_locations_published(self):
+        publish_snapshot({'room1': make_location('room1'),
+                          'room2': make_location('room2')})
+        s = get_event_bus().subscribe()
+
+        # nothing changed but last_update
+        publish_snapshot({'room1': make_location('room1'),
+                          'room2': make_location('room2')})
+        assert s.get(0.01) is None
+
+        snapshot = publish_snapshot({
+            'room2': make_location('room2', primary_pt='0', secondary_pt='6')})
+        event = s.get(0.1)
+        assert (event['event'], event['id']) == ('location', snapshot['version'])
+        assert event['data']['active_livestream'] == 'secondary'
+        assert s.get(0.1) == {
+                'event': 'removed', 'id': snapshot['version'],
+                'data': {'id': 'room1'}}
+
+        update_snapshot_location(make_location('room2'))
+        assert s.get(0.1)['data']['active_livestream'] == 'primary'
+
+
+class TestEventsView(object):
+
+    @pytest.fixture(autouse=True)
+    def short_streams(self, app_login_disabled):
+        app_login_disabled.config['REDUNLIVE_EVENTS_HEARTBEAT'] = 0.05
+        app_login_disabled.config['REDUNLIVE_EVENTS_MAX_AGE'] = 0.3
+        self.app = app_login_disabled
+
+
+    def test_live(self, testapp_login_disabled):
+        publish_snapshot({'room1': make_location('room1')})
+
+        def toggle():
+            with self.app.test_request_context():
+                update_snapshot_location(
+                        make_location('room1', primary_pt='0', secondary_pt='6'))
+
+        timer = threading.Timer(0.1, toggle)
+        timer.start()
+        res = testapp_login_disabled.get('/redunlive/events')
+        timer.join()
+
+        assert res.content_type == 'text/event-stream'
+        assert ': keepalive' in res.text
+        events = parse_events(res.text)
+        assert [(e, d['id'], d['active_livestream']) for (e, i, d) in events] == [
+                ('location', 'room1', 'secondary')]
+
+
+    def test_replay(self, testapp_login_disabled):
+        first = publish_snapshot({'room1': make_location('room1'),
+                                  'room2': make_location('room2')})
+        last = update_snapshot_location(make_location('room2', primary_pt='0'))
+
+        res = testapp_login_disabled.get(
+                '/redunlive/events', params={'since': first['version']})
+        assert [(e, i, d['id']) for (e, i, d) in parse_events(res.text)] == [
+                ('location', str(last['version']), 'room2')]
+
+        # reconnect: Last-Event-ID sent by the browser wins
+        res = testapp_login_disabled.get(
+                '/redunlive/events', params={'since': first['version']},
+                headers={'Last-Event-ID': str(last['version'])})
+        assert parse_events(res.text) == []
+
+
+    def test_replay_unknown(self, testapp_login_disabled):
+        snapshot = publish_snapshot({'room1': make_location('room1')})
+        res = testapp_login_disabled.get(
+                '/redunlive/events', params={'since': snapshot['version'] - 1})
+        assert [e for (e, i, d) in parse_events(res.text)] == ['reload']
+
+        testapp_login_disabled.get(
+                '/redunlive/events', params={'since': 'x'}, status=400)
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""Tests for `failover` in redunlive webapp."""
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from mock import patch
+import pytest
+
+from cadash.redunlive import failover
+from cadash.redunlive.errors import FailoverInProgressError
+from cadash.redunlive.failover import get_batch_report
+from cadash.redunlive.failover import get_job
+from cadash.redunlive.failover import get_location_job
+from cadash.redunlive.failover import run_failover
+from cadash.redunlive.failover import submit_bulk_failover
+from cadash.redunlive.failover import submit_failover
+from cadash.redunlive.snapshot import load_snapshot
+from cadash.redunlive.snapshot import location_to_dict
+from cadash.redunlive.snapshot import publish_snapshot
+
+from tests.test_redunlive_poller import ConcurrencyTracker
+from tests.test_redunlive_snapshot import make_location
+
+
+class FakeDevice(object):
+    """fake epipearl client that remembers publish_type per channel."""
+
+    def __init__(self, name, publish_type, log, tracker=None):
+        self.name = name
+        self.publish_type = {'1': publish_type, '2': publish_type,
+                             '3': publish_type, '4': publish_type}
+        self.log = log
+        self.tracker = tracker
+
+    def get_params(self, channel, params={}):
+        return {'publish_type': self.publish_type[channel]}
+
+    def set_params(self, channel, params):
+        if self.tracker is not None:
+            # time.sleep is patched in failover tests
+            self.tracker.enter()
+            threading.Event().wait(0.05)
+            self.tracker.leave()
+        self.log.append((self.name, channel, params['publish_type']))
+        self.publish_type[channel] = params['publish_type']
+        return True
+
+
+def fake_clients(locations, log, tracker=None):
+    """patch set_epipearl_client to set fake devices in `locations`."""
+    if not isinstance(locations, list):
+        locations = [locations]
+    devices = {}
+    for loc in locations:
+        devices[loc.primary_ca.serial_number] = FakeDevice(
+                'primary', loc.primary_ca.channels['live']['publish_type'],
+                log, tracker)
+        devices[loc.secondary_ca.serial_number] = FakeDevice(
+                'secondary', loc.secondary_ca.channels['live']['publish_type'],
+                log, tracker)
+
+    def set_client(ca):
+        ca.client = devices[ca.serial_number]
+    return patch('cadash.redunlive.failover.set_epipearl_client', side_effect=set_client)
+
+
+def new_job(loc_id, target):
+    return {'id': 'job1', 'loc_id': loc_id, 'target': target,
+            'state': failover.QUEUED, 'step': None, 'error': None,
+            'active_livestream': None}
+
+
+@pytest.mark.usefixtures('app')
+class TestFailover(object):
+
+    def test_failover_to_primary(self):
+        loc = make_location('room1', primary_pt='0', secondary_pt='6')
+        publish_snapshot({'room1': loc})
+        log = []
+
+        with fake_clients(loc, log), patch('cadash.redunlive.failover.time.sleep'):
+            job = run_failover(new_job('room1', 'primary'), location_to_dict(loc))
+
+        assert job['state'] == failover.DONE
+        assert job['active_livestream'] == 'primary'
+        assert [(d, c) for (d, c, p) in log if c in ('1', '3')] == [
+                ('primary', '1'), ('secondary', '3'), ('secondary', '3')]
+        assert get_job('job1')['state'] == failover.DONE
+        assert [t['publish_type'] for t in job['settle_times']] == ['6', '0', '6']
+        assert all(t['secs'] is not None for t in job['settle_times'])
+        assert load_snapshot()['locations']['room1']['primary_ca']['channels']['live']['publish_type'] == '6'
+
+
+    def test_failover_to_secondary(self):
+        loc = make_location('room1', primary_pt='6', secondary_pt='6')
+        publish_snapshot({'room1': loc})
+        log = []
+
+        with fake_clients(loc, log), patch('cadash.redunlive.failover.time.sleep'):
+            job = run_failover(new_job('room1', 'secondary'), location_to_dict(loc))
+
+        assert job['state'] == failover.DONE
+        assert job['active_livestream'] == 'secondary'
+
+
+    def test_no_active_livestream(self):
+        loc = make_location('room1', primary_pt='0', secondary_pt='0')
+        job = run_failover(new_job('room1', 'primary'), location_to_dict(loc))
+        assert job['state'] == failover.FAILED
+        assert job['error'] is not None
+
+
+    def test_invalid_transition(self):
+        job = new_job('room1', 'primary')
+        job['state'] = failover.DONE
+        with pytest.raises(ValueError):
+            failover._transition(job, failover.SWITCHING)
+
+
+    def test_submit_reuses_running_job(self):
+        loc = make_location('room1', primary_pt='0', secondary_pt='6')
+
+        with patch('cadash.redunlive.failover._get_executor') as executor:
+            first = submit_failover(location_to_dict(loc), 'primary')
+            second = submit_failover(location_to_dict(loc), 'primary')
+
+        assert executor.return_value.submit.call_count == 1
+        assert first['id'] == second['id']
+        assert get_location_job('room1')['state'] == failover.QUEUED
+
+
+    def test_submit_other_target_in_progress(self):
+        loc = make_location('room1', primary_pt='0', secondary_pt='6')
+
+        with patch('cadash.redunlive.failover._get_executor') as executor:
+            first = submit_failover(location_to_dict(loc), 'primary')
+            with pytest.raises(FailoverInProgressError) as e:
+                submit_failover(location_to_dict(loc), 'secondary')
+
+        assert executor.return_value.submit.call_count == 1
+        assert e.value.job['id'] == first['id']
+        assert get_location_job('room1')['target'] == 'primary'
+
+
+    def test_concurrent_submits_queue_once(self, app):
+        loc = location_to_dict(make_location('room1', primary_pt='0', secondary_pt='6'))
+        go = threading.Event()
+        jobs = []
+
+        def submit():
+            go.wait()
+            with app.app_context():
+                jobs.append(submit_failover(loc, 'primary'))
+
+        with patch('cadash.redunlive.failover._get_executor') as executor:
+            threads = [threading.Thread(target=submit) for i in range(8)]
+            for t in threads:
+                t.start()
+            go.set()
+            for t in threads:
+                t.join()
+
+        assert executor.return_value.submit.call_count == 1
+        assert len(set(j['id'] for j in jobs)) == 1
+
+
+    def test_lost_job_reported_failed(self):
+        loc = make_location('room1', primary_pt='0', secondary_pt='6')
+
+        with patch('cadash.redunlive.failover._get_executor') as executor:
+            lost = submit_failover(location_to_dict(loc), 'primary')
+            later = lost['deadline'] + 1
+            with patch('cadash.redunlive.failover.time.time', return_value=later):
+                job = get_job(lost['id'])
+                assert job['state'] == failover.FAILED
+                assert job['error'].startswith('job lost')
+                # location free for another failover
+                other = submit_failover(location_to_dict(loc), 'secondary')
+
+        assert executor.return_value.submit.call_count == 2
+        assert other['id'] != lost['id']
+        assert get_location_job('room1')['id'] == other['id']
+
+
+    def test_bulk_failover_bounded(self):
+        locs = [make_location('room%d' % i) for i in range(6)]
+        publish_snapshot(dict((l.id, l) for l in locs))
+        snapshot = load_snapshot()
+        tracker = ConcurrencyTracker()
+
+        with patch.object(failover, '_executor', ThreadPoolExecutor(max_workers=2)), \
+                fake_clients(locs, [], tracker), \
+                patch('cadash.redunlive.failover.time.sleep'):
+            report = submit_bulk_failover(
+                    snapshot['locations'], [l.id for l in locs] + ['nowhere'],
+                    'secondary')
+            failover._executor.shutdown(wait=True)
+
+        assert report['locations']['nowhere']['error'] == 'location not found'
+        report = get_batch_report(report['id'])
+        assert report['finished']
+        assert report['summary'] == {'done': 6, 'failed': 1}
+        assert report['locations']['room3']['active_livestream'] == 'secondary'
+        # 2 locations at a time, live and lowBR channels at once
+        assert tracker.max == 2 * 2
+
+
+class TestFailoverStatus(object):
+
+    def test_status_not_found(self, testapp_login_disabled):
+        res = testapp_login_disabled.get('/redunlive/failover/unknown', status=404)
+        assert 'not found' in res.json['error']
+
+
+    def test_bulk_failover_bad_request(self, testapp_login_disabled):
+        res = testapp_login_disabled.post_json(
+                '/redunlive/failover', {'loc_ids': ['room1'], 'target': 'tertiary'},
+                status=400)
+        assert 'error' in res.json
+
+
+    @pytest.mark.parametrize('body', [
+        ['room1'],
+        {'loc_ids': 'room1', 'target': 'primary'},
+        {'loc_ids': [['room1']], 'target': 'primary'},
+    ])
+    def test_bulk_failover_bad_body(self, testapp_login_disabled, body):
+        res = testapp_login_disabled.post_json('/redunlive/failover', body, status=400)
+        assert 'error' in res.json
+
+
+    def test_bulk_failover(self, testapp_login_disabled):
+        publish_snapshot({'room1': make_location('room1')})
+
+        with patch('cadash.redunlive.failover._get_executor'):
+            res = testapp_login_disabled.post_json(
+                    '/redunlive/failover',
+                    {'loc_ids': ['room1', 'room2'], 'target': 'secondary'},
+                    status=202)
+        assert res.json['locations']['room1']['state'] == failover.QUEUED
+        assert res.json['locations']['room2']['state'] == failover.FAILED
+        assert not res.json['finished']
+
+        res = testapp_login_disabled.get(res.headers['Location'])
+        assert res.json['summary'] == {'queued': 1, 'failed': 1}
+
+
+    def test_failover_other_target_in_progress(self, testapp_login_disabled):
+        publish_snapshot({'room1': make_location('room1')})
+        headers = {'Accept': 'application/json'}
+
+        with patch('cadash.redunlive.failover._get_executor'):
+            res = testapp_login_disabled.post(
+                    '/redunlive/', {'loc_id': 'room1', 'active_device': 'secondary'},
+                    headers=headers, status=202)
+            res = testapp_login_disabled.post(
+                    '/redunlive/', {'loc_id': 'room1', 'active_device': 'primary'},
+                    headers=headers, status=409)
+            assert res.json['job']['target'] == 'secondary'
+
+            res = testapp_login_disabled.post_json(
+                    '/redunlive/failover', {'loc_ids': ['room1'], 'target': 'primary'},
+                    status=202)
+        assert 'in progress' in res.json['locations']['room1']['error']
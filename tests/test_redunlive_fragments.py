@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Tests for `fragments` in redunlive webapp."""
+from mock import patch
+import pytest
+
+from cadash.redunlive.fragments import FragmentCache
+from cadash.redunlive.fragments import get_fragment_cache
+from cadash.redunlive.fragments import render_location
+from cadash.redunlive.fragments import render_locations
+from cadash.redunlive.snapshot import location_to_dict
+from cadash.redunlive.snapshot import publish_snapshot
+
+from tests.test_redunlive_snapshot import make_location
+
+
+class TestFragmentCache(object):
+
+    def test_bounded(self):
+        fragments = FragmentCache(max_size=2)
+        fragments.set('a', u'A')
+        fragments.set('b', u'B')
+        assert fragments.get('a') == u'A'
+        fragments.set('c', u'C')
+        assert len(fragments) == 1
+        assert fragments.get('a') is None
+        assert (fragments.hits, fragments.misses) == (1, 1)
+
+
+@pytest.mark.usefixtures('app')
+class TestRenderLocation(object):
+
+    def test_rendered_once_per_state(self):
+        d = location_to_dict(make_location('room1'))
+        html = render_location(d)
+        assert 'id="room1"' in html
+        assert 'checked="checked"\n' in html
+
+        # polled again, lowBR not shown
+        polled = location_to_dict(make_location('room1'))
+        polled['primary_ca']['last_update'] += 60
+        polled['primary_ca']['channels']['lowBR']['publish_type'] = '0'
+        with patch('cadash.redunlive.fragments.render_template') as render:
+            assert render_location(polled) is html
+            assert not render.called
+
+        toggled = render_location(location_to_dict(
+            make_location('room1', primary_pt='0', secondary_pt='6')))
+        assert toggled != html
+        assert len(get_fragment_cache()) == 2
+
+
+    def test_template_version(self):
+        d = location_to_dict(make_location('room1'))
+        html = render_location(d)
+        with patch('cadash.redunlive.fragments.template_version',
+                   return_value='changed'):
+            with patch('cadash.redunlive.fragments.render_template',
+                       return_value=u'<div>new</div>'):
+                assert render_location(d) == u'<div>new</div>'
+        assert render_location(d) is html
+
+
+    def test_page_from_fragments(self, testapp_login_disabled):
+        publish_snapshot({'room1': make_location('room1'),
+                          'room2': make_location('room2')})
+        first = testapp_login_disabled.get('/redunlive/')
+        assert first.forms['room2']['active_device'].value == 'primary'
+
+        with patch('cadash.redunlive.fragments.render_template') as render:
+            second = testapp_login_disabled.get('/redunlive/')
+            fragments = render_locations([
+                    location_to_dict(make_location('room1')),
+                    location_to_dict(make_location('room2'))])
+            assert not render.called
+        assert sorted(second.forms.keys()) == sorted(first.forms.keys())
+        for fragment in fragments:
+            assert fragment in second.text
+
+        publish_snapshot({'room1': make_location('room1'),
+                          'room2': make_location('room2', primary_pt='0',
+                                                 secondary_pt='6')})
+        res = testapp_login_disabled.get('/redunlive/')
+        assert res.forms['room2']['active_device'].value == 'secondary'
+        assert res.forms['room1']['active_device'].value == 'primary'
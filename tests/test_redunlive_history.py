@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Tests for `history` in redunlive webapp."""
+import struct
+
+from mock import MagicMock
+import pytest
+from werkzeug.contrib.cache import RedisCache
+
+from cadash.extensions import cache
+from cadash.redunlive.history import HistoryRecorder
+from cadash.redunlive.history import StatusHistory
+from cadash.redunlive.models import CaptureAgent
+
+from tests.test_redunlive_breaker import FailingClient
+
+
+def make_ca(client, history):
+    ca = CaptureAgent('SERIAL0001', 'fake0001.example.edu')
+    ca.channels['live']['channel'] = '1'
+    ca.channels['lowBR']['channel'] = '2'
+    ca.channels['live']['publish_type'] = '6'
+    ca.channels['lowBR']['publish_type'] = '6'
+    ca.client = client
+    ca.history = history
+    return ca
+
+
+class TestStatusHistory(object):
+
+    def test_ring_overwrites_oldest(self):
+        h = StatusHistory(capacity=3)
+        for i in range(5):
+            h.append(1000 + i, 'live', str(i), 0.1)
+
+        assert len(h) == 3
+        assert [e['publish_type'] for e in h.entries()] == ['2', '3', '4']
+        assert [e['timestamp'] for e in h.entries(since=1003)] == [1004]
+
+
+    def test_to_bytes_roundtrip(self):
+        h = StatusHistory(capacity=4)
+        for (i, pt) in enumerate(['0', '6', 'not available', '6', '0']):
+            h.append(1000 + i, 'lowBR' if i % 2 else 'live', pt, 0.25)
+
+        data = h.to_bytes()
+        assert len(data) == StatusHistory.HEADER.size + 4 * 18
+        assert StatusHistory.from_bytes(data).entries() == h.entries()
+        # arrays are big-endian, as the header; slot 0 was overwritten last
+        offset = StatusHistory.HEADER.size
+        assert struct.unpack('!d', data[offset:offset + 8]) == (1004.0,)
+
+
+    def test_from_bytes_resized(self):
+        h = StatusHistory(capacity=4)
+        for i in range(4):
+            h.append(1000 + i, 'live', '6', 0.1)
+
+        smaller = StatusHistory.from_bytes(h.to_bytes(), capacity=2)
+        assert smaller.capacity == 2
+        assert [e['timestamp'] for e in smaller.entries()] == [1002, 1003]
+
+
+@pytest.mark.usefixtures('app')
+class TestHistoryRecorder(object):
+
+    def test_records_only_transitions(self):
+        client = FailingClient()
+        client.fail = False
+        recorder = HistoryRecorder(cache.cache, capacity=8)
+        ca = make_ca(client, recorder)
+
+        # first seen state is recorded, then only changes
+        ca.sync_live_status()
+        ca.sync_live_status()
+        assert len(recorder.get('SERIAL0001')) == 2
+
+        client.fail = True
+        ca.sync_live_status()
+        ca.sync_live_status()
+        entries = recorder.get('SERIAL0001').entries()[2:]
+        assert sorted(e['channel'] for e in entries) == ['live', 'lowBR']
+        assert all(e['publish_type'] == 'not available' for e in entries)
+        assert all(e['latency'] >= 0 for e in entries)
+
+
+    def test_new_ca_compared_with_stored(self):
+        client = FailingClient()
+        client.fail = False
+        make_ca(client, HistoryRecorder(cache.cache)).sync_live_status()
+
+        # e.g. another worker, or after a restart: state not polled yet
+        recorder = HistoryRecorder(cache.cache)
+        ca = make_ca(client, recorder)
+        ca.channels['live']['publish_type'] = 'not available'
+        ca.sync_live_status()
+        assert len(recorder.get('SERIAL0001')) == 2
+
+
+    def test_recovery_recorded_after_other_recorder(self):
+        # the poller, and a failover job that saw the device unreachable
+        poller = HistoryRecorder(cache.cache)
+        job = HistoryRecorder(cache.cache)
+        assert poller.record('SERIAL0001', 1000, 'live', '6', 0.1)
+        assert job.record('SERIAL0001', 1001, 'live', 'not available', 0.1)
+
+        assert poller.record('SERIAL0001', 1002, 'live', '6', 0.1)
+        assert not poller.record('SERIAL0001', 1003, 'live', '6', 0.1)
+        assert [e['publish_type'] for e in poller.get('SERIAL0001').entries()] == [
+                '6', 'not available', '6']
+
+
+    def test_records_writes(self):
+        client = FailingClient()
+        client.fail = False
+        recorder = HistoryRecorder(cache.cache, capacity=8)
+        ca = make_ca(client, recorder)
+
+        ca.write_live_status('0')
+        entries = recorder.get('SERIAL0001').entries()
+        assert sorted((e['channel'], e['publish_type']) for e in entries) == [
+                ('live', '0'), ('lowBR', '0')]
+
+
+class TestRedisHistory(object):
+
+    def make_recorder(self, stored):
+        client = MagicMock()
+        pipe = client.pipeline.return_value.__enter__.return_value
+        pipe.lrange.return_value = stored
+        backend = RedisCache(host=client, key_prefix='cadash:')
+        return (HistoryRecorder(backend, capacity=8, timeout=60), pipe)
+
+
+    def test_appended_to_list(self):
+        (recorder, pipe) = self.make_recorder(
+                [StatusHistory.pack_entry(1000, 'live', '0', 0.1)])
+        assert recorder.record('SERIAL0001', 2000, 'live', '6', 0.1)
+
+        name = 'cadash:redunlive:history:list:SERIAL0001'
+        pipe.watch.assert_called_once_with(name)
+        pipe.rpush.assert_called_once_with(
+                name, StatusHistory.pack_entry(2000, 'live', '6', 0.1))
+        pipe.ltrim.assert_called_once_with(name, -8, -1)
+        pipe.expire.assert_called_once_with(name, 60)
+
+
+    def test_same_as_stored_not_appended(self):
+        (recorder, pipe) = self.make_recorder([
+                StatusHistory.pack_entry(1000, 'live', '6', 0.1),
+                StatusHistory.pack_entry(1001, 'lowBR', '0', 0.1)])
+        assert not recorder.record('SERIAL0001', 2000, 'live', '6', 0.1)
+        assert not pipe.rpush.called
+
+
+class TestHistoryView(object):
+
+    def test_history(self, testapp_login_disabled):
+        recorder = HistoryRecorder(cache.cache)
+        recorder.record('SERIAL0001', 1000, 'live', '0', 0.5)
+        recorder.record('SERIAL0001', 2000, 'live', '6', 0.2)
+
+        res = testapp_login_disabled.get('/redunlive/history/SERIAL0001')
+        assert [e['publish_type'] for e in res.json['entries']] == ['0', '6']
+        assert res.json['entries'][0]['time'] == '1970-01-01T00:16:40+00:00'
+
+        res = testapp_login_disabled.get(
+                '/redunlive/history/SERIAL0001?since=1000')
+        assert [e['timestamp'] for e in res.json['entries']] == [2000]
+
+        res = testapp_login_disabled.get('/redunlive/history/SERIAL0002')
+        assert res.json['entries'] == []
+
+
+    def test_history_bad_since(self, testapp_login_disabled):
+        testapp_login_disabled.get(
+                '/redunlive/history/SERIAL0001?since=yesterday', status=400)
@@ -6,6 +6,7 @@ from epipearl import Epipearl
 
 from cadash.redunlive.models import CaptureAgent
 from cadash.redunlive.models import CaLocation
+from cadash.redunlive.models import NOT_AVAILABLE
 
 
 epiphan_url = 'http://fake.example.edu'
@@ -79,6 +80,90 @@ class TestCaptureAgentModel(object):
         assert live['publish_type'] == new_publish_status
 
 
+    @httpretty.activate
+    def test_wait_for_publish_type(self):
+        httpretty.register_uri(
+                httpretty.GET, '%s/admin/channel1/get_params.cgi' % epiphan_url,
+                responses=[
+                    httpretty.Response(body='publish_type = 0'),
+                    httpretty.Response(body='publish_type = 0'),
+                    httpretty.Response(body='publish_type = 6')])
+        httpretty.register_uri(
+                httpretty.GET, '%s/admin/channel2/get_params.cgi' % epiphan_url,
+                body='publish_type = 6')
+
+        secs = self.ca.wait_for_publish_type('6', deadline=5, interval=0.01)
+        assert secs is not None
+        assert secs < 5
+        assert self.ca.channels['live']['publish_type'] == '6'
+        assert len([r for r in httpretty.HTTPretty.latest_requests
+                    if 'channel1' in r.path]) == 3
+
+
+    @httpretty.activate
+    def test_wait_for_publish_type_deadline(self):
+        httpretty.register_uri(
+                httpretty.GET, '%s/admin/channel1/get_params.cgi' % epiphan_url,
+                body='publish_type = 0')
+        httpretty.register_uri(
+                httpretty.GET, '%s/admin/channel2/get_params.cgi' % epiphan_url,
+                body='publish_type = 6')
+
+        assert self.ca.wait_for_publish_type('6', deadline=0.1, interval=0.02) is None
+        assert self.ca.channels['live']['publish_type'] == '0'
+
+
+    def test_compact_state(self):
+        assert not hasattr(self.ca, '__dict__')
+        with pytest.raises(AttributeError):
+            self.ca.color = 'blue'
+
+        other = CaptureAgent('ABCD2222', 'fake2.example.edu')
+        other.channels['live'].update({'channel': '1', 'publish_type': u'0'})
+        assert other.channels['live']['publish_type'] is \
+                self.ca.channels['live']['publish_type']
+        assert other.channels['lowBR']['publish_type'] is NOT_AVAILABLE
+
+
+    def test_channels_view(self):
+        assert dict(self.ca.channels['live']) == {
+                'channel': '1', 'publish_type': '0'}
+        assert self.ca.channels == {
+                'live': {'channel': '1', 'publish_type': '0'},
+                'lowBR': {'channel': '2', 'publish_type': '0'}}
+
+        # replaces the channel, as a dict would
+        self.ca.channels['lowBR'] = {'publish_type': '6'}
+        assert self.ca.channels['lowBR']['channel'] == NOT_AVAILABLE
+        assert self.ca.channels['lowBR']['publish_type'] == '6'
+        self.ca.channels['lowBR'] = {'channel': '2', 'publish_type': '0'}
+        assert dict(self.ca.channels['lowBR']) == {'channel': '2', 'publish_type': '0'}
+        with pytest.raises(KeyError):
+            self.ca.channels['live']['bitrate'] = '1000'
+        with pytest.raises(KeyError):
+            self.ca.channels['live'] = {'bitrate': '1000'}
+
+
+    def test_channel_accessors(self):
+        assert self.ca.channel('live') == '1'
+        assert self.ca.publish_type('lowBR') == '0'
+        self.ca.set_publish_type('lowBR', u'6')
+        assert self.ca.channels['lowBR']['publish_type'] == '6'
+        assert self.ca.publish_type('lowBR') is self.ca.publish_type('lowBR')
+
+
+    def test_last_update(self):
+        self.ca.last_update = 1000
+        assert self.ca.last_update_timestamp == 1000.0
+        # a python 2 long too
+        self.ca.last_update = 10 ** 20
+        assert self.ca.last_update_timestamp == 1e20
+        self.ca.last_update = 1000
+        assert self.ca.last_update.isoformat() == '1970-01-01T00:16:40+00:00'
+
+        self.ca.last_update = self.ca.last_update.replace(seconds=+10)
+        assert self.ca.last_update_timestamp == 1010.0
+
 
 
 
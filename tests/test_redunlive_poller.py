@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Tests for `poller` in redunlive webapp."""
+import threading
+import time
+
+import pytest
+
+from cadash.redunlive import poller
+from cadash.redunlive.models import CaptureAgent
+from cadash.redunlive.poller import call_concurrently
+from cadash.redunlive.poller import sync_all
+
+
+class FakeClient(object):
+    """fake epipearl client that takes `delay` secs to respond."""
+
+    def __init__(self, delay=0, publish_type='6', tracker=None):
+        self.delay = delay
+        self.publish_type = publish_type
+        self.tracker = tracker
+        self.release = threading.Event()
+
+    def get_params(self, channel, params={}):
+        if self.tracker is not None:
+            self.tracker.enter()
+        try:
+            self.release.wait(self.delay)
+        finally:
+            if self.tracker is not None:
+                self.tracker.leave()
+        return {'publish_type': self.publish_type}
+
+    def set_params(self, channel, params):
+        self.get_params(channel)
+        self.publish_type = params['publish_type']
+        return True
+
+
+class ConcurrencyTracker(object):
+    """keep track of max number of concurrent calls."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.max = 0
+
+    def enter(self):
+        with self.lock:
+            self.current += 1
+            self.max = max(self.max, self.current)
+
+    def leave(self):
+        with self.lock:
+            self.current -= 1
+
+
+def make_ca(i, client):
+    ca = CaptureAgent('SERIAL%04d' % i, 'fake%04d.example.edu' % i)
+    ca.channels['live']['channel'] = '1'
+    ca.channels['lowBR']['channel'] = '2'
+    ca.client = client
+    return ca
+
+
+class TestPoller(object):
+
+    def test_sync_all_in_parallel(self):
+        tracker = ConcurrencyTracker()
+        cas = [make_ca(i, FakeClient(0.1, tracker=tracker)) for i in range(20)]
+
+        start = time.time()
+        missed = sync_all(cas, max_workers=10, deadline=10)
+        elapsed = time.time() - start
+
+        assert missed == []
+        # 10 devices, live and lowBR channels at the same time
+        assert tracker.max <= 2 * 10
+        assert elapsed < 20 * 2 * 0.1
+        for ca in cas:
+            assert ca.channels['live']['publish_type'] == '6'
+            assert ca.channels['lowBR']['publish_type'] == '6'
+
+
+    def test_sync_all_deadline(self):
+        fast = [make_ca(i, FakeClient(0)) for i in range(3)]
+        slow = make_ca(99, FakeClient(2))
+        slow.channels['live']['publish_type'] = '6'
+
+        start = time.time()
+        missed = sync_all(fast + [slow], max_workers=4, deadline=0.5)
+        elapsed = time.time() - start
+
+        assert elapsed < 1.5
+        assert missed == [slow]
+        assert slow.channels['live']['publish_type'] == 'not available'
+        assert slow.channels['lowBR']['publish_type'] == 'not available'
+        for ca in fast:
+            assert ca.channels['live']['publish_type'] == '6'
+
+        # abandoned device call finishing late does not change the ca
+        slow.client.release.set()
+        time.sleep(0.1)
+        assert slow.channels['live']['publish_type'] == 'not available'
+        assert slow.channels['lowBR']['publish_type'] == 'not available'
+
+
+    def test_sync_all_empty(self):
+        assert sync_all([]) == []
+
+
+    def test_channels_synced_concurrently(self):
+        tracker = ConcurrencyTracker()
+        ca = make_ca(1, FakeClient(0.2, tracker=tracker))
+
+        start = time.time()
+        ca.sync_live_status()
+        elapsed = time.time() - start
+
+        assert tracker.max == 2
+        assert elapsed < 2 * 0.2
+        assert ca.channels['lowBR']['publish_type'] == '6'
+
+
+    def test_channels_written_concurrently(self):
+        tracker = ConcurrencyTracker()
+        ca = make_ca(1, FakeClient(0.2, tracker=tracker))
+
+        start = time.time()
+        ca.write_live_status('0')
+        elapsed = time.time() - start
+
+        assert tracker.max == 2
+        assert elapsed < 2 * 0.2
+        assert ca.channels['live']['publish_type'] == '0'
+        assert ca.channels['lowBR']['publish_type'] == '0'
+
+
+    def test_call_concurrently_raises(self):
+        def fail():
+            raise ValueError('boom')
+
+        assert call_concurrently((len, 'ab'), (len, 'abc')) == [2, 3]
+        with pytest.raises(ValueError):
+            call_concurrently((len, 'ab'), (fail,))
+
+
+    def test_channel_pool_sized_by_app(self, app):
+        assert poller._get_channel_executor()._max_workers == \
+                app.config['REDUNLIVE_CHANNEL_WORKERS']
+
+        poller.set_channel_max_workers(3)
+        try:
+            assert poller._get_channel_executor()._max_workers == 3
+            assert call_concurrently((len, 'ab'), (len, 'abc')) == [2, 3]
+        finally:
+            poller.set_channel_max_workers(app.config['REDUNLIVE_CHANNEL_WORKERS'])
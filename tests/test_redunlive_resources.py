@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Tests for rest `resources` in redunlive webapp."""
+from mock import patch
+
+from cadash.redunlive.snapshot import publish_snapshot
+from cadash.redunlive.snapshot import update_snapshot_location
+
+from tests.test_redunlive_snapshot import make_location
+
+
+class TestLocationListAPI(object):
+
+    def setup(self):
+        self.url = '/api/redunlive/locations'
+
+
+    def test_full(self, testapp_login_disabled):
+        snapshot = publish_snapshot({
+            'room1': make_location('room1'),
+            'room2': make_location('room2', primary_pt='0', secondary_pt='6')})
+
+        res = testapp_login_disabled.get(self.url)
+        assert res.json['version'] == snapshot['version']
+        assert res.json['full']
+        assert [l['id'] for l in res.json['locations']] == ['room1', 'room2']
+        assert [l['active_livestream'] for l in res.json['locations']] == [
+                'primary', 'secondary']
+        assert res.headers['ETag'].startswith('"')
+        assert 'no-cache' in res.headers['Cache-Control']
+
+
+    def test_not_modified(self, testapp_login_disabled):
+        publish_snapshot({'room1': make_location('room1')})
+
+        res = testapp_login_disabled.get(self.url)
+        etag = res.headers['ETag']
+        with patch('cadash.redunlive.resources.location_item') as item:
+            res = testapp_login_disabled.get(
+                    self.url, headers={'If-None-Match': etag}, status=304)
+            assert not item.called
+        assert res.headers['ETag'] == etag
+
+        publish_snapshot({'room1': make_location('room1', primary_pt='0')})
+        res = testapp_login_disabled.get(
+                self.url, headers={'If-None-Match': etag}, status=200)
+        assert res.headers['ETag'] != etag
+
+
+    def test_since(self, testapp_login_disabled):
+        first = publish_snapshot({
+            'room1': make_location('room1'),
+            'room2': make_location('room2'),
+            'room3': make_location('room3')})
+        publish_snapshot({'room1': make_location('room1'),
+                          'room2': make_location('room2')})
+        last = update_snapshot_location(
+                make_location('room2', primary_pt='0', secondary_pt='6'))
+
+        res = testapp_login_disabled.get(
+                self.url, params={'since': first['version']})
+        assert not res.json['full']
+        assert res.json['since'] == first['version']
+        assert res.json['version'] == last['version']
+        assert [l['id'] for l in res.json['locations']] == ['room2']
+        assert res.json['removed'] == ['room3']
+
+        # since a different version, a different representation
+        etag = res.headers['ETag']
+        res = testapp_login_disabled.get(
+                self.url, params={'since': last['version']},
+                headers={'If-None-Match': etag})
+        assert res.json['locations'] == []
+        assert res.json['removed'] == []
+        assert res.headers['ETag'] != etag
+
+
+    def test_since_unknown_is_full(self, testapp_login_disabled):
+        snapshot = publish_snapshot({'room1': make_location('room1')})
+
+        for since in [snapshot['version'] - 1, snapshot['version'] + 1]:
+            res = testapp_login_disabled.get(self.url, params={'since': since})
+            assert res.json['full']
+            assert [l['id'] for l in res.json['locations']] == ['room1']
+
+
+    def test_since_invalid(self, testapp_login_disabled):
+        publish_snapshot({'room1': make_location('room1')})
+        testapp_login_disabled.get(self.url, params={'since': 'x'}, status=400)
+
+
+class TestLocationAPI(object):
+
+    def test_location(self, testapp_login_disabled):
+        publish_snapshot({'room1': make_location('room1')})
+
+        res = testapp_login_disabled.get('/api/redunlive/locations/room1')
+        assert res.json['primary_ca']['serial_number'] == 'room1P'
+        etag = res.headers['ETag']
+
+        # another location changed: same representation
+        update_snapshot_location(make_location('room2'))
+        testapp_login_disabled.get(
+                '/api/redunlive/locations/room1',
+                headers={'If-None-Match': etag}, status=304)
+
+
+    def test_not_found(self, testapp_login_disabled):
+        publish_snapshot({'room1': make_location('room1')})
+        res = testapp_login_disabled.get(
+                '/api/redunlive/locations/room9', status=404)
+        assert 'not found' in res.json['message']
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Tests for `schedule` in redunlive webapp."""
+from cadash.redunlive.models import CaptureAgent
+from cadash.redunlive.schedule import PollSchedule
+
+
+def make_ca(serial, publish_type='6'):
+    ca = CaptureAgent(serial, '%s.example.edu' % serial.lower())
+    ca.channels['live']['channel'] = '1'
+    ca.channels['live']['publish_type'] = publish_type
+    return ca
+
+
+class TestPollSchedule(object):
+
+    def setup(self):
+        self.schedule = PollSchedule(
+                live_interval=10, idle_interval=100, recent_window=50)
+
+
+    def test_pop_due_in_order(self):
+        self.schedule.schedule('C', 30)
+        self.schedule.schedule('A', 10)
+        self.schedule.schedule('B', 20)
+
+        assert self.schedule.next_due() == 10
+        assert self.schedule.pop_due(25) == ['A', 'B']
+        assert self.schedule.pop_due(25) == []
+        assert self.schedule.pop_due(30) == ['C']
+        assert len(self.schedule) == 0
+        assert self.schedule.next_due() is None
+
+
+    def test_reschedule_replaces_previous(self):
+        self.schedule.schedule('A', 10)
+        self.schedule.schedule('A', 50)
+
+        assert self.schedule.pop_due(20) == []
+        assert self.schedule.due_at('A') == 50
+        assert self.schedule.pop_due(50) == ['A']
+
+
+    def test_retain(self):
+        for (i, serial) in enumerate(['A', 'B', 'C']):
+            self.schedule.schedule(serial, i)
+        self.schedule.retain(['B'])
+
+        assert len(self.schedule) == 1
+        assert self.schedule.pop_due(100) == ['B']
+
+
+    def test_intervals(self):
+        assert self.schedule.reschedule(make_ca('LIVE'), True, False, 0) == 10
+        assert self.schedule.reschedule(make_ca('IDLE'), False, False, 0) == 100
+        assert self.schedule.reschedule(
+                make_ca('DOWN', 'not available'), True, False, 0) == 100
+
+
+    def test_recently_changed(self):
+        ca = make_ca('CHANGED')
+        assert self.schedule.reschedule(ca, False, True, 0) == 10
+        assert self.schedule.reschedule(ca, False, False, 40) == 50
+        assert self.schedule.reschedule(ca, False, False, 60) == 160
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Tests for `singleflight` in redunlive webapp."""
+import threading
+import time
+
+from mock import patch
+import pytest
+from werkzeug.contrib.cache import SimpleCache
+
+from cadash.extensions import cache
+from cadash.redunlive.models import CaLocation
+from cadash.redunlive.singleflight import CacheLease
+from cadash.redunlive.singleflight import SingleFlight
+from cadash.redunlive.snapshot import REFRESH_LEASE_KEY
+from cadash.redunlive.snapshot import publish_snapshot
+from cadash.redunlive.snapshot import refresh_snapshot
+
+
+def run_threads(target, count):
+    results = []
+    errors = []
+
+    def wrapper():
+        try:
+            results.append(target())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=wrapper) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    return (results, errors)
+
+
+class TestSingleFlight(object):
+
+    def test_concurrent_calls_coalesced(self):
+        calls = []
+
+        def work():
+            calls.append(1)
+            time.sleep(0.3)
+            return 'result'
+
+        flight = SingleFlight()
+        (results, errors) = run_threads(lambda: flight.do('k', work), 5)
+
+        assert errors == []
+        assert results == ['result'] * 5
+        assert len(calls) == 1
+
+
+    def test_sequential_calls_not_coalesced(self):
+        flight = SingleFlight()
+        calls = []
+        flight.do('k', calls.append, 1)
+        flight.do('k', calls.append, 2)
+        assert calls == [1, 2]
+
+
+    def test_error_shared_with_followers(self):
+        def work():
+            time.sleep(0.3)
+            raise ValueError('boom')
+
+        flight = SingleFlight()
+        (results, errors) = run_threads(lambda: flight.do('k', work), 3)
+
+        assert results == []
+        assert len(errors) == 3
+        assert all(isinstance(e, ValueError) for e in errors)
+
+
+class TestCacheLease(object):
+
+    def test_lease_is_exclusive(self):
+        backend = SimpleCache()
+        lease1 = CacheLease(backend, 'lease', ttl=10)
+        lease2 = CacheLease(backend, 'lease', ttl=10)
+
+        assert lease1.acquire()
+        assert not lease2.acquire()
+
+        # release by non-holder is a noop
+        lease2.release()
+        assert not lease2.acquire()
+
+        lease1.release()
+        assert lease2.acquire()
+
+
+    def test_expired_lease(self):
+        backend = SimpleCache()
+        lease1 = CacheLease(backend, 'lease', ttl=1)
+        lease2 = CacheLease(backend, 'lease', ttl=1)
+
+        assert lease1.acquire()
+        time.sleep(1.1)
+        assert lease2.acquire()
+
+
+@pytest.mark.usefixtures('app')
+class TestCoalescedRefresh(object):
+
+    def test_concurrent_refresh_in_process(self, app):
+        def slow_prep():
+            time.sleep(0.3)
+            return {'all_locations': {'room1': CaLocation('room1')}}
+
+        def refresh():
+            with app.app_context():
+                return refresh_snapshot()['version']
+
+        with patch('cadash.redunlive.snapshot.prep_redunlive_data',
+                   side_effect=slow_prep) as prep:
+            (results, errors) = run_threads(refresh, 5)
+
+        assert errors == []
+        assert prep.call_count == 1
+        assert len(set(results)) == 1
+
+
+    def test_refresh_waits_for_other_worker(self, app):
+        # another worker holds the refresh lease
+        other = CacheLease(cache.cache, REFRESH_LEASE_KEY, ttl=10)
+        assert other.acquire()
+
+        def refresh():
+            with app.app_context():
+                return refresh_snapshot()
+
+        results = []
+        with patch('cadash.redunlive.snapshot.prep_redunlive_data') as prep:
+            follower = threading.Thread(target=lambda: results.append(refresh()))
+            follower.start()
+            time.sleep(0.3)
+
+            # other worker publishes its snapshot
+            published = publish_snapshot({'room1': CaLocation('room1')})
+            other.release()
+            follower.join(5)
+
+        assert prep.call_count == 0
+        assert results[0]['version'] == published['version']
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""Tests for `snapshot` and `worker` in redunlive webapp."""
+import threading
+import time
+
+from mock import patch
+import pytest
+
+from cadash.redunlive.codec import replace_locations
+from cadash.redunlive.models import CaptureAgent
+from cadash.redunlive.models import CaLocation
+from cadash.redunlive.snapshot import get_snapshot
+from cadash.redunlive.snapshot import load_snapshot
+from cadash.redunlive.snapshot import location_from_dict
+from cadash.redunlive.snapshot import location_to_dict
+from cadash.redunlive.snapshot import publish_snapshot
+from cadash.redunlive.snapshot import snapshot_locations
+from cadash.redunlive.snapshot import update_snapshot_location
+from cadash.redunlive import worker
+from cadash.redunlive.worker import FleetPoller
+from cadash.redunlive.worker import refresh_in_background
+
+
+def make_location(name, primary_pt='6', secondary_pt='0'):
+    p = CaptureAgent('%sP' % name, '%s-primary.example.edu' % name)
+    p.channels['live']['channel'] = '1'
+    p.channels['live']['publish_type'] = primary_pt
+    p.channels['lowBR']['channel'] = '2'
+    p.channels['lowBR']['publish_type'] = primary_pt
+    s = CaptureAgent('%sS' % name, '%s-secondary.example.edu' % name)
+    s.channels['live']['channel'] = '3'
+    s.channels['live']['publish_type'] = secondary_pt
+    s.channels['lowBR']['channel'] = '4'
+    s.channels['lowBR']['publish_type'] = secondary_pt
+
+    loc = CaLocation(name)
+    loc.primary_ca = p
+    loc.secondary_ca = s
+    return loc
+
+
+def mapping(*locations):
+    """result of map_redunlive_ca_loc, all capture agents synced."""
+    all_cas = {}
+    for loc in locations:
+        for ca in [loc.primary_ca, loc.secondary_ca] + loc.experimental_cas:
+            all_cas[ca.serial_number] = ca
+    return {
+            'all_locations': dict((loc.id, loc) for loc in locations),
+            'all_cas': all_cas,
+            'synced_cas': list(all_cas.values())}
+
+
+@pytest.mark.usefixtures('app')
+class TestSnapshot(object):
+
+    def test_location_roundtrip(self):
+        loc = make_location('room1')
+        loc.experimental_cas.append(
+                CaptureAgent('EXP1', 'room1-exp.example.edu'))
+
+        copy = location_from_dict(location_to_dict(loc))
+        assert copy.id == loc.id
+        assert copy.primary_ca.serial_number == loc.primary_ca.serial_number
+        assert copy.secondary_ca.channels == loc.secondary_ca.channels
+        assert copy.primary_ca.client is None
+        assert len(copy.experimental_cas) == 1
+        assert copy.active_livestream == 'primary'
+
+
+    def test_publish_increments_version(self):
+        assert load_snapshot() is None
+
+        first = publish_snapshot({'room1': make_location('room1')})
+        second = publish_snapshot({'room1': make_location('room1')})
+        assert second['version'] == first['version'] + 1
+        assert load_snapshot()['version'] == second['version']
+
+
+    def test_update_location(self):
+        publish_snapshot({
+            'room1': make_location('room1'),
+            'room2': make_location('room2')})
+
+        snapshot = update_snapshot_location(
+                make_location('room2', primary_pt='0', secondary_pt='6'))
+        locations = snapshot_locations(snapshot)
+
+        assert [l.id for l in locations] == ['room1', 'room2']
+        assert locations[0].active_livestream == 'primary'
+        assert locations[1].active_livestream == 'secondary'
+
+
+    def test_concurrent_updates_kept(self, app):
+        names = ['room%d' % i for i in range(6)]
+        publish_snapshot(dict((n, make_location(n)) for n in names))
+
+        def slow_replace(*args):
+            # widen the window between reading and writing the snapshot
+            time.sleep(0.01)
+            return replace_locations(*args)
+
+        def toggle(name):
+            with app.app_context():
+                update_snapshot_location(
+                        make_location(name, primary_pt='0', secondary_pt='6'))
+
+        with patch('cadash.redunlive.snapshot.replace_locations', side_effect=slow_replace):
+            threads = [threading.Thread(target=toggle, args=(n,)) for n in names]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        locations = snapshot_locations(load_snapshot())
+        assert [l.active_livestream for l in locations] == ['secondary'] * 6
+
+
+    def test_changes_tracked(self, app):
+        first = publish_snapshot({
+            'room1': make_location('room1'),
+            'room2': make_location('room2'),
+            'room3': make_location('room3')})
+        v1 = first['version']
+        assert first['deltas_since'] == v1
+
+        # room1 polled, same state; room2 toggled; room3 removed
+        polled = make_location('room1')
+        polled.primary_ca.last_update = 2000000000
+        second = publish_snapshot({
+            'room1': polled,
+            'room2': make_location('room2', primary_pt='0', secondary_pt='6')})
+        v2 = second['version']
+        assert second['changed'] == {'room1': v1, 'room2': v2}
+        assert second['removed'] == {'room3': v2}
+        assert second['deltas_since'] == v1
+
+        third = update_snapshot_location(make_location('room3'))
+        assert third['changed']['room3'] == third['version']
+        assert third['removed'] == {}
+        assert load_snapshot()['changed'] == third['changed']
+
+
+    def test_removed_bounded(self, app):
+        with patch('cadash.redunlive.snapshot.REMOVED_MAX', 2):
+            v1 = publish_snapshot({
+                'room1': make_location('room1'),
+                'room2': make_location('room2'),
+                'room3': make_location('room3')})['version']
+            v2 = publish_snapshot({'room2': make_location('room2'),
+                                   'room3': make_location('room3')})['version']
+            snapshot = publish_snapshot({})
+
+        assert snapshot['removed'] == {
+                'room2': snapshot['version'], 'room3': snapshot['version']}
+        assert snapshot['deltas_since'] == v2
+        assert v1 < v2
+
+
+    def test_get_snapshot_refresh_when_missing(self):
+        with patch('cadash.redunlive.snapshot.prep_redunlive_data',
+                   return_value=mapping(make_location('room1'))) as prep:
+            snapshot = get_snapshot()
+            assert prep.call_count == 1
+            assert 'room1' in snapshot['locations']
+
+            # fresh snapshot is not refreshed again
+            get_snapshot()
+            assert prep.call_count == 1
+
+
+    def test_get_snapshot_refresh_when_stale(self, app):
+        publish_snapshot({'room1': make_location('room1')})
+        app.config['REDUNLIVE_SNAPSHOT_MAX_AGE'] = -1
+
+        with patch('cadash.redunlive.snapshot.prep_redunlive_data',
+                   return_value=mapping(make_location('room2'))) as prep:
+            snapshot = get_snapshot()
+            assert prep.call_count == 1
+            assert list(snapshot['locations'].keys()) == ['room2']
+
+
+    def test_refresh_keeps_newer_state_of_cas_not_polled(self, app):
+        # room1 toggled to secondary after its cas were last polled
+        toggled = make_location('room1', primary_pt='0', secondary_pt='6')
+        toggled.primary_ca.last_update = 2000000000
+        toggled.secondary_ca.last_update = 2000000000
+        publish_snapshot({'room1': toggled})
+        app.config['REDUNLIVE_SNAPSHOT_MAX_AGE'] = -1
+
+        # refresh reuses cas as polled before the toggle
+        data = mapping(make_location('room1'))
+        data['synced_cas'] = []
+        with patch('cadash.redunlive.snapshot.prep_redunlive_data', return_value=data):
+            snapshot = get_snapshot()
+
+        loc = snapshot_locations(snapshot)[0]
+        assert loc.active_livestream == 'secondary'
+
+
+    def test_location_toggled_during_refresh_kept(self, app):
+        publish_snapshot({'room1': make_location('room1'),
+                          'room2': make_location('room2')})
+        app.config['REDUNLIVE_SNAPSHOT_MAX_AGE'] = -1
+
+        def prep_while_toggled():
+            # polled before the toggle, published by a failover job meanwhile
+            data = mapping(make_location('room1'), make_location('room2'))
+            toggled = make_location('room1', primary_pt='0', secondary_pt='6')
+            toggled.primary_ca.last_update = time.time()
+            toggled.secondary_ca.last_update = time.time()
+            update_snapshot_location(toggled)
+            return data
+
+        with patch('cadash.redunlive.snapshot.prep_redunlive_data',
+                   side_effect=prep_while_toggled):
+            snapshot = get_snapshot()
+
+        locations = dict((loc.id, loc) for loc in snapshot_locations(snapshot))
+        assert locations['room1'].active_livestream == 'secondary'
+        assert locations['room2'].active_livestream == 'primary'
+        assert load_snapshot()['version'] == snapshot['version']
+
+
+class TestFleetPoller(object):
+
+    def test_poll_once(self, app):
+        poller = FleetPoller(app, interval=1)
+        with patch('cadash.redunlive.snapshot.prep_redunlive_data',
+                   return_value=mapping(make_location('room1'))):
+            snapshot = poller.poll_once()
+        assert snapshot is not None
+        assert load_snapshot()['version'] == snapshot['version']
+
+
+    def test_poll_once_failure(self, app):
+        poller = FleetPoller(app, interval=1)
+        with patch('cadash.redunlive.snapshot.prep_redunlive_data',
+                   side_effect=ValueError('ca_stats is down')):
+            assert poller.poll_once() is None
+
+
+    def test_refresh_in_background(self, app):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_prep():
+            started.set()
+            release.wait(5)
+            return mapping(make_location('room1'))
+
+        with patch('cadash.redunlive.snapshot.prep_redunlive_data',
+                   side_effect=slow_prep) as prep:
+            assert refresh_in_background(app)
+            started.wait(5)
+            # one refresh at a time
+            assert not refresh_in_background(app)
+            release.set()
+            worker._background_refresh[0].join(5)
+        assert prep.call_count == 1
+        assert 'room1' in load_snapshot()['locations']
+
+
+    def test_stale_location_served_while_refreshed(
+            self, app_login_disabled, testapp_login_disabled):
+        publish_snapshot({'room1': make_location('room1')})
+        version = load_snapshot()['version']
+        app_login_disabled.config['REDUNLIVE_SNAPSHOT_MAX_AGE'] = -1
+        release = threading.Event()
+
+        def slow_prep():
+            release.wait(5)
+            return mapping(make_location('room1', primary_pt='0', secondary_pt='6'))
+
+        with patch('cadash.redunlive.snapshot.prep_redunlive_data',
+                   side_effect=slow_prep):
+            # served from the stale snapshot, without waiting for the refresh
+            res = testapp_login_disabled.get('/redunlive/locations/room1')
+            assert 'room1' in res
+            assert load_snapshot()['version'] == version
+            release.set()
+            worker._background_refresh[0].join(5)
+        assert load_snapshot()['version'] > version
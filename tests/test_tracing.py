@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Tests for `tracing` module."""
+import threading
+import time
+
+from mock import patch
+
+from cadash import tracing
+from cadash.app import create_app
+from cadash.ldap import LdapClient
+from cadash.redunlive.poller import sync_all
+from cadash.settings import Config
+
+from tests.test_redunlive_poller import FakeClient
+from tests.test_redunlive_poller import make_ca
+
+
+def names(t):
+    return [(name, count, depth) for (name, count, total, depth) in t.totals()]
+
+
+class TestSpans(object):
+
+    def test_nested(self):
+        with tracing.trace('task') as t:
+            with tracing.span('outer'):
+                with tracing.span('inner'):
+                    pass
+                with tracing.span('inner'):
+                    pass
+            tracing.record('device_get_params', time.time(), 0.25)
+
+        assert names(t)[:2] == [('outer', 1, 0), ('inner', 2, 1)]
+        assert ('device_get_params', 1, 0) in names(t)
+        assert t.duration is not None
+        summary = t.summary()
+        assert summary.startswith('task ')
+        assert 'outer=' in summary
+        assert '.inner=' in summary and 'ms/2' in summary
+        assert 'device_get_params=250.0ms' in summary
+        assert tracing.current_trace() is None
+
+
+    def test_no_trace(self):
+        with tracing.span('outer'):
+            tracing.record('device_get_params', 0, 0.25)
+        assert tracing.current_trace() is None
+
+
+    def test_traced(self):
+        @tracing.traced('work')
+        def work(x):
+            return x * 2
+
+        with tracing.trace('task') as t:
+            assert work(2) == 4
+        assert names(t) == [('work', 1, 0)]
+
+
+    def test_wrap_in_other_thread(self):
+        def work():
+            with tracing.span('inner'):
+                pass
+
+        with tracing.trace('task') as t:
+            with tracing.span('outer'):
+                thread = threading.Thread(target=tracing.wrap(work))
+                thread.start()
+                thread.join()
+
+        assert names(t) == [('outer', 1, 0), ('inner', 1, 1)]
+
+
+    def test_device_calls(self):
+        cas = [make_ca(i, FakeClient()) for i in range(3)]
+        with tracing.trace('poll') as t:
+            with tracing.span('fleet_poll'):
+                assert sync_all(cas, max_workers=2, deadline=10) == []
+
+        assert names(t) == [('fleet_poll', 1, 0), ('device_get_params', 6, 1)]
+
+
+    def test_server_timing(self):
+        with tracing.trace('task') as t:
+            tracing.record('device_get_params', 0, 0.1)
+            tracing.record('device_get_params', 0, 0.2)
+        header = t.server_timing()
+        assert header.startswith('total;dur=')
+        assert 'device_get_params;dur=300.0;desc="2 calls"' in header
+
+
+    def test_ldap(self, app):
+        client = LdapClient()
+        client.init_app(app)
+        with patch('cadash.ldap.Connection'):
+            with tracing.trace('login') as t:
+                client.is_authenticated('user', 'passwd')
+        assert names(t) == [('ldap', 1, 0)]
+
+
+    def test_db(self, db):
+        with tracing.trace('query') as t:
+            db.session.execute('select 1')
+        assert names(t) == [('db', 1, 0)]
+
+
+class TestRequestTrace(object):
+
+    def test_server_timing_header(self, app, testapp):
+        res = testapp.get('/')
+        assert 'Server-Timing' not in res.headers
+
+        app.config['TRACING_SERVER_TIMING'] = True
+        res = testapp.get('/')
+        header = res.headers['Server-Timing']
+        assert header.startswith('total;dur=')
+        assert 'render;dur=' in header
+        assert tracing.current_trace() is None
+
+
+    def test_logged_when_slow(self, app, testapp):
+        app.config['TRACING_LOG_THRESHOLD'] = 0
+        with patch('cadash.tracing.logging.getLogger') as get_logger:
+            testapp.get('/')
+        message = get_logger.return_value.info.call_args[0][0]
+        assert message.startswith('timing GET / ')
+        assert 'render=' in message
+
+
+    def test_disabled(self):
+        config = Config(environment='test', login_disabled=True)
+        config.TRACING_ENABLED = False
+        config.TRACING_SERVER_TIMING = True
+        with patch.object(LdapClient, 'is_authenticated', return_value=True):
+            app = create_app(config)
+        res = app.test_client().get('/')
+        assert 'Server-Timing' not in res.headers
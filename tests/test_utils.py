@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Tests for `utils` module."""
+import os
+import shutil
+import tempfile
+
+import httpretty
+
+from cadash.utils import pull_data_cached
+from cadash.utils import stream_data_cached
+
+ca_stats_url = 'http://ca_stats_fake_url.com/ca_stats.json'
+
+
+class TestPullDataCached(object):
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmpdir, 'ca_stats.json')
+
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+    @httpretty.activate
+    def test_not_modified_serves_cached(self):
+        httpretty.register_uri(
+                httpretty.GET, ca_stats_url,
+                responses=[
+                    httpretty.Response(
+                        body='[{"a": 1}]', status=200,
+                        etag='"v1"', last_modified='Mon, 01 Aug 2016 00:00:00 GMT'),
+                    httpretty.Response(body='', status=304),
+                    ])
+
+        first = pull_data_cached(ca_stats_url, cache_file=self.cache_file)
+        assert first.text == '[{"a": 1}]'
+        assert first.modified
+        assert os.path.exists(self.cache_file)
+
+        second = pull_data_cached(ca_stats_url, cache_file=self.cache_file)
+        assert second.text == '[{"a": 1}]'
+        assert not second.modified
+        assert second.fetched_at == first.fetched_at
+
+        headers = httpretty.last_request().headers
+        assert headers['If-None-Match'] == '"v1"'
+        assert headers['If-Modified-Since'] == 'Mon, 01 Aug 2016 00:00:00 GMT'
+
+
+    @httpretty.activate
+    def test_modified_replaces_cached(self):
+        httpretty.register_uri(
+                httpretty.GET, ca_stats_url,
+                responses=[
+                    httpretty.Response(body='[1]', status=200, etag='"v1"'),
+                    httpretty.Response(body='[2]', status=200, etag='"v2"'),
+                    httpretty.Response(body='', status=304),
+                    ])
+
+        pull_data_cached(ca_stats_url, cache_file=self.cache_file)
+        second = pull_data_cached(ca_stats_url, cache_file=self.cache_file)
+        assert second.text == '[2]'
+        assert second.modified
+
+        third = pull_data_cached(ca_stats_url, cache_file=self.cache_file)
+        assert third.text == '[2]'
+        assert httpretty.last_request().headers['If-None-Match'] == '"v2"'
+
+
+    @httpretty.activate
+    def test_upstream_down_serves_cached(self):
+        httpretty.register_uri(
+                httpretty.GET, ca_stats_url,
+                responses=[
+                    httpretty.Response(body='[1]', status=200),
+                    httpretty.Response(body='oops', status=503),
+                    ])
+
+        first = pull_data_cached(ca_stats_url, cache_file=self.cache_file)
+        second = pull_data_cached(ca_stats_url, cache_file=self.cache_file)
+        assert second.text == '[1]'
+        assert not second.modified
+        assert second.fetched_at == first.fetched_at
+
+
+    @httpretty.activate
+    def test_upstream_down_nothing_cached(self):
+        httpretty.register_uri(
+                httpretty.GET, ca_stats_url, body='oops', status=503)
+
+        assert pull_data_cached(ca_stats_url, cache_file=self.cache_file) is None
+
+
+    @httpretty.activate
+    def test_cached_copy_from_other_url_ignored(self):
+        other_url = 'http://other_fake_url.com/ca_stats.json'
+        httpretty.register_uri(httpretty.GET, other_url, body='[1]', etag='"v1"')
+        httpretty.register_uri(httpretty.GET, ca_stats_url, body='[2]')
+
+        pull_data_cached(other_url, cache_file=self.cache_file)
+        result = pull_data_cached(ca_stats_url, cache_file=self.cache_file)
+        assert result.text == '[2]'
+        assert 'If-None-Match' not in httpretty.last_request().headers
+
+
+    @httpretty.activate
+    def test_no_cache_file(self):
+        httpretty.register_uri(httpretty.GET, ca_stats_url, body='[1]')
+
+        result = pull_data_cached(ca_stats_url)
+        assert result.text == '[1]'
+        assert result.modified
+
+
+    @httpretty.activate
+    def test_stream_cached_when_read(self):
+        httpretty.register_uri(
+                httpretty.GET, ca_stats_url, body=u'[1, "ñ", 3]', etag='"v1"')
+
+        with stream_data_cached(
+                ca_stats_url, cache_file=self.cache_file, chunk_size=2) as stream:
+            assert stream.modified
+            assert next(iter(stream)) == u'[1'
+        # not read to the end: not cached, no temp files left
+        assert os.listdir(self.tmpdir) == []
+
+        with stream_data_cached(
+                ca_stats_url, cache_file=self.cache_file, chunk_size=2) as stream:
+            chunks = list(stream)
+        assert len(chunks) > 1
+        assert u''.join(chunks) == u'[1, "ñ", 3]'
+        assert sorted(os.listdir(self.tmpdir)) == ['ca_stats.json', 'ca_stats.json.meta']